@@ -0,0 +1,213 @@
+import asyncio
+import functools
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web  # устанавливается вместе с pyTelegramBotAPI[async]
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from bot_message import *
+import media_converter
+import metrics
+from bot_base import BotBase
+from send_queue import AsyncSendQueue
+from webhook import parse_update
+from keyed_executor import AsyncKeyedLocks
+from scenario_watcher import ScenarioWatcher
+
+
+class AsyncBot(BotBase):
+    """Telegram-бот с игрой на asyncio.
+
+    Работает по тому же сценарию (графу постов и переходов), что и bot.Bot, но все обновления
+    обрабатываются в одном потоке событийного цикла: ожидание ответов Telegram не занимает
+    потоков, поэтому бот выдерживает тысячи одновременно играющих игроков. Блокирующая работа
+    (распознавание голосовых сообщений через ffmpeg, чтение и запись кэша файлов) выполняется
+    в пуле потоков.
+    """
+    EXECUTOR_WORKERS = 8  # количество потоков для блокирующей работы
+
+    def __init__(self, token, start_post, media_cache_path=None, webhook_port=None,
+                 webhook_url=None, webhook_secret=None, sessions_path=None, scenario_path=None,
+                 res_path=None, send_limits=None):
+        """Создаёт Telegram-бота и запускает событийный цикл (параметры - как у bot.Bot)."""
+        super().__init__(token, start_post, media_cache_path, sessions_path)
+        self.tgbot = AsyncTeleBot(token)
+        self.send_limits = send_limits or {}  # очередь отправки создаётся в событийном цикле
+        self.executor = ThreadPoolExecutor(self.EXECUTOR_WORKERS)
+        self.player_locks = AsyncKeyedLocks()  # обновления одного игрока обрабатываются по очереди
+        self.webhook_tasks = set()  # задачи обработки обновлений, полученных через webhook
+
+        @self.tgbot.message_handler(commands=['start'])
+        @self.per_player
+        async def register_new_user(message):
+            """Записывает нового игрока в таблицу при нажатии им кнопки "Старт"."""
+            self.start_game(message)
+
+        @self.tgbot.message_handler(content_types=['text'])
+        @self.per_player
+        async def handle_text(message):
+            """Обрабатывает текстовые сообщения от игрока."""
+            self.answer(message.from_user.id, message, message.text)
+
+        @self.tgbot.message_handler(content_types=['voice'])
+        @self.per_player
+        async def handle_voice(message):
+            """Обрабатывает голосовые сообщения от игрока."""
+            if self.sessions.get_post(message.from_user.id) is None:
+                # игрок ещё не начал игру (не нажал на "Старт")
+                return
+            file_info = await self.tgbot.get_file(message.voice.file_id)
+            downloaded_file = await self.tgbot.download_file(file_info.file_path)
+            if metrics.enabled:
+                start = time.perf_counter()
+            text = await self.run_blocking(media_converter.MediaConverter().voiceDataToText,
+                                           downloaded_file)
+            if metrics.enabled:
+                metrics.VOICE_SECONDS.observe(time.perf_counter() - start)
+            self.send_recognized(message.chat.id, text)
+            self.answer(message.from_user.id, message, text)
+
+        @self.tgbot.callback_query_handler(func=lambda call: True)
+        @self.per_player
+        async def handle_buttons(call):
+            """Обрабатывает нажатия на кнопки."""
+            self.answer(call.from_user.id, call.message, call.data, call.message.id)
+            await self.tgbot.answer_callback_query(call.id)
+
+        asyncio.run(self.run(webhook_port, webhook_url, webhook_secret, scenario_path, res_path))
+
+    async def run(self, webhook_port=None, webhook_url=None, webhook_secret=None, scenario_path=None,
+                  res_path=None):
+        """Принимает обновления через long polling или webhook, пока бот не будет остановлен."""
+        self.send_queue = AsyncSendQueue(**self.send_limits)
+        watcher = None
+        if scenario_path is not None:
+            # сценарий загружается в потоке наблюдателя, а переключается в событийном цикле
+            loop = asyncio.get_running_loop()
+            watcher = ScenarioWatcher(scenario_path, res_path,
+                                      lambda *scenario: loop.call_soon_threadsafe(self.reload, *scenario))
+        try:
+            if webhook_port is None:
+                await self.tgbot.infinity_polling()  # начинаем слушать бота
+            else:
+                await self.run_webhook(webhook_port, webhook_url, webhook_secret)
+        finally:
+            if watcher is not None:
+                watcher.stop()
+            await self.send_queue.join()
+            await self.tgbot.close_session()
+            self.executor.shutdown()
+            self.sessions.close()
+
+    async def run_webhook(self, port, url=None, secret=None):
+        """Принимает обновления через webhook (см. bot.Bot.run_webhook)."""
+        if url is not None:
+            if secret is None:
+                secret = secrets.token_urlsafe(32)
+            await self.tgbot.set_webhook(url=url, secret_token=secret)
+        if not secret:
+            raise Exception('Для режима webhook нужен секретный токен.')
+        secret = secret.encode('utf-8')
+
+        async def handle(request):
+            status, update = parse_update(request.headers, await request.read(), secret)
+            if update is not None:
+                # обновление обрабатывается отдельной задачей, Telegram получает ответ сразу
+                task = asyncio.create_task(self.tgbot.process_new_updates([update]))
+                self.webhook_tasks.add(task)
+                task.add_done_callback(self.webhook_tasks.discard)
+            return web.Response(status=status)
+
+        app = web.Application()
+        app.router.add_post('/', handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '0.0.0.0', port).start()
+        print(f'Бот принимает обновления через webhook на порту {port}.')
+        try:
+            await asyncio.Event().wait()  # работаем, пока задачу не отменят
+        finally:
+            await runner.cleanup()
+
+    def per_player(self, handler):
+        """Декоратор обработчика: обновления игрока обрабатываются строго в порядке получения
+        (следующее ждёт, пока предыдущее, например распознавание голоса, не завершится),
+        обновления разных игроков - параллельно."""
+        @functools.wraps(handler)
+        async def wrapper(update):
+            async with self.player_locks(update.from_user.id):
+                if not metrics.enabled:
+                    await handler(update)
+                    return
+                start = time.perf_counter()
+                try:
+                    await handler(update)
+                finally:
+                    metrics.UPDATE_SECONDS.observe(time.perf_counter() - start, handler.__name__)
+        return wrapper
+
+    def run_blocking(self, function, *args):
+        """Выполняет блокирующую функцию в пуле потоков и возвращает awaitable с результатом."""
+        return asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def send_file(self, chat_id, post):
+        """Отправляет пост с файлом, по возможности используя file_id из кэша (см. bot.Bot.send_file)."""
+        method, kwargs = self.get_file_request(post)
+        send_method = getattr(self.tgbot, method)
+        file_id = await self.run_blocking(self.get_cached_file_id, post)
+        if file_id is not None:
+            try:
+                return await send_method(chat_id, file_id, timeout=self.TIMEOUT, **kwargs)
+            except ApiTelegramException as e:
+                if e.error_code != 400:
+                    raise
+                # Telegram не принял сохранённый file_id - загружаем файл заново
+                await self.run_blocking(self.forget_file_ids, [post])
+        with open(post.content, 'rb') as content:
+            sent = await send_method(chat_id, content, timeout=self.TIMEOUT, **kwargs)
+        await self.run_blocking(self.remember_file_ids, [post], [sent])
+        return sent
+
+    async def send_group(self, chat_id, group_post, use_cache=True):
+        """Отправляет сгруппированный пост и возвращает список отправленных сообщений
+        (см. bot.Bot.send_group)."""
+        file_ids = [None] * len(group_post.content)
+        if use_cache:
+            file_ids = await self.run_blocking(self.get_cached_file_ids, group_post)
+        posts, medias, opened_files, from_cache = self.make_group(group_post, file_ids)
+        try:
+            sent = await self.tgbot.send_media_group(chat_id, medias, timeout=self.TIMEOUT)
+        except ApiTelegramException as e:
+            if not from_cache or e.error_code != 400:
+                raise
+            # Telegram не принял сохранённые file_id - загружаем все файлы группы заново
+            await self.run_blocking(self.forget_file_ids, posts)
+            return await self.send_group(chat_id, group_post, use_cache=False)
+        finally:
+            for file in opened_files:
+                file.close()
+        await self.run_blocking(self.remember_file_ids, posts, sent)
+        return sent
+
+    async def send_post(self, chat_id, new_post):
+        """Отправляет пост в чат и возвращает отправленное сообщение (вызывается очередью отправки).
+
+        Параметры:
+        chat_id - идентификатор чата
+        new_post - пост для отправки (тип bot_message.Post)
+        """
+        start = time.perf_counter()
+        message = self.get_message_request(new_post)
+        if message is not None:
+            text, kwargs = message
+            sent = await self.tgbot.send_message(chat_id, text, timeout=self.TIMEOUT, **kwargs)
+        elif type(new_post) in self.FILE_METHODS:
+            sent = await self.send_file(chat_id, new_post)
+        elif isinstance(new_post, GroupPost):
+            sent = (await self.send_group(chat_id, new_post))[-1]
+        else:
+            sent = None
+            print('Неизвестный тип сообщений.')
+        self.observe_send(new_post, start)
+        return sent
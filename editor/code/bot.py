@@ -1,5 +1,5 @@
 import telebot  # pip install pyTelegramBotAPI
-from telebot import types
+from telebot.apihelper import ApiTelegramException
 from bot_message import *
 # from config import TOKEN
 import media_converter
@@ -7,187 +7,207 @@ import pickle
 import sys
 from code_analyzer import CodeAnalyzer
 import parser
+from bot_base import BotBase
+from send_queue import SendQueue
+from webhook import WebhookServer
+from keyed_executor import KeyedExecutor
+from scenario_watcher import ScenarioWatcher
+import functools
+import secrets
+import time
+import metrics
 
-class Bot:
+class Bot(BotBase):
     """Класс Telegram-бота с игрой."""
-    def __init__(self, token, start_post):
+    def __init__(self, token, start_post, media_cache_path=None, webhook_port=None,
+                 webhook_url=None, webhook_secret=None, sessions_path=None,
+                 update_queue=None, shards=1, scenario_path=None, res_path=None, send_limits=None):
         """Создаёт Telegram-бота с указанным токеном и сценарием.
 
         Параметры:
         token - токен бота
         start_post - первый пост игры
+        media_cache_path - путь до файла с кэшем file_id загруженных в Telegram файлов
+        webhook_port - если указан, бот получает обновления через webhook на этом порту,
+                       иначе - через long polling
+        webhook_url - внешний адрес webhook; если указан, webhook устанавливается в Telegram
+                      (если нет - считается, что он уже установлен, например, балансировщиком)
+        webhook_secret - секретный токен webhook (если не указан, создаётся случайный)
+        sessions_path - путь до базы сессий игроков (если None, сессии хранятся только в памяти)
+        update_queue - если указана, бот получает обновления из этой очереди (рабочий процесс
+                       supervisor.Supervisor), а не от Telegram
+        shards - количество процессов бота (ограничение Telegram на частоту отправки делится
+                 между ними поровну)
+        scenario_path - путь до файла со скомпилированным сценарием; если указан, после
+                        пересборки проекта бот переключается на новый сценарий без перезапуска
+        res_path - путь до папки с ресурсами проекта (нужен вместе с scenario_path)
+        send_limits - ограничения частоты отправки вместо ограничений Telegram (словарь
+                      параметров send_queue.RateLimits, например, для нагрузочного тестирования)
         """
-        self.token = token
-        self.tgbot = telebot.TeleBot(token)
-        self.user_table = []  # таблица с записями вида "userid - post - last_message_id"
-        self.start_post = start_post
+        super().__init__(token, start_post, media_cache_path, sessions_path)
+        # обработчики вызываются в потоке получения обновлений и сразу передаются в self.executor
+        self.tgbot = telebot.TeleBot(token, threaded=False)
+        self.executor = KeyedExecutor()  # обновления одного игрока обрабатываются по очереди
+        self.send_queue = SendQueue(**(send_limits or {'global_rate': SendQueue.GLOBAL_RATE / shards}))
 
         @self.tgbot.message_handler(commands=['start'])
+        @self.per_player
         def register_new_user(message):
             """Записывает нового игрока в таблицу при нажатии им кнопки "Старт"."""
-            if any([user_id == message.from_user.id for user_id, _, _ in self.user_table]):
-                return  # данный игрок уже начал игру
-            # делаем запись о новом игроке
-            self.user_table.append((message.from_user.id, self.start_post, message.id))
-            print(f'Пользователь {message.from_user.id} начал игру.')
-            post = self.start_post
-            self.send(message, post)  # отправляем первое сообщение
-            while True:
-                post = post.get_next(message.text)
-                if post is None:
-                    break
-                self.send(received=message, new_post=post)
-                message.text = None
-
+            self.start_game(message)
 
         @self.tgbot.message_handler(content_types=['text'])
+        @self.per_player
         def handle_text(message):
             """Обрабатывает текстовые сообщения от игрока."""
-            post = None
-            for user_id, last_post, _ in self.user_table:
-                if user_id == message.from_user.id:
-                    post = last_post
-                    break
-            if post is None:
-                # игрок ещё не начал игру (не нажал на "Старт")
-                return
-            while True:
-                post = post.get_next(message.text)  # получаем новые сообщения для отправки
-                if post is None:
-                    # сообщения кончились либо ожидается ответ от пользователя
-                    break
-                self.send(received=message, new_post=post)
-                message.text = None
+            self.answer(message.from_user.id, message, message.text)
 
         @self.tgbot.message_handler(content_types=['voice'])
+        @self.per_player
         def handle_voice(message):
             """Обрабатывает голосовые сообщения от игрока."""
-            post = None
-            for user_id, last_post, _ in self.user_table:
-                if user_id == message.from_user.id:
-                    post = last_post
-                    break
-            if post is None:
+            if self.sessions.get_post(message.from_user.id) is None:
                 # игрок ещё не начал игру (не нажал на "Старт")
                 return
             file_info = self.tgbot.get_file(message.voice.file_id)
             downloaded_file = self.tgbot.download_file(file_info.file_path)
-            audio_ogg = str(message.chat.id) + '.ogg'
-            with open(audio_ogg, 'wb') as f:
-                f.write(downloaded_file)
             mc = media_converter.MediaConverter()
-            text = mc.voiceToText(audio_ogg)
-            if text == mc.UNKNOWN:
-                self.tgbot.send_message(message.chat.id, '🙁 Извините, я не понял, что вы сказали', timeout=self.TIMEOUT)
-            else:
-                self.tgbot.send_message(message.chat.id, f'😊 Кажется, вы сказали: {text}', timeout=self.TIMEOUT)
-            while True:
-                post = post.get_next(text)  # получаем новые сообщения для отправки
-                if post is None:
-                    # сообщения кончились либо ожидается ответ от пользователя
-                    break
-                self.send(received=message, new_post=post)
-                text = None
+            if metrics.enabled:
+                start = time.perf_counter()
+            text = mc.voiceDataToText(downloaded_file)
+            if metrics.enabled:
+                metrics.VOICE_SECONDS.observe(time.perf_counter() - start)
+            self.send_recognized(message.chat.id, text)
+            self.answer(message.from_user.id, message, text)
 
         @self.tgbot.callback_query_handler(func=lambda call: True)
+        @self.per_player
         def handle_buttons(call):
             """Обрабатывает нажатия на кнопки."""
             self.tgbot.answer_callback_query(call.id)
-            post = None
-            for user_id, last_post, last_message_id in self.user_table:
-                if user_id == call.from_user.id and last_message_id == call.message.id:
-                    post = last_post
-                    break
-            if post is None:
-                # игрок ещё не начал игру (не нажал на "Старт") или нажал на старые кнопки
-                return
-            while True:
-                post = post.get_next(call.data)  # получаем новые сообщения для отправки
-                if post is None:
-                    # сообщения кончились либо ожидается ответ от пользователя
-                    break
-                self.send(received=call.message, new_post=post)
-                call.data = None
+            self.answer(call.from_user.id, call.message, call.data, call.message.id)
+
+        watcher = None
+        if scenario_path is not None:
+            watcher = ScenarioWatcher(scenario_path, res_path, self.reload)
+        try:
+            if update_queue is not None:
+                self.run_queue(update_queue)
+            elif webhook_port is None:
+                self.tgbot.infinity_polling()  # начинаем слушать бота
+            else:
+                self.run_webhook(webhook_port, webhook_url, webhook_secret)
+        finally:
+            if watcher is not None:
+                watcher.stop()
+            self.sessions.close()
+
+    def per_player(self, handler):
+        """Декоратор обработчика: обновления игрока выполняются в пуле потоков строго в порядке
+        получения, обновления разных игроков - параллельно."""
+        @functools.wraps(handler)
+        def wrapper(update):
+            self.executor.submit(update.from_user.id, self.timed, handler, update)
+        return wrapper
+
+    def timed(self, handler, update):
+        """Вызывает обработчик обновления, замеряя время его работы (если метрики включены)."""
+        if not metrics.enabled:
+            return handler(update)
+        start = time.perf_counter()
+        try:
+            return handler(update)
+        finally:
+            metrics.UPDATE_SECONDS.observe(time.perf_counter() - start, handler.__name__)
+
+    def run_queue(self, update_queue):
+        """Обрабатывает обновления из очереди, пока не будет получен None."""
+        while True:
+            update = update_queue.get()
+            if update is None:
+                break
+            self.tgbot.process_new_updates([update])
+        self.executor.shutdown()  # дожидаемся обработки полученных обновлений
+        self.send_queue.join(self.TIMEOUT)
 
-        self.tgbot.infinity_polling()  # начинаем слушать бота
+    def run_webhook(self, port, url=None, secret=None):
+        """Принимает обновления через webhook (см. webhook.WebhookServer)."""
+        if url is not None:
+            if secret is None:
+                secret = secrets.token_urlsafe(32)
+            self.tgbot.set_webhook(url=url, secret_token=secret)
+        server = WebhookServer(self.tgbot, secret, port=port)
+        print(f'Бот принимает обновления через webhook на порту {port}.')
+        server.serve_forever()
 
-    TIMEOUT = 45
-    def send(self, received, new_post):
-        """Отправляет пост в чат.
+    def send_file(self, chat_id, post):
+        """Отправляет пост с файлом, по возможности используя file_id из кэша вместо
+        повторной загрузки.
 
         Параметры:
-        received - полученнное сообщение (тип telebot.Message)
+        chat_id - идентификатор чата
+        post - пост для отправки (класс из BotBase.FILE_METHODS)
+        """
+        method, kwargs = self.get_file_request(post)
+        send_method = getattr(self.tgbot, method)
+        file_id = self.get_cached_file_id(post)
+        if file_id is not None:
+            try:
+                return send_method(chat_id, file_id, timeout=self.TIMEOUT, **kwargs)
+            except ApiTelegramException as e:
+                if e.error_code != 400:
+                    raise
+                # Telegram не принял сохранённый file_id - загружаем файл заново
+                self.forget_file_ids([post])
+        with open(post.content, 'rb') as content:
+            sent = send_method(chat_id, content, timeout=self.TIMEOUT, **kwargs)
+        self.remember_file_ids([post], [sent])
+        return sent
+
+    def send_group(self, chat_id, group_post, use_cache=True):
+        """Отправляет сгруппированный пост и возвращает список отправленных сообщений.
+
+        Параметры:
+        chat_id - идентификатор чата
+        group_post - пост для отправки (тип bot_message.GroupPost)
+        use_cache - если True, файлы, уже загруженные в Telegram, отправляются по file_id
+        """
+        file_ids = [None] * len(group_post.content)
+        if use_cache:
+            file_ids = self.get_cached_file_ids(group_post)
+        posts, medias, opened_files, from_cache = self.make_group(group_post, file_ids)
+        try:
+            sent = self.tgbot.send_media_group(chat_id, medias, timeout=self.TIMEOUT)
+        except ApiTelegramException as e:
+            if not from_cache or e.error_code != 400:
+                raise
+            # Telegram не принял сохранённые file_id - загружаем все файлы группы заново
+            self.forget_file_ids(posts)
+            return self.send_group(chat_id, group_post, use_cache=False)
+        finally:
+            for file in opened_files:
+                file.close()
+        self.remember_file_ids(posts, sent)
+        return sent
+
+    def send_post(self, chat_id, new_post):
+        """Отправляет пост в чат и возвращает отправленное сообщение (вызывается очередью отправки).
+
+        Параметры:
+        chat_id - идентификатор чата
         new_post - пост для отправки (тип bot_message.Post)
         """
-        if isinstance(new_post, TextPost):
-            sent = self.tgbot.send_message(received.chat.id, new_post.content, timeout=self.TIMEOUT)
-        elif isinstance(new_post, ImagePost):
-            with open(new_post.content, 'rb') as content:
-                sent = self.tgbot.send_photo(received.chat.id, content, timeout=self.TIMEOUT)
-        elif isinstance(new_post, VideoPost):
-            with open(new_post.content, 'rb') as content:
-                sent = self.tgbot.send_video(received.chat.id, content, timeout=self.TIMEOUT)
-        elif isinstance(new_post, VoicePost):
-            with open(new_post.content, 'rb') as content:
-                sent = self.tgbot.send_voice(received.chat.id, content, timeout=self.TIMEOUT)
-        elif isinstance(new_post, GifPost):
-            with open(new_post.content, 'rb') as content:
-                sent = self.tgbot.send_animation(received.chat.id, content, timeout=self.TIMEOUT)
-        elif isinstance(new_post, RoundPost):
-            with open(new_post.content, 'rb') as content:
-                sent = self.tgbot.send_video_note(received.chat.id, content,
-                                                  length=new_post.width, timeout=self.TIMEOUT)
-        elif isinstance(new_post, DocPost):
-            with open(new_post.content, 'rb') as content:
-                sent = self.tgbot.send_document(received.chat.id, content, timeout=self.TIMEOUT)
-        elif isinstance(new_post, AudioPost):
-            with open(new_post.content, 'rb') as content:
-                sent = self.tgbot.send_audio(received.chat.id, content, timeout=self.TIMEOUT)
-        elif isinstance(new_post, StickerPost):
-            with open(new_post.content, 'rb') as content:
-                sent = self.tgbot.send_sticker(received.chat.id, content, timeout=self.TIMEOUT)
-        elif isinstance(new_post, ButtonsPost):
-            markup_inline = types.InlineKeyboardMarkup()
-            for button in new_post.content:
-                new_item = types.InlineKeyboardButton(text=button.text,
-                                                      callback_data=button.callback_data)
-                markup_inline.add(new_item)
-            sent = self.tgbot.send_message(received.chat.id, new_post.caption,
-                                           reply_markup=markup_inline, timeout=self.TIMEOUT)
+        start = time.perf_counter()
+        message = self.get_message_request(new_post)
+        if message is not None:
+            text, kwargs = message
+            sent = self.tgbot.send_message(chat_id, text, timeout=self.TIMEOUT, **kwargs)
+        elif type(new_post) in self.FILE_METHODS:
+            sent = self.send_file(chat_id, new_post)
         elif isinstance(new_post, GroupPost):
-            if not new_post.content:  # сгруппированное сообщение содержит только текст
-                sent = self.tgbot.send_message(received.chat.id, new_post.caption, timeout=self.TIMEOUT)
-            else:
-                medias = []
-                opened_files = []
-                for post in new_post.content:
-                    content = open(post.content, 'rb')
-                    if isinstance(post, DocPost):
-                        medias = [types.InputMediaDocument(content)]
-                        break
-                    elif isinstance(post, AudioPost):
-                        medias= [types.InputMediaAudio(content)]
-                        break
-                    elif isinstance(post, ImagePost):
-                        medias.append(types.InputMediaPhoto(content))
-                    elif isinstance(post, VideoPost):
-                        medias.append(types.InputMediaVideo(content))
-                    opened_files.append(content)
-                medias[0].caption = new_post.caption
-                sent = self.tgbot.send_media_group(received.chat.id, medias, timeout=self.TIMEOUT)[-1]
-                for file in opened_files:
-                    file.close()
+            sent = self.send_group(chat_id, new_post)[-1]
         else:
             sent = None
             print('Неизвестный тип сообщений.')
-        # сохраняем id последнего отправленного сообщения для конкретного пользователя и новый пост
-        for i, (user_id, last_post, last_message_id) in enumerate(self.user_table):
-            if user_id == received.chat.id:
-                self.user_table[i] = (user_id, new_post, sent.id)
-                break
-        if new_post.is_endpoint():
-            # отправлено последнее сообщение игры, игрок может начать заново
-            for i in range(len(self.user_table)):
-                if self.user_table[i][0] == received.chat.id:
-                    print(f'Пользователь {self.user_table[i][0]} прошёл игру.')
-                    del self.user_table[i]
+        self.observe_send(new_post, start)
+        return sent
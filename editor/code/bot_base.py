@@ -0,0 +1,237 @@
+import functools
+import time
+from telebot import types
+from bot_message import *
+import media_converter
+import metrics
+import sessions
+from media_cache import MediaCache
+
+
+class BotBase:
+    """Общая часть bot.Bot и async_bot.AsyncBot: сессии игроков, переходы по сценарию,
+    очередь отправки и подготовка постов к отправке.
+
+    Наследники выполняют только вызовы Bot API (синхронно или в событийном цикле asyncio)
+    и создают self.tgbot и self.send_queue.
+    """
+    TIMEOUT = 45
+    # методы Bot API для отправки постов с файлом
+    FILE_METHODS = {ImagePost: 'send_photo', VideoPost: 'send_video', VoicePost: 'send_voice',
+                    GifPost: 'send_animation', RoundPost: 'send_video_note', DocPost: 'send_document',
+                    AudioPost: 'send_audio', StickerPost: 'send_sticker'}
+
+    def __init__(self, token, start_post, media_cache_path=None, sessions_path=None):
+        """Параметры - как у bot.Bot."""
+        self.token = token
+        self.media_cache = MediaCache(media_cache_path)  # кэш file_id отправленных файлов
+        # сессии игроков вида "userid - post - last_message_id"
+        self.sessions = sessions.open_store(sessions_path, start_post)
+        self.start_post = start_post
+        self.tgbot = None
+        self.send_queue = None  # очередь исходящих сообщений
+        metrics.ACTIVE_SESSIONS.set_function(self.sessions.__len__)
+
+    def reload(self, token, start_post):
+        """Переключает бота на новую версию сценария; игроки продолжают игру с тех же постов
+        (см. sessions.SessionStore.set_scenario)."""
+        if token != self.token:
+            print('Токен бота изменился - чтобы применить новый токен, перезапустите бота.')
+        self.sessions.set_scenario(start_post)
+        self.start_post = start_post
+        print('=== СЦЕНАРИЙ ОБНОВЛЁН ===')
+
+    def get_next(self, post, received):
+        """Возвращает следующий пост (см. bot_message.Post.get_next), замеряя время поиска."""
+        if not metrics.enabled:
+            return post.get_next(received)
+        start = time.perf_counter()
+        next_post = post.get_next(received)
+        metrics.GET_NEXT_SECONDS.observe(time.perf_counter() - start)
+        return next_post
+
+    def send_next(self, received, post, answer):
+        """Ставит в очередь отправки посты, следующие за post после ответа игрока answer.
+
+        Выполняется без ожиданий, поэтому переходы по сценарию одного обновления
+        не перемешиваются с другими обновлениями.
+        """
+        while True:
+            post = self.get_next(post, answer)  # получаем новые сообщения для отправки
+            if post is None:
+                # сообщения кончились либо ожидается ответ от пользователя
+                break
+            self.send(received=received, new_post=post)
+            answer = None
+
+    def start_game(self, message):
+        """Записывает нового игрока в таблицу при нажатии им кнопки "Старт"."""
+        if message.from_user.id in self.sessions:
+            return  # данный игрок уже начал игру
+        # делаем запись о новом игроке
+        self.sessions.set(message.from_user.id, self.start_post, message.id)
+        print(f'Пользователь {message.from_user.id} начал игру.')
+        metrics.GAMES.inc('started')
+        self.send(message, self.start_post)  # отправляем первое сообщение
+        self.send_next(message, self.start_post, message.text)
+
+    def answer(self, user_id, received, answer, message_id=None):
+        """Продолжает игру после ответа игрока (текстом, голосом или кнопкой).
+
+        Параметры:
+        user_id - идентификатор игрока
+        received - сообщение, в чат которого отправляются следующие посты
+        answer - ответ игрока
+        message_id - идентификатор сообщения с нажатой кнопкой (см. SessionStore.get_post)
+        """
+        post = self.sessions.get_post(user_id, message_id)
+        if post is None:
+            # игрок ещё не начал игру (не нажал на "Старт") или нажал на старые кнопки
+            return
+        self.send_next(received, post, answer)
+
+    def send_recognized(self, chat_id, text):
+        """Сообщает игроку, как распознано его голосовое сообщение."""
+        if text == media_converter.MediaConverter.UNKNOWN:
+            self.send_text(chat_id, '🙁 Извините, я не понял, что вы сказали')
+        else:
+            self.send_text(chat_id, f'😊 Кажется, вы сказали: {text}')
+
+    def send_text(self, chat_id, text):
+        """Ставит в очередь отправки служебное текстовое сообщение."""
+        self.send_queue.put(chat_id, functools.partial(self.tgbot.send_message, chat_id, text,
+                                                       timeout=self.TIMEOUT))
+
+    def send(self, received, new_post):
+        """Ставит пост в очередь отправки в чат.
+
+        Пост сессии игрока обновляется сразу, а идентификатор последнего сообщения -
+        после отправки (см. on_sent).
+
+        Параметры:
+        received - полученнное сообщение (тип telebot.Message)
+        new_post - пост для отправки (тип bot_message.Post)
+        """
+        chat_id = received.chat.id
+        # сессия игрока, получающего последний пост игры, удаляется после его отправки (см. on_sent)
+        self.sessions.update(chat_id, new_post, None)
+        cost = 1
+        if isinstance(new_post, GroupPost) and new_post.content:
+            cost = len(new_post.content)  # группа файлов считается как несколько сообщений
+        self.send_queue.put(chat_id, functools.partial(self.send_post, chat_id, new_post),
+                            callback=functools.partial(self.on_sent, chat_id, new_post), cost=cost)
+
+    def on_sent(self, chat_id, post, sent, error=None):
+        """Вызывается очередью отправки после отправки поста post игроку (или неудачи).
+
+        После отправки запоминает id последнего отправленного игроку сообщения, а после
+        отправки последнего поста игры завершает игру. Если пост отправить не удалось,
+        а игрок всё ещё на нём, продолжить игру он не сможет (кнопки не отправлены, id
+        сообщения неизвестен) - игра сбрасывается, чтобы её можно было начать заново.
+        """
+        if error is not None:
+            if self.sessions.remove_at(chat_id, post):
+                print(f'Игра пользователя {chat_id} сброшена: не удалось отправить сообщение.')
+                self.send_text(chat_id, '😔 Не удалось отправить сообщение. '
+                                        'Чтобы начать игру заново, нажмите /start')
+        elif post.is_endpoint():
+            # последнее сообщение игры доставлено, игрок может начать заново
+            if self.sessions.remove_at(chat_id, post):
+                print(f'Пользователь {chat_id} прошёл игру.')
+                metrics.GAMES.inc('finished')
+        elif sent is not None:
+            self.sessions.set_message_id(chat_id, post, sent.id)
+
+    def get_message_request(self, post):
+        """Возвращает кортеж (текст, параметры_send_message) для поста, который отправляется
+        текстовым сообщением, или None."""
+        if isinstance(post, TextPost):
+            return post.content, {}
+        if isinstance(post, ButtonsPost):
+            markup_inline = types.InlineKeyboardMarkup()
+            for button in post.content:
+                new_item = types.InlineKeyboardButton(text=button.text,
+                                                      callback_data=button.callback_data)
+                markup_inline.add(new_item)
+            return post.caption, {'reply_markup': markup_inline}
+        if isinstance(post, GroupPost) and not post.content:
+            return post.caption, {}  # сгруппированное сообщение содержит только текст
+        return None
+
+    def get_file_request(self, post):
+        """Возвращает кортеж (метод_Bot_API, параметры) для поста с файлом или None."""
+        method = self.FILE_METHODS.get(type(post))
+        if method is None:
+            return None
+        if isinstance(post, RoundPost):
+            return method, {'length': post.width}
+        return method, {}
+
+    def get_cached_file_id(self, post):
+        """Возвращает file_id файла поста из кэша или None (file_id хранятся отдельно для
+        каждого класса поста, т.к. зависят от способа отправки)."""
+        return self.media_cache.get(type(post).__name__, post.content)
+
+    def get_cached_file_ids(self, group_post):
+        """Возвращает список file_id из кэша (или None) для файлов сгруппированного поста."""
+        return [self.get_cached_file_id(post) for post in group_post.content]
+
+    def make_group(self, group_post, file_ids):
+        """Собирает файлы сгруппированного поста для send_media_group.
+
+        Возвращает кортеж (посты, медиа, открытые_файлы, из_кэша): посты, файлы которых
+        отправляются, список telebot.types.InputMedia*, файлы, которые нужно закрыть после
+        отправки, и признак того, что часть файлов отправляется по file_id из кэша.
+
+        Параметры:
+        group_post - пост для отправки (тип bot_message.GroupPost)
+        file_ids - file_id файлов поста из кэша (None - файл загружается заново)
+        """
+        posts = []
+        medias = []
+        opened_files = []
+        from_cache = False
+        for post, content in zip(group_post.content, file_ids):
+            if content is None:
+                content = open(post.content, 'rb')
+                opened_files.append(content)
+            else:
+                from_cache = True
+            if isinstance(post, DocPost):
+                posts, medias = [post], [types.InputMediaDocument(content)]
+                break
+            elif isinstance(post, AudioPost):
+                posts, medias = [post], [types.InputMediaAudio(content)]
+                break
+            elif isinstance(post, ImagePost):
+                medias.append(types.InputMediaPhoto(content))
+            elif isinstance(post, VideoPost):
+                medias.append(types.InputMediaVideo(content))
+            posts.append(post)
+        medias[0].caption = group_post.caption
+        return posts, medias, opened_files, from_cache
+
+    def remember_file_ids(self, posts, messages):
+        """Запоминает file_id файлов постов posts, отправленных сообщениями messages.
+
+        Вызывается после успешной отправки, поэтому ошибка записи кэша только выводится:
+        исключение заставило бы очередь отправить сообщение повторно.
+        """
+        try:
+            for post, message in zip(posts, messages):
+                self.media_cache.put(type(post).__name__, post.content, MediaCache.get_file_id(message))
+        except OSError as e:
+            print(f'Не удалось сохранить кэш файлов: {e}')
+
+    def forget_file_ids(self, posts):
+        """Забывает file_id файлов постов posts (Telegram их не принял)."""
+        try:
+            for post in posts:
+                self.media_cache.remove(type(post).__name__, post.content)
+        except OSError as e:
+            print(f'Не удалось сохранить кэш файлов: {e}')
+
+    def observe_send(self, post, start):
+        """Замеряет время отправки поста post, начатой в момент start (time.perf_counter)."""
+        if metrics.enabled:
+            metrics.SEND_SECONDS.observe(time.perf_counter() - start, type(post).__name__)
@@ -1,9 +1,11 @@
 from abc import ABC, abstractmethod
+import hashlib
 import random
 import string
 import media_converter
 import os
 import morpheme
+from keyword_matcher import KeywordMatcher
 
 class Transition:
     SEND_IMMEDIATELY = '0'  # константа: отправить следующий пост сразу за текущим
@@ -14,7 +16,28 @@ class Transition:
         self.next_post = next_post
         self.requiered_callback = requiered_callback
         self.is_keyword = is_keyword
-        self.morph = morpheme.StringsAnalyser()  # анализатор для поиска ключевых слов в строке
+        self.forms = None  # заранее вычисленные формы ключевого слова (см. precompute_forms)
+
+    def precompute_forms(self):
+        """Заранее вычисляет формы требуемой строки, чтобы не склонять её при каждом сообщении."""
+        if self.requiered_callback != self.SEND_IMMEDIATELY:
+            self.forms = self.morph.get_required_forms(self.requiered_callback, self.is_keyword)
+
+    @property
+    def morph(self):
+        """Анализатор для поиска ключевых слов в строке (общий для всех переходов)."""
+        return morpheme.SHARED_ANALYSER
+
+    def __getstate__(self):
+        # анализатор не сериализуется - после загрузки используется общий экземпляр
+        state = self.__dict__.copy()
+        state.pop('morph', None)
+        return state
+
+    def __setstate__(self, state):
+        state.pop('morph', None)  # анализатор из файлов, собранных старыми версиями
+        state.setdefault('forms', None)
+        self.__dict__.update(state)
 
     def __call__(self, received):
         if self.requiered_callback == self.SEND_IMMEDIATELY:
@@ -23,7 +46,7 @@ class Transition:
         if received is None:
             # ответа от игрока не получено - ничего не возвращаем
             return None
-        if self.morph.check(received, self.requiered_callback, self.is_keyword):
+        if self.morph.check(received, self.requiered_callback, self.is_keyword, self.forms):
             return self.next_post
         if self.requiered_callback == self.SEND_ELSE:
             # следующий пост нужно отправить, если ни одно условие не выполнилось
@@ -41,6 +64,15 @@ class Post(ABC):
         self.content = content
         self.transitions = []  # список функций, возвращающих следующий пост при выполнении
                                # некоторого условия
+        self.keyword_matcher = None  # автомат для поиска ключевых слов всех переходов поста
+        self.scene = None  # название сцены, в которую входит пост
+        self.index = None  # порядковый номер поста в сцене
+
+    def __getstate__(self):
+        # автомат не сериализуется - он строится заново при первой проверке ключевых слов
+        state = self.__dict__.copy()
+        state['keyword_matcher'] = None
+        return state
 
     def add_next(self, next_post, requiered_callback=Transition.SEND_IMMEDIATELY, is_keyword=False):
         """Добавить переход на пост.
@@ -56,6 +88,25 @@ class Post(ABC):
         """
         transition = Transition(self, next_post, requiered_callback, is_keyword)
         self.transitions.append(transition)
+        self.keyword_matcher = None  # автомат нужно перестроить с учётом нового перехода
+        return transition
+
+    def get_conversion(self):
+        """Возвращает конвертацию, которая нужна файлу поста, в виде кортежа
+        (вид_конвертации, метод_MediaConverter, аргументы_метода) или None."""
+        return None
+
+    def convert_media(self):
+        """Конвертирует файл поста (см. get_conversion)."""
+        conversion = self.get_conversion()
+        if conversion is not None:
+            _, method, args = conversion
+            self.content = media_converter.convert(self.content, method, *args)
+
+    def get_id(self):
+        """Возвращает идентификатор поста вида (название_сцены, номер_в_сцене), не меняющийся
+        между сборками, пока сцена не изменена."""
+        return (getattr(self, 'scene', None), getattr(self, 'index', None))
 
     def is_endpoint(self):
         """Возвращает True, если с этого сообщения нельзя перейти на следующие."""
@@ -69,11 +120,35 @@ class Post(ABC):
                   будет производиться поиск поста, который отправляется
                   без условий
         """
-        for transition in self.transitions:
+        matched = None  # индексы переходов, ключевые слова которых найдены в сообщении
+        if received is not None:
+            matcher = self.get_keyword_matcher()
+            if matcher:
+                matched = matcher.match(received)
+        for i, transition in enumerate(self.transitions):
+            if matched is not None and i in matcher.indexes:
+                # ключевое слово уже проверено автоматом
+                if i in matched:
+                    return transition.next_post
+                continue
             next_post = transition(received)
             if not next_post is None:
                 return next_post
 
+    def get_keyword_matcher(self):
+        """Возвращает автомат для поиска ключевых слов всех переходов поста за один проход."""
+        if getattr(self, 'keyword_matcher', None) is None:
+            keywords = []
+            for i, transition in enumerate(self.transitions):
+                if not isinstance(transition, Transition) or not transition.is_keyword or\
+                   transition.requiered_callback in (Transition.SEND_IMMEDIATELY, Transition.SEND_ELSE):
+                    continue
+                if transition.forms is None:
+                    transition.precompute_forms()
+                keywords.append((i, transition.requiered_callback, transition.forms))
+            self.keyword_matcher = KeywordMatcher(keywords)
+        return self.keyword_matcher
+
 
 class TextPost(Post):
     """Текстовый пост."""
@@ -112,16 +187,28 @@ class VideoPost(Post):
 class VoicePost(Post):  # должен быть формат ogg
     """Пост с голосовым сообщением"""
     FORMATS = ['.ogg']
-    def __init__(self, file_path):
+    def __init__(self, file_path, convert=True):
+        """Создаёт пост с голосовым сообщением.
+
+        Параметры:
+        file_path - путь до аудиофайла
+        convert - если False, файл не конвертируется, а только проверяется возможность конвертации
+        """
         if not os.path.exists(file_path):
             raise Exception(f'Файл {file_path} не существует.')
         if not os.path.getsize(file_path):
             raise Exception(f'Файл {file_path} не должен быть пустым.')
         mc = media_converter.MediaConverter()
         if not mc.getFileExtension(file_path) in self.FORMATS:
-            file_path = mc.convertToOgg(file_path)  # выбрасывает исключение в случае 
-                                                    # неподдерживаемого формата
+            mc.checkConvertible(file_path, mc.TO_OGG_FORMATS)
         super().__init__(file_path)
+        if convert:
+            self.convert_media()
+
+    def get_conversion(self):
+        if media_converter.MediaConverter().getFileExtension(self.content) in self.FORMATS:
+            return None
+        return ('ogg', 'convertToOgg', ())
 
 
 class GifPost(Post):
@@ -143,12 +230,13 @@ class RoundPost(Post):
     FORMATS = ['.mp4']
     WIDTH = 480  # ширина (высота) видео по умолчанию
 
-    def __init__(self, file_path, width=480):
+    def __init__(self, file_path, width=480, convert=True):
         """Создаёт пост с круглым видео.
 
         Параметры:
         file_path - путь до видео
         width - ширина (и высота) видео
+        convert - если False, разрешение видео не изменяется
         """
         if not os.path.exists(file_path):
             raise Exception(f'Файл {file_path} не существует.')
@@ -160,9 +248,14 @@ class RoundPost(Post):
         if width < 10:
             raise Exception(f'Указана недопустимая ширина (высота) видео.')
         width = min(width, self.WIDTH)
-        mc.changeVideoResolution(file_path, (width, width))
         self.width = width
         super().__init__(file_path)
+        if convert:
+            self.convert_media()
+
+    def get_conversion(self):
+        # видео изменяется на месте
+        return (f'round{self.width}', 'changeVideoResolution', ((self.width, self.width),))
 
 
 class DocPost(Post):
@@ -179,16 +272,28 @@ class AudioPost(Post):
     """Пост с аудиозаписью."""
     # mp3 формат
     FORMATS = ['.mp3']
-    def __init__(self, file_path):
+    def __init__(self, file_path, convert=True):
+        """Создаёт пост с аудиозаписью.
+
+        Параметры:
+        file_path - путь до аудиофайла
+        convert - если False, файл не конвертируется, а только проверяется возможность конвертации
+        """
         if not os.path.exists(file_path):
             raise Exception(f'Файл {file_path} не существует.')
         if not os.path.getsize(file_path):
             raise Exception(f'Файл {file_path} не должен быть пустым.')
         mc = media_converter.MediaConverter()
         if not mc.getFileExtension(file_path) in self.FORMATS:
-            file_path = mc.convertToMp3(file_path)  # выбрасывает исключение в случае 
-                                                    # неподдерживаемого формата
+            mc.checkConvertible(file_path, mc.TO_MP3_FORMATS)
         super().__init__(file_path)
+        if convert:
+            self.convert_media()
+
+    def get_conversion(self):
+        if media_converter.MediaConverter().getFileExtension(self.content) in self.FORMATS:
+            return None
+        return ('mp3', 'convertToMp3', ())
 
 
 class StickerPost(Post):
@@ -234,6 +339,8 @@ class ButtonsPost(Post):
     def add_next(self, next_post, requiered_button):
         transition = ButtonTransition(self, next_post, requiered_button)
         self.transitions.append(transition)
+        self.keyword_matcher = None
+        return transition
 
 
 class Button:
@@ -251,6 +358,14 @@ class Button:
         """Генерирует случайный идентификатор для кнопки."""
         return ''.join(random.choices(string.ascii_lowercase, k=10))
 
+    def set_id(self, scene, index, position):
+        """Задаёт кнопке идентификатор по месту в сценарии: название сцены, номер поста
+        с кнопками в сцене и номер кнопки. В отличие от случайного идентификатора он не
+        меняется при пересборке, поэтому кнопки, отправленные игроку до перезапуска бота
+        на новой версии сценария, продолжают работать."""
+        key = f'{scene}\n{index}\n{position}'.encode('utf-8')
+        self.callback_data = hashlib.sha1(key).hexdigest()[:16]  # Telegram ограничивает длину 64 байтами
+
 
 class GroupPost(Post):
     """Пост, содержащий фото, видео, документы, аудио и (или) текст."""
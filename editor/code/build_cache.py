@@ -0,0 +1,134 @@
+import hashlib
+import os
+import pickle
+from media_cache import file_hash
+
+
+class BuildCache:
+    """Кэш сборки проекта.
+
+    Хранит результаты дорогих шагов прошлой сборки, чтобы при повторной сборке выполнять
+    их только для изменившихся частей проекта:
+    - формы ключевых слов переходов (склонение через pymorphy2) - по тексту ключевого слова;
+    - конвертированные медиафайлы - по хэшу содержимого исходного файла;
+    - хэши кода и использованных файлов - чтобы не собирать проект, если ничего не изменилось.
+    """
+    VERSION = 1  # версия кэша; кэш другой версии не используется
+
+    def __init__(self, path, project_path):
+        """Загружает кэш сборки.
+
+        Параметры:
+        path - путь до файла с кэшем
+        project_path - путь до проекта (пути до файлов хранятся относительно него)
+        """
+        self.path = path
+        self.project_path = project_path
+        self.code_hash = None  # хэш кода последней сборки
+        self.files = {}  # словарь вида {путь: хэш_содержимого} файлов последней сборки
+        self.hashes = {}  # словарь вида {путь: (время_изменения, размер, хэш_содержимого)}
+        self.forms = {}  # словарь вида {(ключевое_слово, is_keyword): формы}
+        self.media = {}  # словарь вида {(вид_конвертации, путь): (хэш_исходного_файла,
+                         #                                       путь_до_результата, хэш_результата)}
+        self.load()
+        # то, что используется в текущей сборке (остальное при сохранении удаляется)
+        self.used_files = {}
+        self.used_forms = {}
+        self.used_media = {}
+
+    def load(self):
+        """Загружает кэш с диска."""
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                version, state = pickle.load(f)
+        except Exception:
+            # файл с кэшем повреждён - собираем проект заново
+            return
+        if version == self.VERSION:
+            self.code_hash, self.files, self.hashes, self.forms, self.media = state
+
+    def dump(self):
+        """Сохраняет кэш на диск."""
+        state = (self.code_hash, self.files, self.hashes, self.forms, self.media)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((self.VERSION, state), f)
+        os.replace(tmp_path, self.path)
+
+    def relpath(self, file_path):
+        return os.path.relpath(file_path, self.project_path)
+
+    def get_hash(self, file_path):
+        """Возвращает хэш содержимого файла (пересчитывается только при изменении файла)."""
+        stat = os.stat(file_path)
+        relpath = self.relpath(file_path)
+        cached = self.hashes.get(relpath)
+        if cached is not None and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            return cached[2]
+        content_hash = file_hash(file_path)
+        self.hashes[relpath] = (stat.st_mtime, stat.st_size, content_hash)
+        return content_hash
+
+    def get_code_hash(self, code):
+        return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+    def is_up_to_date(self, code):
+        """Возвращает True, если с прошлой сборки не изменились ни код, ни использованные файлы."""
+        if self.code_hash is None or self.code_hash != self.get_code_hash(code):
+            return False
+        for relpath, content_hash in self.files.items():
+            file_path = os.path.join(self.project_path, relpath)
+            if not os.path.isfile(file_path) or self.get_hash(file_path) != content_hash:
+                return False
+        return True
+
+    def add_file(self, file_path):
+        """Запоминает файл, от которого зависит результат сборки."""
+        self.used_files[self.relpath(file_path)] = self.get_hash(file_path)
+
+    def precompute_forms(self, transition):
+        """Вычисляет формы ключевого слова перехода или берёт их из прошлой сборки."""
+        key = (transition.requiered_callback, transition.is_keyword)
+        if key in self.forms:
+            transition.forms = self.forms[key]
+        else:
+            transition.precompute_forms()
+        self.forms[key] = self.used_forms[key] = transition.forms
+
+    def get_converted(self, kind, file_path):
+        """Возвращает путь до результата прошлой конвертации файла или None, если файл
+        изменился с прошлой сборки или результат конвертации пропал.
+
+        Параметры:
+        kind - вид конвертации (например, 'ogg'); для одного файла может быть несколько видов
+        file_path - путь до исходного файла
+        """
+        key = (kind, self.relpath(file_path))
+        cached = self.media.get(key)
+        if cached is None:
+            return None
+        source_hash, result_relpath, result_hash = cached
+        result_path = os.path.join(self.project_path, result_relpath)
+        # при конвертации на месте хэш исходного файла совпадает с хэшем результата
+        if self.get_hash(file_path) not in (source_hash, result_hash) or\
+           not os.path.isfile(result_path) or self.get_hash(result_path) != result_hash:
+            return None
+        self.used_media[key] = cached
+        return result_path
+
+    def put_converted(self, kind, file_path, source_hash, result_path):
+        """Запоминает результат конвертации файла с хэшем source_hash (хэш до конвертации)."""
+        key = (kind, self.relpath(file_path))
+        self.media[key] = self.used_media[key] =\
+            (source_hash, self.relpath(result_path), self.get_hash(result_path))
+
+    def commit(self, code):
+        """Сохраняет результаты успешной сборки кода code; неиспользованные записи удаляются."""
+        self.code_hash = self.get_code_hash(code)
+        self.files = self.used_files
+        self.forms = self.used_forms
+        self.media = self.used_media
+        self.hashes = {relpath: self.hashes[relpath] for relpath in self.files if relpath in self.hashes}
+        self.dump()
@@ -0,0 +1,109 @@
+import json
+import time
+import tracemalloc
+
+
+class BuildProfile:
+    """Профиль сборки проекта (compiler.py --profile).
+
+    Сборка размечается этапами: каждый вызов lap завершает этап, начавшийся при предыдущем
+    вызове lap (или start), поэтому для разметки не нужно менять структуру кода сборки.
+    Для этапа запоминаются время, прирост памяти и её пик (через tracemalloc, учитывается
+    только память Python этого процесса: память ffmpeg и процессов конвертации не видна).
+    Отдельно собирается время каждой сцены (разбор и склонение ключевых слов её переходов)
+    и каждой конвертации медиафайла (замеряется в процессе, который конвертирует файл).
+
+    Отслеживание памяти замедляет код на Python в несколько раз (сильнее всего - склонение
+    ключевых слов), поэтому для точных замеров времени его можно отключить.
+    """
+    TOP = 10  # сколько самых долгих сцен и ресурсов выводится в отчёте
+    MB = 1024 * 1024
+
+    def __init__(self, trace_memory=True):
+        """Параметры:
+        trace_memory - замерять ли память этапов
+        """
+        self.trace_memory = trace_memory
+        self.stages = []  # список словарей с описанием этапов
+        self.scenes = {}  # словарь вида {название_сцены: {'line': строка, 'seconds': время}}
+        self.resources = []  # список словарей вида {'path', 'conversion', 'seconds'}
+        self.last_time = None
+        self.last_memory = 0
+
+    def start(self):
+        """Начинает замеры (первый этап начинается сейчас)."""
+        if self.trace_memory:
+            tracemalloc.start()
+            self.last_memory = tracemalloc.get_traced_memory()[0]
+        self.last_time = time.perf_counter()
+
+    def lap(self, stage):
+        """Завершает этап stage."""
+        now = time.perf_counter()
+        stage = {'stage': stage, 'seconds': now - self.last_time}
+        if self.trace_memory:
+            memory, peak = tracemalloc.get_traced_memory()
+            stage['memory_delta'] = memory - self.last_memory
+            stage['memory_peak'] = peak
+            tracemalloc.reset_peak()
+            self.last_memory = memory
+        self.stages.append(stage)
+        self.last_time = time.perf_counter()  # время самих замеров в этапы не входит
+
+    def stop(self):
+        """Завершает замеры."""
+        if self.trace_memory:
+            tracemalloc.stop()
+
+    def add_scene_time(self, name, line, seconds):
+        """Добавляет время, потраченное на сцену name, объявленную на строке line."""
+        scene = self.scenes.setdefault(name, {'line': line, 'seconds': 0.0})
+        scene['seconds'] += seconds
+
+    def add_resource_time(self, path, conversion, seconds):
+        """Добавляет время конвертации conversion (название метода MediaConverter) файла path."""
+        self.resources.append({'path': path, 'conversion': conversion, 'seconds': seconds})
+
+    def get_top_scenes(self, top=TOP):
+        """Возвращает список кортежей (название, строка, время) самых долгих сцен."""
+        scenes = sorted(self.scenes.items(), key=lambda item: item[1]['seconds'], reverse=True)
+        return [(name, scene['line'], scene['seconds']) for name, scene in scenes[:top]]
+
+    def get_top_resources(self, top=TOP):
+        return sorted(self.resources, key=lambda resource: resource['seconds'], reverse=True)[:top]
+
+    def to_dict(self, top=TOP):
+        return {
+            'total_seconds': sum(stage['seconds'] for stage in self.stages),
+            'stages': self.stages,
+            'scenes': [{'name': name, 'line': line, 'seconds': seconds}
+                       for name, line, seconds in self.get_top_scenes(top)],
+            'resources': self.get_top_resources(top),
+        }
+
+    def dump(self, path, top=TOP):
+        """Сохраняет профиль в JSON-файл."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(top), f, ensure_ascii=False, indent=2)
+
+    def format(self, top=TOP):
+        """Возвращает отчёт в виде текста для вывода в консоль."""
+        header = f'{"Этап":<24}{"Время, с":>10}'
+        if self.trace_memory:
+            header += f'{"Память, МБ":>12}{"Пик, МБ":>10}'
+        lines = ['=== ПРОФИЛЬ СБОРКИ ===', header]
+        for stage in self.stages:
+            line = f'{stage["stage"]:<24}{stage["seconds"]:>10.3f}'
+            if self.trace_memory:
+                line += f'{stage["memory_delta"] / self.MB:>+12.1f}{stage["memory_peak"] / self.MB:>10.1f}'
+            lines.append(line)
+        lines.append(f'{"Всего":<24}{sum(stage["seconds"] for stage in self.stages):>10.3f}')
+        if self.scenes:
+            lines.append('Самые долгие сцены (разбор и склонение ключевых слов переходов):')
+            for name, line, seconds in self.get_top_scenes(top):
+                lines.append(f'{seconds:>10.3f} с  {name} (строка {line})')
+        if self.resources:
+            lines.append('Самые долгие конвертации медиафайлов:')
+            for resource in self.get_top_resources(top):
+                lines.append(f'{resource["seconds"]:>10.3f} с  {resource["path"]} ({resource["conversion"]})')
+        return '\n'.join(lines)
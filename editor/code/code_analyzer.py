@@ -46,6 +46,13 @@ class CodeAnalyzer:
               GROUP, GROUP_END, WAIT_AUDIO, WAIT_TEXT, WAIT_END, BACK, ELSE, EXIT, BUTTONS, BUTTONS_END,
               ASTERISK, COLON, DOUBLE_DASH, ROUND, TRANSITION]
 
+    KWORDS_SET = frozenset(KWORDS)
+    MAX_KWORD_LEN = max(len(kword) for kword in KWORDS)
+
+    # лексемы: строка в кавычках, комментарий, перевод строки, последовательность символов
+    # без пробелов (\n не влияет на разбор и пропускается внутри лексем)
+    TOKEN_RE = re.compile(r'"[^"]*"?|![^\r]*\r?|\r|[^ \r"!]+')
+
     # показывает количество пробелов для каждого отступа
     INDENT_SPACE_COUNT = 4
 
@@ -102,62 +109,71 @@ class CodeAnalyzer:
     def get_words(self, code):
         analyzed = []  # список кортежей вида (слово, номер_строки, позиция_последнего_символа_в_тексте, тип)
         line_number = 1  # номер текущей строки
-        current_word = ''  # текущее исследуемое слово
-        current_type = self.UNKNOWN  # тип текущего исследуемого слова
-
-        symbol = ''
-        for i, symbol in enumerate(code):
-            pos = i+1
-            if symbol == '\r':
-                symbol = self.NEWLINE
-                pos += 1
-            elif symbol == '\n':
-                symbol = self.NEWLINE
-                continue
-            if symbol == self.QUOTE:
-                if current_type == self.STRING:
-                    # заканчиваем считывание строки в кавычках
-                    analyzed.append((current_word+symbol,
-                                   line_number-current_word.count(self.NEWLINE),
-                                   pos, current_type))
-                    current_word = ''
-                    current_type = self.UNKNOWN
-                    continue
-                elif current_type != self.COMMENT:
-                    # начинаем считывание строки в кавычках
-                    current_word = ''
-                    current_type = self.STRING
-            elif symbol == self.NEWLINE:
-                line_number += 1
-                if current_type == self.COMMENT:
+        code_len = len(code)
+
+        # символ \n нигде не учитывается (перевод строки - это \r), поэтому вырезается из слов,
+        # а позиции считаются по исходному тексту
+        for match in self.TOKEN_RE.finditer(code):
+            token = match.group()
+            first = token[0]
+            start = match.start()
+            if first == self.QUOTE:
+                # строка в кавычках (возможно, незакрытая)
+                word = token.replace('\n', '').replace('\r', self.NEWLINE)
+                line_number += token.count('\r')
+                if len(token) > 1 and token[-1] == self.QUOTE:
+                    pos = match.end()
+                else:
+                    pos = code_len + 1 if code[-1] == '\r' else code_len
+                analyzed.append((word, line_number-word.count(self.NEWLINE), pos, self.STRING))
+            elif first == self.EXCLAM:
+                # комментарий до конца строки
+                word = token.replace('\n', '')
+                if token[-1] == '\r':
                     # комментарий прерывается при переходе на следующую строку
-                    analyzed.append((current_word+symbol, line_number, pos, current_type))
-                    current_word = ''
-                    current_type = self.UNKNOWN
-                    continue
-            elif symbol == self.EXCLAM:
-                if current_type != self.STRING and current_type != self.COMMENT:
-                    # начинается комментарий
-                    current_word = ''
-                    current_type = self.COMMENT
-            if current_type == self.KEYWORD and symbol != self.NEWLINE and\
-               symbol != self.SPACE and symbol != self.COLON:
-                # если после ввода ключевого слова пользователь ввёл что-то, кроме
-                # пробела или перевода строки, ключевое слово теряется
-                current_word, _, _, _ = analyzed[-1]
-                del analyzed[-1]
-            if current_type == self.KEYWORD:
-                current_type = self.UNKNOWN
-            if current_type == self.UNKNOWN and (symbol == self.NEWLINE or symbol == self.SPACE):
-                current_word = ''
+                    line_number += 1
+                    analyzed.append((word+'\n', line_number, match.end()+1, self.COMMENT))
+                else:
+                    analyzed.append((word, line_number, code_len, self.COMMENT))
+            elif first == '\r':
+                line_number += 1
             else:
-                current_word += symbol
-            if current_word in self.KWORDS:
-                current_type = self.KEYWORD
-                analyzed.append((current_word, line_number, pos, current_type))
-                current_word = ''
-        if current_type == self.STRING or current_type == self.COMMENT:
-            analyzed.append((current_word, line_number-current_word.count(self.NEWLINE), pos, current_type))
+                self.add_keywords(analyzed, token, start, line_number)
 
         completion = ''
         return analyzed, completion
+
+
+    def add_keywords(self, analyzed, token, start, line_number):
+        """Добавляет в analyzed ключевые слова из непрерывной последовательности символов без
+        пробелов, кавычек, комментариев и переводов строк.
+
+        Ключевое слово распознаётся, как только набранное с начала слова совпадает с ним. Если
+        сразу после ключевого слова идёт что-то, кроме двоеточия (или конца последовательности),
+        ключевое слово теряется и слово продолжает набираться дальше.
+        """
+        if '\n' in token:
+            # позиции символов в тексте без учёта вырезанных символов \n
+            positions = [start+i for i, symbol in enumerate(token) if symbol != '\n']
+            token = token.replace('\n', '')
+        else:
+            positions = None
+        token_len = len(token)
+        word_start = 0  # индекс начала текущего слова
+        end = 1  # минимальная длина текущего слова, при которой проверяется совпадение
+        while True:
+            # ищем кратчайшее ключевое слово, с которого начинается текущее слово
+            stop = min(token_len, word_start+self.MAX_KWORD_LEN)
+            for end in range(max(end, word_start+1), stop+1):
+                if token[word_start:end] in self.KWORDS_SET:
+                    break
+            else:
+                return
+            if end == token_len or token[end] == self.COLON:
+                # ключевое слово закончено (двоеточие начинает новое слово)
+                last = positions[end-1] if positions else start+end-1
+                analyzed.append((token[word_start:end], line_number, last+1, self.KEYWORD))
+                if end == token_len:
+                    return
+                word_start = end
+            end += 1
@@ -1,17 +1,42 @@
 from project_controller import Project
+from build_profile import BuildProfile
+import multiprocessing
 import sys
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # для пула процессов конвертации медиафайлов в .exe
     try:
+        workers = None
+        if '--workers' in sys.argv:
+            # project_controller.exe [-c] --workers N path
+            # бот запускается в N процессах (вместо количества из TGBOT_WORKERS)
+            i = sys.argv.index('--workers')
+            if i + 2 >= len(sys.argv) or not sys.argv[i + 1].isdigit() or int(sys.argv[i + 1]) < 1:
+                raise Exception('После --workers нужно указать количество процессов бота (не меньше 1).')
+            workers = int(sys.argv[i + 1])
+            del sys.argv[i:i + 2]
         project = Project(sys.argv[-1])
-        if len(sys.argv) == 3 or len(sys.argv) == 4 and sys.argv[0] == 'python':
+        if '--profile' in sys.argv:
+            # project_controller.exe --profile [--no-memory] path
+            # нужно собрать проект и показать, на что ушло время и память
+            # (с --no-memory - только время, зато без замедления от замеров памяти)
+            profile = BuildProfile(trace_memory='--no-memory' not in sys.argv)
+            project.compile(profile)
+            print(profile.format())
+            profile.dump(project.profile)
+            print(f'Профиль сохранён в файл {project.profile}')
+        elif '-b' in sys.argv:
+            # project_controller.exe -b path
+            # нужно только пересобрать проект (запущенный бот подхватит новый сценарий)
+            project.compile()
+        elif len(sys.argv) == 3 or len(sys.argv) == 4 and sys.argv[0] == 'python':
             # project_controller.exe -c path
             # нужно скомпилировать проект
-            project.run(recompile=True, new_console=False)
+            project.run(recompile=True, new_console=False, workers=workers)
         elif len(sys.argv) == 2 or len(sys.argv) == 3 and sys.argv[0] == 'python':
             # project_controller.exe path
             # нужно запустить уже скомпилированный проект
-            project.run(recompile=False, new_console=False)
+            project.run(recompile=False, new_console=False, workers=workers)
     except Exception as e:
         print(e)
         input('Для выхода нажмите любую клавишу...')
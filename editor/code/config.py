@@ -17,3 +17,23 @@ PROJ_PATH = os.path.abspath(os.path.join(SRCCODE_PATH,'..')) + os.sep
 FFMPEG_PATH = f'{PROJ_PATH}ffmpeg{os.sep}bin{os.sep}ffmpeg.exe'
 HTML_PATH = f'{PROJ_PATH}html{os.sep}'
 IMAGE_PATH = f'{PROJ_PATH}img{os.sep}'
+
+# режим webhook: если порт не задан, бот получает обновления через long polling
+WEBHOOK_PORT = int(os.environ['TGBOT_WEBHOOK_PORT']) if os.environ.get('TGBOT_WEBHOOK_PORT') else None
+WEBHOOK_URL = os.environ.get('TGBOT_WEBHOOK_URL')  # внешний адрес webhook
+WEBHOOK_SECRET = os.environ.get('TGBOT_WEBHOOK_SECRET')  # секретный токен webhook
+
+# среда выполнения бота: 'threads' - bot.Bot (поток на обновление), 'asyncio' - async_bot.AsyncBot
+RUNTIME = os.environ.get('TGBOT_RUNTIME', 'threads')
+
+# количество процессов бота: при значении больше 1 игроки распределяются между процессами
+WORKERS = int(os.environ.get('TGBOT_WORKERS') or 1)
+
+# распознаватель голосовых сообщений: 'google' (через интернет), 'vosk' (офлайн) или 'stub' (для проверок)
+RECOGNIZER = os.environ.get('TGBOT_RECOGNIZER', 'google')
+VOSK_MODEL_PATH = os.environ.get('TGBOT_VOSK_MODEL', f'{PROJ_PATH}vosk-model')  # папка с моделью Vosk
+STUB_RECOGNIZER_TEXT = os.environ.get('TGBOT_STUB_TEXT')  # текст, который "распознаёт" 'stub'
+
+# порт HTTP-сервера с метриками бота (/metrics в формате Prometheus); если не задан, метрики не собираются.
+# При нескольких процессах рабочий процесс с номером i использует порт METRICS_PORT + i
+METRICS_PORT = int(os.environ['TGBOT_METRICS_PORT']) if os.environ.get('TGBOT_METRICS_PORT') else None
@@ -1,7 +1,9 @@
 import wx  # pip install -U --pre -f https://wxpython.org/Phoenix/snapshot-builds/ wxPython
 import wx.stc
 import codecs
+import os
 import code_analyzer
+from scenario_validator import ScenarioValidator
 
 
 class Editor(wx.stc.StyledTextCtrl):
@@ -21,6 +23,10 @@ class Editor(wx.stc.StyledTextCtrl):
         self.SetMarginWidth(1, 40)
         self.SetMarginType(1, wx.stc.STC_MARGIN_NUMBER)
         self.SetMarginWidth(2, 10)
+        # боковая панель с отметками об ошибках
+        self.SetMarginType(2, wx.stc.STC_MARGIN_SYMBOL)
+        self.SetMarginMask(2, 1 << self.MARK_ERROR)
+        self.MarkerDefine(self.MARK_ERROR, wx.stc.STC_MARK_CIRCLE, '#C80000', '#C80000')
 
         # создаем кодировщик один раз в конструкторе,
         # чтобы не создавать его при каждой необходимости
@@ -35,6 +41,7 @@ class Editor(wx.stc.StyledTextCtrl):
         self.style_purple = 2
         self.style_blue = 3
         self.style_green = 4
+        self.style_error = 5
 
         # стили для текста в поле ввода
         self.StyleSetSpec(self.style_def, "face:Consolas,size:12,fore:#000000")
@@ -42,14 +49,13 @@ class Editor(wx.stc.StyledTextCtrl):
         self.StyleSetSpec(self.style_purple, "face:Consolas,size:12,fore:#C800C8,bold")
         self.StyleSetSpec(self.style_blue, "face:Consolas,size:12,fore:#000096,bold")
         self.StyleSetSpec(self.style_green, "face:Consolas,size:12,fore:#009600,italic")
+        self.StyleSetSpec(self.style_error, "face:Consolas,size:10,fore:#C80000,back:#FFF0F0,italic")
 
         self.code_analyzer = code_analyzer.CodeAnalyzer()
 
         # подписка на событие, когда нужно изменить стиль
         self.Bind(wx.stc.EVT_STC_STYLENEEDED, self.onStyleNeed)
 
-        self.analyzed = None  # список кортежей с результатом анализа текста
-
         # подписка на событие "Добавление символа"
         self.Bind(wx.stc.EVT_STC_CHARADDED, self.onCharAdded)
 
@@ -57,6 +63,61 @@ class Editor(wx.stc.StyledTextCtrl):
         self.SetIndent(self.code_analyzer.INDENT_SPACE_COUNT)
         self.SetUseTabs(False)
 
+        # фоновая проверка сценария на ошибки
+        self.revision = 0  # номер текущей версии текста
+        self.validate_timer = None  # таймер, откладывающий проверку до паузы в наборе текста
+        self.validator = ScenarioValidator(self.onValidated)
+        self.Bind(wx.stc.EVT_STC_CHANGE, self.onTextChange)
+
+    MARK_ERROR = 1  # номер маркера ошибки на боковой панели
+    VALIDATE_DELAY = 700  # пауза в наборе текста (мс), после которой сценарий проверяется
+
+
+    def onTextChange(self, event):
+        """Откладывает проверку сценария до паузы в наборе текста."""
+        self.revision += 1
+        self.scheduleValidation()
+        event.Skip()
+
+
+    def scheduleValidation(self):
+        """Запускает (или перезапускает) таймер проверки сценария."""
+        if self.validate_timer is None:
+            self.validate_timer = wx.CallLater(self.VALIDATE_DELAY, self.validate)
+        else:
+            self.validate_timer.Start(self.VALIDATE_DELAY)
+
+
+    def validate(self):
+        """Отправляет текущий текст на проверку в фоновый поток."""
+        project = self.frame.project if self.frame else None
+        if project is None:
+            return
+        self.validator.submit(self.revision, self.GetText(), project.res + os.sep)
+
+
+    def onValidated(self, revision, errors):
+        """Вызывается в потоке проверки - передаёт результат в главный поток."""
+        wx.CallAfter(self.showErrors, revision, errors)
+
+
+    def showErrors(self, revision, errors):
+        """Показывает ошибки сценария под строками, в которых они найдены."""
+        if not self or revision != self.revision:
+            # окно закрыто или текст изменился после начала проверки - результат устарел
+            return
+        self.MarkerDeleteAll(self.MARK_ERROR)
+        self.AnnotationClearAll()
+        messages = {}  # словарь вида {индекс_строки: [текст_ошибки]}
+        for line_number, message in errors:
+            line = min(max((line_number or 1)-1, 0), self.GetLineCount()-1)
+            messages.setdefault(line, []).append(message)
+        for line, line_messages in messages.items():
+            self.AnnotationSetText(line, '\n'.join(line_messages))
+            self.AnnotationSetStyle(line, self.style_error)
+            self.MarkerAdd(line, self.MARK_ERROR)
+        self.AnnotationSetVisible(wx.stc.STC_ANNOTATION_BOXED)
+
 
     def onCharAdded(self, event):
         # # получим код нажатой клавиши
@@ -96,13 +157,31 @@ class Editor(wx.stc.StyledTextCtrl):
         return len(self.encoder(text[:pos])[0])
 
 
-    def onStyleNeed(self, event):
-        """Подсветка синтаксиса."""
-        text = self.GetText()
+    LINE_IN_STRING = 1  # состояние строки: строка начинается внутри строки в кавычках
 
-        # cначала ко всему тексту применим стиль по умолчанию
-        self.StartStyling(0)
-        self.SetStyling(self.calcByteLen(text), self.style_def)
+    def onStyleNeed(self, event):
+        """Подсветка синтаксиса.
+
+        Перекрашивается только изменённая часть текста: от строки, с которой начинается
+        неокрашенный текст, до позиции, запрошенной событием. Разбор начинается с начала строки,
+        которая не находится внутри строки в кавычках, - там состояние анализатора заведомо чистое.
+        """
+        line = self.LineFromPosition(self.GetEndStyled())
+        while line > 0 and self.GetLineState(line) == self.LINE_IN_STRING:
+            line -= 1
+        last_line = self.LineFromPosition(event.GetPosition())
+        start = self.PositionFromLine(line)  # позиции в Scintilla - в байтах
+        if last_line+1 < self.GetLineCount():
+            end = self.PositionFromLine(last_line+1)
+        else:
+            end = self.GetLength()
+        text = self.GetTextRange(start, end)
+
+        # cначала ко всему перекрашиваемому тексту применим стиль по умолчанию
+        self.StartStyling(start)
+        self.SetStyling(end-start, self.style_def)
+        for i in range(line, min(last_line+2, self.GetLineCount())):
+            self.SetLineState(i, 0)
 
         analyzed, completion = self.code_analyzer.get_words(text)
 
@@ -110,15 +189,28 @@ class Editor(wx.stc.StyledTextCtrl):
             self.AddText(completion)
         # self.SetCurrentPos(len(completed_code))
 
-        scene_idxs = []
-        for i, (word, line_number, last_pos, word_type) in enumerate(analyzed):
+        char_pos = 0  # позиция в символах относительно начала перекрашиваемого текста
+        byte_pos = start  # та же позиция в байтах относительно начала документа
+        for word, line_number, last_pos, word_type in analyzed:
             pos = last_pos-len(word)
-            bytepos = self.calcBytePos(text, pos)  # находим начальную позицию в байтах
+            # позиции слов возрастают, поэтому байтовые позиции считаются за один проход
+            if pos >= char_pos:
+                byte_pos += self.calcByteLen(text[char_pos:pos])
+            else:
+                byte_pos = start + self.calcBytePos(text, pos)
+            char_pos = pos
             text_byte_len = self.calcByteLen(word)  # вычисляем длину слова в байтах
             # применяем стиль
-            self.StartStyling(bytepos)
+            self.StartStyling(byte_pos)
             if word_type == self.code_analyzer.STRING:
                 self.SetStyling(text_byte_len, self.style_green)
+                # запоминаем строки, которые начинаются внутри строки в кавычках
+                first_line = line + line_number - 1
+                in_string_lines = word.count(self.code_analyzer.NEWLINE)
+                if len(word) < 2 or not word.endswith(self.code_analyzer.QUOTE):
+                    in_string_lines += 1  # строка не закрыта в перекрашиваемом тексте
+                for i in range(first_line+1, min(first_line+in_string_lines+1, self.GetLineCount())):
+                    self.SetLineState(i, self.LINE_IN_STRING)
             elif word_type == self.code_analyzer.COMMENT:
                 self.SetStyling(text_byte_len, self.style_gray)
             elif word_type == self.code_analyzer.KEYWORD:
@@ -128,4 +220,12 @@ class Editor(wx.stc.StyledTextCtrl):
                 else:
                     self.SetStyling(text_byte_len, self.style_blue)
 
-        self.analyzed = analyzed
+
+    def getAnalyzed(self):
+        """Возвращает результат анализа всего текста (см. CodeAnalyzer.get_words).
+
+        Подсветка разбирает только перекрашиваемую часть текста, поэтому весь текст
+        анализируется заново при каждом запросе.
+        """
+        analyzed, _ = self.code_analyzer.get_words(self.GetText())
+        return analyzed
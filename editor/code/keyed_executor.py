@@ -0,0 +1,89 @@
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class KeyedExecutor:
+    """Пул потоков, выполняющий задачи с одинаковым ключом строго по очереди.
+
+    Задачи разных ключей (например, разных игроков) выполняются параллельно, а задачи одного
+    ключа - последовательно и в порядке постановки, поэтому обработчики обновлений одного
+    игрока не гоняются за его сессию.
+    """
+    WORKERS = 16  # количество рабочих потоков
+
+    def __init__(self, workers=WORKERS):
+        self.pool = ThreadPoolExecutor(workers)
+        self.queues = {}  # словарь вида {ключ: deque([(функция, аргументы)])}
+        self.lock = threading.Lock()
+
+    def submit(self, key, function, *args):
+        """Ставит вызов function(*args) в очередь ключа key."""
+        with self.lock:
+            queue = self.queues.get(key)
+            if queue is not None:
+                # очередь ключа уже обрабатывается - задача выполнится после предыдущих
+                queue.append((function, args))
+                return
+            self.queues[key] = deque([(function, args)])
+        self.pool.submit(self.run, key)
+
+    def run(self, key):
+        """Выполняет задачи ключа, пока его очередь не опустеет."""
+        queue = self.queues[key]
+        while True:
+            function, args = queue[0]
+            try:
+                function(*args)
+            except Exception as e:
+                print(f'Ошибка при обработке обновления {key}: {e}')
+            with self.lock:
+                queue.popleft()
+                if not queue:
+                    del self.queues[key]
+                    return
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait)
+
+
+class AsyncKeyedLocks:
+    """Блокировки asyncio по ключу: корутины с одинаковым ключом выполняются по очереди
+    (в порядке обращения к блокировке), с разными - параллельно.
+
+    Использование: async with locks(key): ...
+    Блокировки создаются по требованию и удаляются, когда их никто не ждёт.
+    """
+    def __init__(self):
+        self.locks = {}  # словарь вида {ключ: [asyncio.Lock, количество_владельцев_и_ожидающих]}
+
+    def __call__(self, key):
+        return _AsyncKeyedLock(self, key)
+
+
+class _AsyncKeyedLock:
+    def __init__(self, locks, key):
+        self.locks = locks.locks
+        self.key = key
+
+    async def __aenter__(self):
+        entry = self.locks.get(self.key)
+        if entry is None:
+            entry = self.locks[self.key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self.release(entry, locked=False)
+            raise
+
+    async def __aexit__(self, *exc_info):
+        self.release(self.locks[self.key], locked=True)
+
+    def release(self, entry, locked):
+        if locked:
+            entry[0].release()
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.locks[self.key]
@@ -0,0 +1,99 @@
+from collections import deque
+import morpheme
+
+
+class AhoCorasick:
+    """Автомат Ахо-Корасик для поиска сразу всех образцов в строке за один проход."""
+    def __init__(self, patterns):
+        """Строит автомат.
+
+        Параметры:
+        patterns - список кортежей вида (образец, метка); метка возвращается при нахождении образца
+        """
+        self.goto = [{}]  # переходы автомата по символам
+        self.fail = [0]  # суффиксные ссылки
+        self.out = [set()]  # метки образцов, заканчивающихся в данном состоянии
+        self.always = set()  # метки пустых образцов (содержатся в любой строке)
+        for pattern, label in patterns:
+            if not pattern:
+                self.always.add(label)
+                continue
+            state = 0
+            for symbol in pattern:
+                next_state = self.goto[state].get(symbol)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][symbol] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(set())
+                state = next_state
+            self.out[state].add(label)
+        # строим суффиксные ссылки обходом в ширину
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for symbol, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and symbol not in self.goto[fail]:
+                    fail = self.fail[fail]
+                fail = self.goto[fail].get(symbol, 0)
+                self.fail[next_state] = fail if fail != next_state else 0
+                self.out[next_state] |= self.out[self.fail[next_state]]
+        self.out = [frozenset(labels) for labels in self.out]
+
+    def search(self, text):
+        """Возвращает множество меток образцов, найденных в строке."""
+        found = set(self.always)
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for symbol in text:
+            while state and symbol not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(symbol, 0)
+            if out[state]:
+                found |= out[state]
+        return found
+
+
+class KeywordMatcher:
+    """Поиск ключевых слов всех переходов поста за один проход по сообщению игрока.
+
+    Повторяет логику morpheme.StringsAnalyser.check для ключевых слов: если и в ключевом слове,
+    и в сообщении есть цифры, ключевое слово ищется как есть; иначе ищутся его формы, а числа
+    в сообщении предварительно заменяются словами.
+    """
+    def __init__(self, keywords):
+        """Строит автоматы для поиска.
+
+        Параметры:
+        keywords - список кортежей вида (индекс_перехода, ключевое_слово, формы_ключевого_слова)
+        """
+        self.indexes = set()  # индексы переходов, проверяемых автоматом
+        self.digit_indexes = set()  # индексы переходов, в ключевых словах которых есть цифры
+        forms_patterns = []
+        raw_patterns = []
+        for index, requiered, forms in keywords:
+            requiered = requiered.lower()
+            self.indexes.add(index)
+            forms_patterns += [(form, index) for form in forms]
+            if morpheme.SHARED_ANALYSER.contains_digits(requiered):
+                self.digit_indexes.add(index)
+                raw_patterns.append((requiered, index))
+        self.forms_automaton = AhoCorasick(forms_patterns)
+        self.raw_automaton = AhoCorasick(raw_patterns)
+
+    def __bool__(self):
+        return bool(self.indexes)
+
+    def match(self, received):
+        """Возвращает множество индексов переходов, ключевые слова которых найдены в сообщении."""
+        analyser = morpheme.SHARED_ANALYSER
+        received = received.lower()
+        if not analyser.contains_digits(received):
+            return self.forms_automaton.search(received)
+        matched = self.raw_automaton.search(received)
+        received = analyser.replace_numbers_with_words(received)
+        matched |= self.forms_automaton.search(received) - self.digit_indexes
+        return matched
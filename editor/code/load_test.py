@@ -0,0 +1,414 @@
+"""Нагрузочное тестирование бота без Telegram.
+
+Запускает бота (bot.Bot или async_bot.AsyncBot) со скомпилированным сценарием проекта,
+подменив Telegram Bot API локальным сервером, и моделирует игроков, которые проходят
+сценарий: нажимают кнопки постов с кнопками и отвечают ключевыми словами на ждатьТекст.
+В конце выводится количество обработанных действий игроков в секунду и задержки ответа.
+Сервер и игроки работают в одном процессе с ботом, поэтому результаты полезны для сравнения
+версий бота между собой, а не как оценка возможностей настоящего сервера.
+
+Использование:
+    python load_test.py путь_до_проекта [--players 100] [--duration 30] [--runtime asyncio]
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import telebot
+from bot_message import *
+import scenario_format
+
+TOKEN = '123456:load-test'  # токен бота (проверяется только его формат)
+# ограничения частоты отправки для --no-rate-limits (см. send_queue.RateLimits)
+NO_RATE_LIMITS = {'global_rate': 10 ** 9, 'global_burst': 10 ** 9, 'chat_rate': 10 ** 9, 'chat_burst': 10 ** 9}
+
+# поля отправленного сообщения для методов отправки файлов
+FILE_FIELDS = {
+    'sendPhoto': ('photo', {'width': 1, 'height': 1}),
+    'sendVideo': ('video', {'width': 1, 'height': 1, 'duration': 1}),
+    'sendVoice': ('voice', {'duration': 1}),
+    'sendAnimation': ('animation', {'width': 1, 'height': 1, 'duration': 1}),
+    'sendVideoNote': ('video_note', {'length': 1, 'duration': 1}),
+    'sendDocument': ('document', {}),
+    'sendAudio': ('audio', {'duration': 1}),
+    'sendSticker': ('sticker', {'type': 'regular', 'width': 1, 'height': 1, 'is_animated': False,
+                                'is_video': False}),
+}
+# методы отправки, для которых у элементов sendMediaGroup нужны такие же поля
+MEDIA_METHODS = {'photo': 'sendPhoto', 'video': 'sendVideo', 'document': 'sendDocument',
+                 'audio': 'sendAudio'}
+
+
+def percentile(values, percent):
+    """Возвращает перцентиль percent отсортированного списка values."""
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))]
+
+
+class FakeBotApi:
+    """Локальный сервер, отвечающий на запросы бота так же, как Telegram Bot API.
+
+    Обновления игроков отдаются боту через getUpdates, а отправленные ботом сообщения
+    передаются в callback on_send(chat_id, message_id). Параметр latency задаёт задержку ответа
+    на каждый запрос (как у настоящего сервера), с.
+    """
+    def __init__(self, on_send, latency=0):
+        self.on_send = on_send
+        self.latency = latency
+        self.updates = []  # обновления, ещё не подтверждённые ботом
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.file_ids = itertools.count(1)
+        self.condition = threading.Condition()
+        self.requests = 0
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def get_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+    def make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.handle_request()
+
+            def do_POST(self):
+                self.handle_request()
+
+            def handle_request(self):
+                url = urllib.parse.urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                sent = None
+                if url.path.startswith('/file/'):
+                    status, payload = 200, b'OggS'  # содержимое скачиваемого файла
+                else:
+                    params = api.parse_params(url.query, self.headers.get('Content-Type', ''), body)
+                    status, result = api.call(url.path.rsplit('/', 1)[-1], params)
+                    payload = json.dumps({'ok': status == 200, 'result': result,
+                                          'error_code': status, 'description': str(result)}).encode('utf-8')
+                    if status == 200 and url.path.rsplit('/', 1)[-1].startswith('send'):
+                        sent = result[-1] if isinstance(result, list) else result
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                if sent is not None:
+                    # игрок узнаёт о сообщении после того, как ответ отправлен боту
+                    api.on_send(sent['chat']['id'], sent['message_id'])
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def parse_params(self, query, content_type, body):
+        """Возвращает словарь параметров запроса (из строки запроса и тела запроса)."""
+        params = dict(urllib.parse.parse_qsl(query))
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            params.update(urllib.parse.parse_qsl(body.decode('utf-8')))
+        elif content_type.startswith('multipart/form-data'):
+            message = BytesParser(policy=HTTP).parsebytes(
+                b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+            for part in message.iter_parts():
+                if part.get_filename() is None:  # файлы не нужны
+                    params[part.get_param('name', header='content-disposition')] = part.get_content()
+        return params
+
+    def put_update(self, update):
+        """Добавляет обновление от игрока."""
+        with self.condition:
+            update['update_id'] = next(self.update_ids)
+            self.updates.append(update)
+            self.condition.notify_all()
+
+    def new_message_id(self):
+        return next(self.message_ids)
+
+    def call(self, method, params):
+        """Выполняет метод Bot API и возвращает кортеж (HTTP-код, результат)."""
+        with self.condition:
+            self.requests += 1
+        if method == 'getUpdates':
+            return 200, self.get_updates(int(params.get('offset') or 0), float(params.get('timeout') or 0))
+        if self.latency:
+            time.sleep(self.latency)
+        if method == 'getMe':
+            return 200, {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'load_test_bot'}
+        if method in ('deleteWebhook', 'setWebhook', 'answerCallbackQuery'):
+            return 200, True
+        if method == 'getFile':
+            return 200, {'file_id': params['file_id'], 'file_unique_id': params['file_id'],
+                         'file_path': 'voice/' + params['file_id'] + '.ogg'}
+        chat_id = int(params.get('chat_id', 0))
+        if method == 'sendMessage' or method in FILE_FIELDS:
+            result = self.make_message(chat_id, method)
+        elif method == 'sendMediaGroup':
+            media = json.loads(params['media'])
+            result = [self.make_message(chat_id, MEDIA_METHODS[item['type']]) for item in media]
+        else:
+            return 400, f'Bad Request: метод {method} не поддерживается'
+        return 200, result
+
+    def get_updates(self, offset, timeout):
+        """Отдаёт обновления с номером не меньше offset, ожидая их не дольше timeout секунд."""
+        with self.condition:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            self.condition.wait_for(lambda: self.updates, timeout)
+            return list(self.updates)
+
+    def make_message(self, chat_id, method):
+        message = {'message_id': self.new_message_id(), 'date': int(time.time()),
+                   'chat': {'id': chat_id, 'type': 'private'},
+                   'from': {'id': 1, 'is_bot': True, 'first_name': 'bot'}}
+        if method in FILE_FIELDS:
+            field, extra = FILE_FIELDS[method]
+            file_id = f'file{next(self.file_ids)}'
+            media = dict(extra, file_id=file_id, file_unique_id=file_id)
+            message[field] = [media] if field == 'photo' else media
+        return message
+
+
+class Player:
+    """Игрок, проходящий сценарий.
+
+    Игрок ведёт свою копию сценария: после каждого действия он вычисляет (так же, как бот),
+    какие посты должен прислать бот, и ждёт их, а затем выбирает следующее действие.
+    """
+    def __init__(self, user_id, start_post):
+        self.user_id = user_id
+        self.start_post = start_post
+        self.post = None  # последний пост, который должен прислать бот
+        self.message_id = None  # id последнего отправленного ботом сообщения
+        self.expected = 0  # сколько сообщений бота ещё ожидается
+        self.action = None  # функция, повторяющая последнее действие
+        self.sent_time = None  # время последнего действия
+        self.first_time = None  # время первого ответа на последнее действие
+        self.retries = 0
+
+    def chain(self, post, received):
+        """Возвращает посты, которые бот отправит после поста post в ответ на received."""
+        posts = []
+        while True:
+            post = post.get_next(received)
+            if post is None:
+                return posts
+            posts.append(post)
+            received = None
+
+    def choose(self):
+        """Выбирает следующее действие. Возвращает кортеж (функция_действия, ожидаемые_посты)
+        или None, если сценарий пройден (игрок начинает заново) или ответить нечем."""
+        post = self.post
+        if post is None or post.is_endpoint():
+            return 'start', [self.start_post] + self.chain(self.start_post, '/start')
+        if isinstance(post, ButtonsPost):
+            transition = random.choice(post.transitions)
+            data = transition.requiered_button.callback_data
+            return ('button', data), self.chain(post, data)
+        answers = [transition.requiered_callback for transition in post.transitions
+                   if isinstance(transition, Transition) and transition.requiered_callback not in
+                   (Transition.SEND_IMMEDIATELY, Transition.SEND_ELSE)]
+        if not answers and any(getattr(transition, 'requiered_callback', None) == Transition.SEND_ELSE
+                               for transition in post.transitions):
+            answers = ['не знаю']
+        random.shuffle(answers)
+        for answer in answers:
+            posts = self.chain(post, answer)
+            if posts:
+                return ('text', answer), posts
+        return None
+
+
+class LoadTest:
+    """Нагрузочный тест: запускает бота, сервер Bot API и игроков."""
+    TIMEOUT = 10  # через сколько секунд без ответа игрок повторяет действие, с
+    MIN_THINK = 0.02  # минимальное время на ответ: бот запоминает id сообщения с кнопками
+                      # после получения ответа сервера, более быстрое нажатие он не примет, с
+
+    def __init__(self, obj_path, res_path, players=100, duration=30, think=0.1, runtime='threads',
+                 latency=0, rate_limits=True):
+        self.obj_path = obj_path
+        self.res_path = res_path
+        self.runtime = runtime
+        self.duration = duration
+        self.think = think
+        self.rate_limits = rate_limits
+        self.api = FakeBotApi(self.on_send, latency)
+        # у игроков своя копия сценария, чтобы не делить объекты с ботом
+        _, start_post = scenario_format.load_file(obj_path, res_path)
+        self.players = {user_id: Player(user_id, start_post) for user_id in range(1, players + 1)}
+        self.first_latencies = []  # задержки до первого ответа, с
+        self.full_latencies = []  # задержки до последнего сообщения ответа, с
+        self.stuck = 0  # сколько раз игроку было нечем ответить
+        self.lock = threading.Lock()
+        self.timers = []
+
+    def start_bot(self):
+        url = self.api.get_url()
+        telebot.apihelper.API_URL = url + '/bot{0}/{1}'
+        telebot.apihelper.FILE_URL = url + '/file/bot{0}/{1}'
+        send_limits = None if self.rate_limits else NO_RATE_LIMITS
+        token, start_post = scenario_format.load_file(self.obj_path, self.res_path)
+        if self.runtime == 'asyncio':
+            from telebot import asyncio_helper
+            from async_bot import AsyncBot
+            asyncio_helper.API_URL = url + '/bot{0}/{1}'
+            asyncio_helper.FILE_URL = url + '/file/bot{0}/{1}'
+            target = lambda: AsyncBot(TOKEN, start_post, send_limits=send_limits)
+        else:
+            from bot import Bot
+            target = lambda: Bot(TOKEN, start_post, send_limits=send_limits)
+        threading.Thread(target=target, daemon=True).start()
+
+    def act(self, player):
+        """Выполняет следующее действие игрока."""
+        with self.lock:
+            choice = player.choose()
+            if choice is None:
+                self.stuck += 1
+                player.post = None  # игроку нечем ответить - начинаем игру заново
+                choice = player.choose()
+            action, posts = choice
+            player.expected = len(posts)
+            player.post = posts[-1] if posts else player.post
+            player.sent_time = time.perf_counter()
+            player.first_time = None
+            player.retries = 0
+            player.action = action
+        self.send_action(player, action)
+
+    def send_action(self, player, action):
+        user = {'id': player.user_id, 'is_bot': False, 'first_name': f'player{player.user_id}'}
+        chat = {'id': player.user_id, 'type': 'private'}
+        if action == 'start':
+            message = {'message_id': self.api.new_message_id(), 'date': int(time.time()), 'chat': chat,
+                       'from': user, 'text': '/start',
+                       'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]}
+            self.api.put_update({'message': message})
+        elif action[0] == 'text':
+            message = {'message_id': self.api.new_message_id(), 'date': int(time.time()), 'chat': chat,
+                       'from': user, 'text': action[1]}
+            self.api.put_update({'message': message})
+        else:
+            message = {'message_id': player.message_id, 'date': int(time.time()), 'chat': chat,
+                       'from': {'id': 1, 'is_bot': True, 'first_name': 'bot'}, 'text': '...'}
+            self.api.put_update({'callback_query': {'id': str(self.api.new_message_id()), 'from': user,
+                                                    'message': message, 'chat_instance': '1',
+                                                    'data': action[1]}})
+
+    def on_send(self, chat_id, message_id):
+        """Вызывается сервером, когда бот отправил сообщение в чат игрока."""
+        player = self.players.get(chat_id)
+        if player is None:
+            return
+        now = time.perf_counter()
+        with self.lock:
+            player.message_id = message_id
+            if player.first_time is None:
+                player.first_time = now
+            player.expected -= 1
+            if player.expected > 0:
+                return
+            self.first_latencies.append(player.first_time - player.sent_time)
+            self.full_latencies.append(now - player.sent_time)
+        self.schedule(player)
+
+    def schedule(self, player):
+        delay = max(self.MIN_THINK, random.uniform(0, 2 * self.think))
+        timer = threading.Timer(delay, self.act, (player,))
+        timer.daemon = True
+        timer.start()
+
+    def check_timeouts(self):
+        """Повторяет действия игроков, которые слишком долго ждут ответа."""
+        now = time.perf_counter()
+        for player in self.players.values():
+            with self.lock:
+                if player.expected <= 0 or now - player.sent_time < self.TIMEOUT * (player.retries + 1):
+                    continue
+                player.retries += 1
+                action = player.action
+            self.send_action(player, action)
+
+    def run(self):
+        """Проводит тест и возвращает словарь с результатами."""
+        self.api.start()
+        self.start_bot()
+        started = time.perf_counter()
+        for player in self.players.values():
+            self.act(player)
+        while time.perf_counter() - started < self.duration:
+            time.sleep(1)
+            self.check_timeouts()
+        elapsed = time.perf_counter() - started
+        self.api.stop()
+        with self.lock:
+            first = sorted(self.first_latencies)
+            full = sorted(self.full_latencies)
+        return {
+            'players': len(self.players),
+            'seconds': elapsed,
+            'actions': len(full),
+            'actions_per_second': len(full) / elapsed,
+            'requests_per_second': self.api.requests / elapsed,
+            'first_p50': percentile(first, 50), 'first_p99': percentile(first, 99),
+            'full_p50': percentile(full, 50), 'full_p99': percentile(full, 99),
+            'stuck': self.stuck,
+        }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Нагрузочное тестирование бота.')
+    arg_parser.add_argument('project', help='путь до собранного проекта')
+    arg_parser.add_argument('--players', type=int, default=100, help='количество игроков')
+    arg_parser.add_argument('--duration', type=float, default=30, help='длительность теста, с')
+    arg_parser.add_argument('--think', type=float, default=0.1,
+                            help='среднее время на ответ игрока, с')
+    arg_parser.add_argument('--runtime', choices=['threads', 'asyncio'], default='threads')
+    arg_parser.add_argument('--api-latency', type=float, default=0,
+                            help='задержка ответа сервера Bot API, мс')
+    arg_parser.add_argument('--no-rate-limits', action='store_true',
+                            help='отключить ограничения Telegram на частоту отправки')
+    arg_parser.add_argument('--verbose', action='store_true', help='выводить сообщения бота')
+    args = arg_parser.parse_args()
+    test = LoadTest(os.path.join(args.project, 'bin', 'obj.bin'), os.path.join(args.project, 'res'),
+                    args.players, args.duration, args.think, args.runtime, args.api_latency / 1000,
+                    not args.no_rate_limits)
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            devnull = stack.enter_context(open(os.devnull, 'w', encoding='utf-8'))
+            stack.enter_context(contextlib.redirect_stdout(devnull))  # бот сообщает о каждом игроке
+        result = test.run()
+    print(f'Игроков: {result["players"]}, длительность: {result["seconds"]:.1f} с')
+    print(f'Действий игроков: {result["actions"]} ({result["actions_per_second"]:.1f} в секунду), '
+          f'запросов к Bot API: {result["requests_per_second"]:.1f} в секунду')
+    print(f'Первый ответ: p50 {result["first_p50"] * 1000:.1f} мс, p99 {result["first_p99"] * 1000:.1f} мс')
+    print(f'Полный ответ: p50 {result["full_p50"] * 1000:.1f} мс, p99 {result["full_p99"] * 1000:.1f} мс')
+    if result['stuck']:
+        print(f'Игроку нечем было ответить (игра начата заново): {result["stuck"]} раз')
+
+
+if __name__ == '__main__':
+    main()
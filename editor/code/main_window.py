@@ -201,6 +201,8 @@ class MainWindow(wx.Frame):
         self.res_b.Enable()
         self.res_rm_b.Enable()
         self.compile_and_run_item.Enable()
+        # набор ресурсов мог измениться - перепроверяем сценарий
+        self.editor.scheduleValidation()
 
 
     def onCreateClick(self, event):
@@ -246,13 +248,18 @@ class MainWindow(wx.Frame):
 
 
     def onStartClick(self, event):
-        if self.editor.analyzed and not self.project.is_alive():
+        if self.editor.getAnalyzed() and not self.project.is_alive():
             self.project.run(recompile=False, new_console=True)
 
 
     def onCompileClick(self, event):
-        if self.editor.analyzed and not self.project.is_alive():
-            self.project.save(self.editor.GetText())
+        if not self.editor.getAnalyzed():
+            return
+        self.project.save(self.editor.GetText())
+        if self.project.is_alive():
+            # бот запущен - пересобираем проект, бот переключится на новый сценарий сам
+            self.project.build()
+        else:
             self.project.run(recompile=True, new_console=True)
 
 
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+
+def file_hash(file_path):
+    """Возвращает хэш содержимого файла."""
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class MediaCache:
+    """Кэш идентификаторов файлов Telegram (file_id).
+
+    При первой загрузке файла Telegram возвращает его file_id, по которому файл
+    можно отправлять повторно без загрузки. Идентификаторы хранятся по виду отправки
+    и хэшу содержимого файла и сохраняются на диск, поэтому переживают перезапуск бота.
+    Вид отправки нужен потому, что один и тот же файл, отправленный, например, видео
+    и видеосообщением, получает разные file_id, и чужой file_id Telegram не примет.
+    """
+    # атрибуты сообщения telebot.types.Message, в которых может лежать отправленный файл;
+    # animation проверяется раньше document, т.к. у гифок заполнены оба поля
+    FILE_ATTRS = ['video_note', 'voice', 'audio', 'animation', 'video', 'sticker', 'document']
+
+    def __init__(self, path=None):
+        """Создаёт кэш.
+
+        Параметры:
+        path - путь до файла, в котором хранится кэш (если None, кэш живёт только в памяти)
+        """
+        self.path = path
+        self.file_ids = {}  # словарь вида {"вид:хэш_содержимого": file_id}
+        self.hashes = {}  # словарь вида {путь: (время_изменения, размер, хэш_содержимого)}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Загружает кэш с диска."""
+        if self.path is None or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                file_ids = json.load(f)
+        except (OSError, ValueError):
+            # файл с кэшем повреждён - начинаем с пустого кэша
+            return
+        # ключи без вида отправки записаны старой версией - по ним нельзя понять тип file_id
+        self.file_ids = {key: file_id for key, file_id in file_ids.items() if ':' in key}
+
+    def dump(self):
+        """Сохраняет кэш на диск."""
+        if self.path is None:
+            return
+        # у каждого процесса бота (см. supervisor) свой временный файл в той же папке,
+        # иначе процессы писали бы в один файл и переименовывали чужую запись
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.',
+                                        dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with open(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.file_ids, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def get_hash(self, file_path):
+        """Возвращает хэш содержимого файла (пересчитывается только при изменении файла)."""
+        stat = os.stat(file_path)
+        cached = self.hashes.get(file_path)
+        if cached is not None and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            return cached[2]
+        content_hash = file_hash(file_path)
+        self.hashes[file_path] = (stat.st_mtime, stat.st_size, content_hash)
+        return content_hash
+
+    def get_key(self, kind, file_path):
+        """Возвращает ключ кэша для файла, отправляемого видом kind."""
+        return f'{kind}:{self.get_hash(file_path)}'
+
+    def get(self, kind, file_path):
+        """Возвращает file_id для файла, отправляемого видом kind (например, названием класса
+        поста), или None, если файл так ещё не загружался."""
+        with self.lock:
+            return self.file_ids.get(self.get_key(kind, file_path))
+
+    def put(self, kind, file_path, file_id):
+        """Запоминает file_id, полученный при загрузке файла видом kind."""
+        if file_id is None:
+            return
+        with self.lock:
+            key = self.get_key(kind, file_path)
+            if self.file_ids.get(key) == file_id:
+                return
+            self.file_ids[key] = file_id
+            self.dump()
+
+    def remove(self, kind, file_path):
+        """Забывает file_id файла (например, если Telegram его не принял)."""
+        with self.lock:
+            if self.file_ids.pop(self.get_key(kind, file_path), None) is not None:
+                self.dump()
+
+    @staticmethod
+    def get_file_id(message):
+        """Возвращает file_id файла, прикреплённого к сообщению telebot.types.Message."""
+        if message is None:
+            return None
+        if message.photo:
+            return message.photo[-1].file_id  # фото наибольшего размера
+        for attr in MediaCache.FILE_ATTRS:
+            media = getattr(message, attr, None)
+            if media is not None:
+                return media.file_id
+        return None
@@ -3,11 +3,16 @@ import cv2
 from PIL import Image, ImageSequence
 import shutil
 import os
+import hashlib
 import speech_recognition as sr  # pip install SpeechRecognition
+import recognizers
 import subprocess
 from moviepy.video.io.VideoFileClip import VideoFileClip
 import config as cfg
 
+# результаты распознавания голосовых сообщений (общие для всех MediaConverter)
+recognition_cache = recognizers.RecognitionCache()
+
 
 class MediaConverter:
     def __init__(self):
@@ -92,22 +97,62 @@ class MediaConverter:
 
 
     UNKNOWN = '#'
+    VOICE_SAMPLE_RATE = 16000  # частота дискретизации звука для распознавания, Гц
+
     def voiceToText(self, audio_ogg):
-        audio_wav = audio_ogg + '.wav'
-        command = f'{cfg.FFMPEG_PATH}*-loglevel*quiet*-i*{audio_ogg}*-y*-c:a*pcm_s16le*{audio_wav}'
-        process = subprocess.run(command.split('*'))
-        r = sr.Recognizer()
-        with sr.AudioFile(audio_wav) as source:
-            audio = r.record(source)
-        try:
-            text = r.recognize_google(audio, language = 'ru-RU')
-        except:
-            text = self.UNKNOWN
-        os.remove(audio_wav)
+        """Распознаёт голосовое сообщение из файла (файл после распознавания удаляется)."""
+        with open(audio_ogg, 'rb') as f:
+            data = f.read()
         os.remove(audio_ogg)
+        return self.voiceDataToText(data)
+
+    def voiceDataToText(self, data, recognizer=None):
+        """Распознаёт голосовое сообщение, переданное байтами (в любом формате, который
+        понимает ffmpeg), и возвращает текст или UNKNOWN.
+
+        Файлы не создаются: ffmpeg получает сообщение через stdin и возвращает через stdout
+        несжатый звук (16 бит, моно), который сразу передаётся распознавателю. Результаты
+        запоминаются в recognition_cache, поэтому повторное сообщение не распознаётся заново.
+
+        Параметры:
+        recognizer - распознаватель (recognizers.Recognizer); по умолчанию - из настроек
+        """
+        try:
+            recognizer = recognizer or recognizers.get_default()
+        except Exception as e:
+            # распознаватель из настроек не создаётся (например, не установлен vosk)
+            print(f'Не удалось распознать голосовое сообщение: {e}')
+            return self.UNKNOWN
+        key = (recognizer.get_cache_key(), hashlib.sha256(data).digest())
+        found, text = recognition_cache.get(key)
+        if not found:
+            command = [cfg.FFMPEG_PATH, '-loglevel', 'quiet', '-i', 'pipe:0', '-f', 's16le',
+                       '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(self.VOICE_SAMPLE_RATE), 'pipe:1']
+            process = subprocess.run(command, input=data, stdout=subprocess.PIPE)
+            if process.returncode != 0 or not process.stdout:
+                return self.UNKNOWN
+            audio = sr.AudioData(process.stdout, self.VOICE_SAMPLE_RATE, 2)
+            try:
+                text = recognizer.recognize(audio)
+            except Exception as e:
+                # ошибка распознавателя (например, нет сети) не запоминается
+                print(f'Не удалось распознать голосовое сообщение: {e}')
+                return self.UNKNOWN
+            recognition_cache.put(key, text)
+        if text is None:
+            return self.UNKNOWN
         return text
 
 
+    TO_OGG_FORMATS = ['.mp3', '.wav']  # форматы, которые можно конвертировать в .ogg
+    TO_MP3_FORMATS = ['.wav', '.ogg']  # форматы, которые можно конвертировать в .mp3
+
+    def checkConvertible(self, path, formats):
+        """Выбрасывает исключение, если файл нельзя конвертировать (сам файл не конвертируется)."""
+        if not os.path.splitext(path)[1] in formats:
+            raise Exception(f'Не удалось преобразовать {path}: поддерживаются только форматы {", ".join(formats)}.')
+
+
     def convertToOgg(self, path):
         """Конвертирует файл в формат .ogg и возвращает путь до нового файла."""
         new_path, fmat = os.path.splitext(path)
@@ -132,3 +177,17 @@ class MediaConverter:
             raise Exception(f'Не удалось преобразовать {path} к формату .mp3.')
         process = subprocess.run(command.split('*'))
         return new_path
+
+
+def convert(path, method, *args):
+    """Выполняет метод method класса MediaConverter для файла и возвращает путь до результата.
+
+    Функция уровня модуля, чтобы её можно было выполнять в пуле процессов. Если метод изменяет
+    файл на месте и ничего не возвращает, результатом считается сам файл.
+    """
+    result = getattr(MediaConverter(), method)(path, *args)
+    if result is None:
+        result = path
+    if not os.path.isfile(result):
+        raise Exception(f'Не удалось преобразовать {path}.')
+    return result
@@ -0,0 +1,163 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Метрики работы бота в текстовом формате Prometheus.
+#
+# Пока метрики не включены (start_server), места замеров только проверяют флаг enabled:
+#     if metrics.enabled:
+#         start = time.perf_counter()
+#     ...
+#     if metrics.enabled:
+#         metrics.SEND_SECONDS.observe(time.perf_counter() - start, 'TextPost')
+# поэтому выключенные метрики почти ничего не стоят.
+
+enabled = False  # собираются ли метрики
+
+
+class Metric:
+    """Метрика с необязательной меткой (например, типом поста)."""
+    TYPE = None
+
+    def __init__(self, name, description, label=None):
+        """Параметры:
+        name - название метрики
+        description - описание метрики
+        label - название метки; значение метки передаётся при каждом изменении метрики
+        """
+        self.name = name
+        self.description = description
+        self.label = label
+        self.values = {}  # словарь вида {значение_метки: значение}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def format_labels(self, value, extra=''):
+        labels = []
+        if self.label is not None:
+            labels.append(f'{self.label}="{value}"')
+        if extra:
+            labels.append(extra)
+        return '{' + ','.join(labels) + '}' if labels else ''
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.TYPE}']
+        with self.lock:
+            items = sorted(self.values.items(), key=lambda item: str(item[0]))
+        for value, data in items:
+            lines += self.render_value(value, data)
+        return lines
+
+
+class Counter(Metric):
+    """Счётчик событий. По соглашению Prometheus название счётчика оканчивается на _total
+    (и в описании метрики, и в значениях)."""
+    TYPE = 'counter'
+
+    def __init__(self, name, description, label=None):
+        super().__init__(name, description, label)
+        if label is None:
+            self.values[None] = 0  # счётчик без метки виден и до первого события
+
+    def inc(self, label_value=None, amount=1):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def render_value(self, value, data):
+        return [f'{self.name}{self.format_labels(value)} {data}']
+
+
+class Gauge(Metric):
+    """Текущее значение, которое вычисляется функцией при каждом запросе метрик."""
+    TYPE = 'gauge'
+
+    def set_function(self, function, label_value=None):
+        with self.lock:
+            self.values[label_value] = function
+
+    def render_value(self, value, function):
+        return [f'{self.name}{self.format_labels(value)} {function()}']
+
+
+class Histogram(Metric):
+    """Распределение длительностей (в секундах) по корзинам."""
+    TYPE = 'histogram'
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, description, label=None, buckets=BUCKETS):
+        super().__init__(name, description, label)
+        self.buckets = buckets
+
+    def observe(self, seconds, label_value=None):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            data = self.values.get(label_value)
+            if data is None:
+                # [количества по корзинам (последняя - больше всех границ), сумма]
+                data = self.values[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            data[0][index] += 1
+            data[1] += seconds
+
+    def render_value(self, value, data):
+        counts, total = data
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            le = f'le="{bound}"'
+            lines.append(f'{self.name}_bucket{self.format_labels(value, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{self.format_labels(value)} {total}')
+        lines.append(f'{self.name}_count{self.format_labels(value)} {cumulative}')
+        return lines
+
+
+REGISTRY = []  # все метрики
+
+UPDATE_SECONDS = Histogram('tgbot_update_seconds', 'Время обработки обновления.', 'handler')
+GET_NEXT_SECONDS = Histogram('tgbot_get_next_seconds', 'Время поиска следующего поста по ответу игрока.')
+SEND_SECONDS = Histogram('tgbot_send_seconds', 'Время отправки поста.', 'post_type')
+VOICE_SECONDS = Histogram('tgbot_voice_recognition_seconds', 'Время распознавания голосового сообщения.')
+SEND_FAILURES = Counter('tgbot_send_failures_total', 'Сообщения, которые не удалось отправить.')
+SEND_RETRIES = Counter('tgbot_send_retries_total', 'Повторные отправки после ответа 429 или временной ошибки.')
+GAMES = Counter('tgbot_games_total', 'Начатые и пройденные игры.', 'event')
+ACTIVE_SESSIONS = Gauge('tgbot_active_sessions', 'Игроки с сессией в памяти.')
+
+
+def render():
+    """Возвращает все метрики в текстовом формате Prometheus."""
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+def start_server(port, host='127.0.0.1'):
+    """Включает сбор метрик и запускает HTTP-сервер, отдающий их по адресу /metrics.
+
+    По умолчанию сервер доступен только с этого компьютера. Возвращает сервер.
+    """
+    global enabled
+    enabled = True
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
@@ -8,13 +8,23 @@ if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
 import pymorphy2  # pip install pymorphy2
 import num2words  # pip install num2words
 import re
+import threading
 from pyphrasy.inflect import PhraseInflector  # pip install pyphrasy
 
 class StringsAnalyser:
     CASES = ['nomn', 'gent', 'datv', 'accs', 'ablt', 'loct', 'voct', 'gen2', 'acc2', 'loc2']  # падежи
 
     def __init__(self):
-        self.morph = pymorphy2.MorphAnalyzer()
+        self.morph = None  # словари pymorphy2 загружаются при первой проверке ключевого слова
+        self.lock = threading.Lock()
+
+    def get_morph(self):
+        """Возвращает морфологический анализатор, загружая его при первом обращении."""
+        if self.morph is None:
+            with self.lock:
+                if self.morph is None:
+                    self.morph = pymorphy2.MorphAnalyzer()
+        return self.morph
 
     def replace_numbers_with_words(self, string):
         """Заменяет все числа в строке словами."""
@@ -40,7 +50,7 @@ class StringsAnalyser:
 
     def get_all_forms(self, phrase):
         """Возвращает список форм слова (словосочетания)."""
-        inflector = PhraseInflector(self.morph)
+        inflector = PhraseInflector(self.get_morph())
         forms = []
         for case in self.CASES:
             forms.append(inflector.inflect(phrase, case))
@@ -63,41 +73,55 @@ class StringsAnalyser:
             return self.WORDS_ONLY
         return self.MIXED
 
-    def check(self, received, requiered, is_keyword):
-        """Проверяет, содержится (или совпадает) строка requiered в строке received."""
-        received = received.lower()
-        requiered = requiered.lower()
-        contains_digits = lambda s: re.findall(r'\d+', s)
-        try:
-            cd_requiered = contains_digits(requiered)
-        except:
-            cd_requiered = False
+    def contains_digits(self, s):
+        """Возвращает True, если в строке есть цифры."""
         try:
-            cd_received = contains_digits(received)
+            return bool(re.findall(r'\d+', s))
         except:
-            cd_received = False
+            return False
+
+    def get_required_forms(self, requiered, is_keyword):
+        """Возвращает нормализованные формы строки requiered, с которыми сравнивается ответ игрока,
+        если в ответе нет цифр (либо они уже заменены словами).
+
+        Формы зависят только от строки из сценария, поэтому вычисляются один раз при сборке
+        проекта и передаются в check, чтобы не склонять фразу при каждом сообщении игрока.
+        """
+        requiered = requiered.lower()
+        if self.contains_digits(requiered):
+            # переводим ключ слово в слова и склоняем
+            requiered = self.replace_numbers_with_words(requiered)
+            return [form.lower() for form in self.get_all_forms(requiered)]
+        if is_keyword:
+            # склоняем ключ слово
+            return [form.lower() for form in self.get_all_forms(requiered)]
+        return [requiered]
+
+    def check(self, received, requiered, is_keyword, forms=None):
+        """Проверяет, содержится (или совпадает) строка requiered в строке received.
+
+        Параметры:
+        forms - формы строки requiered, заранее вычисленные функцией get_required_forms
+                (если None, вычисляются при каждой проверке)
+        """
+        received = received.lower()
+        requiered = requiered.lower()
+        cd_requiered = self.contains_digits(requiered)
+        cd_received = self.contains_digits(received)
         if cd_requiered and cd_received:
             # не переводим не склоняем, ищем
             if is_keyword:
                 return received.find(requiered) != -1
-            return received.lower() == requiered.lower()
-        elif cd_requiered and not cd_received:
-            # переводим ключ слово, склоняем ключ слово, ищем
-            requiered = self.replace_numbers_with_words(requiered)
-            forms = self.get_all_forms(requiered)
-            if is_keyword:
-                return any([received.find(form) != -1 for form in forms])
-            return any([received.lower() == form.lower() for form in forms])
-        elif not cd_requiered and cd_received:
-            # переводим полученное, склоняем если ключевое, ищем
+            return received == requiered
+        if forms is None:
+            forms = self.get_required_forms(requiered, is_keyword)
+        if cd_received:
+            # переводим полученное
             received = self.replace_numbers_with_words(received)
-            if is_keyword:
-                forms = self.get_all_forms(requiered)
-                return any([received.find(form) != -1 for form in forms])
-            return received.lower() == requiered.lower()
-        elif not cd_requiered and not cd_received:
-            # склоняем ключ если ключевое, ищем
-            if is_keyword:
-                forms = self.get_all_forms(requiered)
-                return any([received.find(form) != -1 for form in forms])
-            return received.lower() == requiered.lower()
+        if is_keyword:
+            return any([received.find(form) != -1 for form in forms])
+        return received in forms
+
+# общий для всего процесса анализатор: словари pymorphy2 занимают много памяти,
+# поэтому все переходы используют один и тот же экземпляр
+SHARED_ANALYSER = StringsAnalyser()
@@ -3,14 +3,19 @@ from code_analyzer import CodeAnalyzer
 from bot_message import *
 import os.path
 import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+import media_converter
+import scenario_graph
 
 class Scene:
     """Класс сцены Telegram-бота"""
 
-    def __init__(self, name, messages, waitingElements):
+    def __init__(self, name, messages, waitingElements, line=None):
         self.sceneMessages = messages
         self.name = name
         self.trash = waitingElements
+        self.line = line  # номер строки, на которой объявлена сцена
 
     def getName(self):
         return self.name
@@ -19,29 +24,62 @@ class Scene:
         return self.sceneMessages
 
 
-def getScenery(words, resPath):
+def getScenery(words, resPath, errors=None, cache=None, profile=None):
+    """Собирает сценарий из списка кортежей, полученного функцией CodeAnalyzer.get_words_for_parsing.
+
+    Параметры:
+    words - список кортежей вида (слово, номер_строки, тип)
+    resPath - путь до папки с ресурсами
+    errors - если передан список, сценарий только проверяется: медиафайлы не конвертируются,
+             формы ключевых слов не вычисляются, а ошибки в ресурсах добавляются в список
+             в виде кортежей (номер_строки, текст_ошибки) и разбор продолжается; сообщения
+             о ходе сборки при этом не выводятся (проверка запускается при каждой правке)
+    cache - кэш сборки (build_cache.BuildCache): если передан, медиафайлы конвертируются и формы
+            ключевых слов вычисляются только для изменившихся с прошлой сборки файлов и слов
+    profile - профиль сборки (build_profile.BuildProfile): если передан, в него записывается
+              время этапов сборки, сцен и конвертаций медиафайлов
+    """
+    convertMedia = errors is None
     elements = []
     token = ""
     text = ""
 
     # для сцен
     currentSceneName = ""
+    currentSceneLine = None
     scenes = []
     currentScene = None
     
     waitSomething = []
 
-    def getSceneByName(sceneName):
-        for sc in scenes:
-            if sc.getName()==sceneName:
-                return sc
+    mediaPosts = []  # список кортежей вида (медиапост, номер_строки)
+
+    def log(message):
+        """Выводит сообщение о ходе сборки (в режиме проверки ничего не выводится)."""
+        if errors is None:
+            print(message)
+
+    def createMediaPost(postClass, line, *args, **kwargs):
+        """Создаёт медиапост (без конвертации файла). В режиме проверки ошибка запоминается,
+        а вместо поста возвращается заглушка того же типа, чтобы продолжить разбор."""
+        try:
+            el = postClass(*args, **kwargs)
+            mediaPosts.append((el, line))
+            return el
+        except Exception as e:
+            if errors is None:
+                raise Exception (str(e)+f" Строка {line}")
+            errors.append((line, str(e)))
+            el = postClass.__new__(postClass)
+            Post.__init__(el, args[0])
+            return el
 
     # для группы
     groupMessageFlag = False
     textFound = False
     groupMessage = []
     
-    print('=== НАЧИНАЕМ СБОРКУ ПРОЕКТА. СОБИРАЕМ СЦЕНЫ... ===')
+    log('=== НАЧИНАЕМ СБОРКУ ПРОЕКТА. СОБИРАЕМ СЦЕНЫ... ===')
     ind = 0 # индекс текущего кортежа
     while True:
         if words[ind][0]==CodeAnalyzer.BOT and words[ind][2]==CodeAnalyzer.KEYWORD:
@@ -59,6 +97,9 @@ def getScenery(words, resPath):
         elif words[ind][0]==CodeAnalyzer.BOT_END and words[ind][2]==CodeAnalyzer.KEYWORD:
             break
         elif words[ind][0]==CodeAnalyzer.SCENE and words[ind][2]==CodeAnalyzer.KEYWORD:
+            currentSceneLine = words[ind][1]
+            if profile is not None:
+                sceneStart = time.perf_counter()
             ind += 1
             if words[ind][2]==CodeAnalyzer.STRING:
                currentSceneName =  words[ind][0][1:len(words[ind][0])-1]
@@ -71,7 +112,9 @@ def getScenery(words, resPath):
             else:
                  raise Exception(f'Ожидилась строка в кавычках после ключевого слова {CodeAnalyzer.SCENE}. Строка {words[ind-1][1]}')
         elif words[ind][0]==CodeAnalyzer.SCENE_END and words[ind][2]==CodeAnalyzer.KEYWORD:
-            scenes.append(Scene(currentSceneName, elements, waitSomething))
+            scenes.append(Scene(currentSceneName, elements, waitSomething, currentSceneLine))
+            if profile is not None:
+                profile.add_scene_time(currentSceneName, currentSceneLine, time.perf_counter() - sceneStart)
             elements = []
             # print(waitSomething)
             waitSomething = []
@@ -95,10 +138,7 @@ def getScenery(words, resPath):
                  raise Exception(f'Ожидилась строка(и) в кавычках после ключевого слова {CodeAnalyzer.TEXT}. Строка {words[ind-1][1]}')
         elif words[ind][0]==CodeAnalyzer.PHOTO and words[ind][2]==CodeAnalyzer.KEYWORD:
             ind += 1
-            try:
-                el = ImagePost(resPath+words[ind][0][1:len(words[ind][0])-1])
-            except Exception as e:
-                raise Exception (str(e)+f" Строка {words[ind][1]}")
+            el = createMediaPost(ImagePost, words[ind][1], resPath+words[ind][0][1:len(words[ind][0])-1])
             if groupMessageFlag:
                 groupMessage.append(el)
             else:
@@ -109,20 +149,14 @@ def getScenery(words, resPath):
             #        raise Exception(f'Ожидилась строка в кавычках после ключевого слова {CodeAnalyzer.PHOTO}. Строка {words[ind-1][1]}')                
         elif words[ind][0]==CodeAnalyzer.VOICE and words[ind][2]==CodeAnalyzer.KEYWORD:
             ind += 1
-            try:
-                elements.append(VoicePost(resPath+words[ind][0][1:len(words[ind][0])-1]))
-            except Exception as e:
-                raise Exception (str(e)+f" Строка {words[ind][1]}")
+            elements.append(createMediaPost(VoicePost, words[ind][1], resPath+words[ind][0][1:len(words[ind][0])-1], convert=False))
             #print(words[ind][0][1:len(words[ind][0])-1])
             ind += 1
             #if words[ind][2]==CodeAnalyzer.KEYWORD:
             #    raise Exception(f'Ожидилась строка в кавычках после ключевого слова {CodeAnalyzer.VOICE}. Строка {words[ind-1][1]}')                
         elif words[ind][0]==CodeAnalyzer.AUDIO and words[ind][2]==CodeAnalyzer.KEYWORD:
             ind += 1 
-            try:
-                el = AudioPost(resPath+words[ind][0][1:len(words[ind][0])-1])                    
-            except Exception as e:
-                raise Exception (str(e)+f" Строка {words[ind][1]}")
+            el = createMediaPost(AudioPost, words[ind][1], resPath+words[ind][0][1:len(words[ind][0])-1], convert=False)
             if groupMessageFlag:
                 groupMessage.append(el)
             else:
@@ -133,10 +167,7 @@ def getScenery(words, resPath):
             #   raise Exception(f'Ожидилась строка в кавычках после ключевого слова {CodeAnalyzer.AUDIO}. Строка {words[ind-1][1]}')                
         elif words[ind][0]==CodeAnalyzer.VIDEO and words[ind][2]==CodeAnalyzer.KEYWORD:
             ind += 1 
-            try:
-                el = VideoPost(resPath+words[ind][0][1:len(words[ind][0])-1])
-            except Exceprion as e:
-                raise Exception (str(e)+f" Строка {words[ind][1]}")
+            el = createMediaPost(VideoPost, words[ind][1], resPath+words[ind][0][1:len(words[ind][0])-1])
             if groupMessageFlag:
                 groupMessage.append(el)
             else:
@@ -147,10 +178,7 @@ def getScenery(words, resPath):
             #    raise Exception(f'Ожидилась строка в кавычках после ключевого слова {CodeAnalyzer.VIDEO}. Строка {words[ind-1][1]}')            
         elif words[ind][0]==CodeAnalyzer.ROUND and words[ind][2]==CodeAnalyzer.KEYWORD:
              ind += 1   
-             try:
-                 el = RoundPost(resPath+words[ind][0][1:len(words[ind][0])-1])
-             except Exception as e:
-                 raise Exception (str(e)+f" Строка {words[ind][1]}")
+             el = createMediaPost(RoundPost, words[ind][1], resPath+words[ind][0][1:len(words[ind][0])-1], convert=False)
              elements.append(el)
              #print("Круг "+words[ind][0][1:len(words[ind][0])-1])
              ind += 1
@@ -158,20 +186,14 @@ def getScenery(words, resPath):
              #   raise Exception(f'Ожидилась строка в кавычках после ключевого слова {CodeAnalyzer.ROUND}. Строка {words[ind-1][1]}')             
         elif words[ind][0]==CodeAnalyzer.GIF and words[ind][2]==CodeAnalyzer.KEYWORD:
             ind += 1  
-            try:
-                elements.append(GifPost(resPath+words[ind][0][1:len(words[ind][0])-1]))
-            except Exception as e:
-                raise Exception (str(e)+f" Строка {words[ind][1]}")
+            elements.append(createMediaPost(GifPost, words[ind][1], resPath+words[ind][0][1:len(words[ind][0])-1]))
             #print(words[ind][0][1:len(words[ind][0])-1])
             ind += 1
             #if words[ind][2]==CodeAnalyzer.KEYWORD:
             #    raise Exception(f'Ожидилась строка в кавычках после ключевого слова {CodeAnalyzer.GIF}. Строка {words[ind-1][1]}')            
         elif words[ind][0]==CodeAnalyzer.DOC and words[ind][2]==CodeAnalyzer.KEYWORD:
             ind += 1
-            try:
-                el = DocPost(resPath+words[ind][0][1:len(words[ind][0])-1])
-            except Exception as e:
-                raise Exception (str(e)+f" Строка {words[ind][1]}")
+            el = createMediaPost(DocPost, words[ind][1], resPath+words[ind][0][1:len(words[ind][0])-1])
             if groupMessageFlag:
                 groupMessage.append(el)
             else:
@@ -182,10 +204,7 @@ def getScenery(words, resPath):
             #    raise Exception(f'Ожидилась строка в кавычках после ключевого слова {CodeAnalyzer.DOC}. Строка {words[ind-1][1]}')            
         elif words[ind][0]==CodeAnalyzer.STICKER and words[ind][2]==CodeAnalyzer.KEYWORD:
             ind += 1  
-            try:
-                elements.append(StickerPost(resPath+words[ind][0][1:len(words[ind][0])-1]))
-            except Exception as e:
-                raise Exception (str(e)+f" Строка {words[ind][1]}")
+            elements.append(createMediaPost(StickerPost, words[ind][1], resPath+words[ind][0][1:len(words[ind][0])-1]))
             #print(words[ind][0][1:len(words[ind][0])-1])
             ind += 1
             #if words[ind][2]==CodeAnalyzer.KEYWORD:
@@ -270,20 +289,133 @@ def getScenery(words, resPath):
             ind += 1
             if ind>len(words)-1:
                 break
-    print('=== СЦЕНЫ СОБРАНЫ. УСТАНАВЛИВАЕМ ПЕРЕХОДЫ... ===')
+    if profile is not None:
+        profile.lap('parse')
+    # переходы разбираются до конвертации медиафайлов: недостижимые сцены не собираются
+    scenes_by_name = index_scenes(scenes)
     remove_quotes(scenes)
-    transitions = get_transitions(scenes)
-    set_transitions(scenes, transitions)
-    print('=== ПЕРЕХОДЫ УСТАНОВЛЕНЫ. ПРОЕКТ СОБРАН ===')
+    transitions = get_transitions(scenes, scenes_by_name)
+    if profile is not None:
+        profile.lap('get_transitions')
+    if convertMedia:
+        graph = scenario_graph.ScenarioGraph(scenes, transitions)
+        report = graph.analyze()
+        print(graph.format_report(report))
+        if report['unreachable']:
+            scenes, transitions = scenario_graph.prune(scenes, transitions, report['reachable'])
+            mediaPosts = get_scene_media(scenes, mediaPosts)
+        if profile is not None:
+            profile.lap('graph')
+        preprocess_media(mediaPosts, cache, profile)
+        if profile is not None:
+            profile.lap('media')
+    log('=== СЦЕНЫ СОБРАНЫ. УСТАНАВЛИВАЕМ ПЕРЕХОДЫ... ===')
+    set_transitions(scenes, transitions, scenes_by_name, precompute=convertMedia, cache=cache,
+                    profile=profile)
+    if profile is not None:
+        profile.lap('set_transitions')
+    log('=== ПЕРЕХОДЫ УСТАНОВЛЕНЫ. ПРОЕКТ СОБРАН ===')
     first_message = scenes[0].getSceneMessages()[0]
     return [token, first_message]
 
 
-def find_scene_by_name(scenes, name):
+def get_scene_media(scenes, media_posts):
+    """Возвращает медиапосты из списка media_posts (кортежей вида (медиапост, номер_строки)),
+    которые входят в сцены scenes (в том числе в сгруппированные посты)."""
+    post_ids = set()
     for scene in scenes:
-        if scene.getName() == name:
-            return scene
-    return None
+        for post in scene.getSceneMessages():
+            post_ids.add(id(post))
+            if isinstance(post, GroupPost):
+                post_ids.update(id(group_post) for group_post in post.content)
+    return [(post, line) for post, line in media_posts if id(post) in post_ids]
+
+
+def preprocess_media(media_posts, cache=None, profile=None):
+    """Конвертирует файлы медиапостов в пуле процессов (по процессу на ядро процессора).
+
+    Параметры:
+    media_posts - список кортежей вида (медиапост, номер_строки)
+    cache - кэш сборки: файлы, не изменившиеся с прошлой сборки, не конвертируются
+    profile - профиль сборки: в него записывается время каждой конвертации
+    """
+    # конвертации одного файла выполняются последовательно в одной задаче,
+    # чтобы несколько процессов не записывали один и тот же файл
+    jobs = {}  # словарь вида {путь_до_файла: [(вид_конвертации, метод, аргументы, посты, строка)]}
+    source_hashes = {}  # словарь вида {путь_до_файла: хэш_до_конвертации}
+    for post, line in media_posts:
+        path = post.content
+        if cache is not None:
+            cache.add_file(path)
+        conversion = post.get_conversion()
+        if conversion is None:
+            continue
+        if cache is not None:
+            result = cache.get_converted(conversion[0], path)
+            if result is not None:
+                post.content = result
+                cache.add_file(result)
+                continue
+            source_hashes[path] = cache.get_hash(path)
+        file_jobs = jobs.setdefault(path, [])
+        for job in file_jobs:
+            if job[:3] == conversion:
+                job[3].append(post)
+                break
+        else:
+            file_jobs.append((*conversion, [post], line))
+    if not jobs:
+        return
+    print(f'=== КОНВЕРТИРУЕМ МЕДИАФАЙЛЫ ({len(jobs)})... ===')
+    with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as pool:
+        futures = {path: pool.submit(convert_file, path, [job[1:3] for job in file_jobs])
+                   for path, file_jobs in jobs.items()}
+        # ошибки сообщаются в порядке строк сценария
+        for path, file_jobs in sorted(jobs.items(), key=lambda item: item[1][0][4]):
+            try:
+                results = futures[path].result()
+            except Exception as e:
+                for future in futures.values():
+                    future.cancel()
+                raise Exception(str(e)+f" Строка {file_jobs[0][4]}")
+            for (kind, method, _, posts, _), (result, seconds) in zip(file_jobs, results):
+                if profile is not None:
+                    profile.add_resource_time(path, method, seconds)
+                for post in posts:
+                    post.content = result
+                if cache is not None:
+                    cache.put_converted(kind, path, source_hashes[path], result)
+                    cache.add_file(result)
+
+
+def convert_file(path, conversions):
+    """Выполняет конвертации файла по очереди и возвращает список кортежей
+    (путь_до_результата, время_конвертации).
+
+    Параметры:
+    path - путь до файла
+    conversions - список кортежей вида (метод_MediaConverter, аргументы_метода)
+    """
+    results = []
+    for method, args in conversions:
+        start = time.perf_counter()
+        result = media_converter.convert(path, method, *args)
+        results.append((result, time.perf_counter() - start))
+    return results
+
+
+def index_scenes(scenes):
+    """Возвращает словарь вида {название_сцены: сцена}. Названия сцен не должны повторяться."""
+    scenes_by_name = {}
+    for scene in scenes:
+        if scene.getName() in scenes_by_name:
+            raise Exception(f'Сцена {scene.getName()} уже объявлена. Строка {scene.line}.')
+        scenes_by_name[scene.getName()] = scene
+    return scenes_by_name
+
+
+def find_scene_by_name(scenes_by_name, name):
+    return scenes_by_name.get(name)
 
 
 def remove_quotes(scenes):
@@ -294,7 +426,7 @@ def remove_quotes(scenes):
                 scene.trash[i] = (words[i][0].replace('"', ''), words[i][1], words[i][2])
 
 
-def get_transitions(scenes):
+def get_transitions(scenes, scenes_by_name):
     transitions = []  # [(from_scene_name, requiered, next_scene_name, is_keyword)]
     for scene in scenes:
         if scene.trash:
@@ -325,7 +457,7 @@ def get_transitions(scenes):
                                 is_keyword = False
                             requiered = content[i][0]
                         elif next_scene is None:
-                            if find_scene_by_name(scenes, content[i][0]) is None:
+                            if find_scene_by_name(scenes_by_name, content[i][0]) is None:
                                 raise Exception(f'Сцена {content[i][0]} не найдена. Строка {content[i][1]}.')
                             next_scene = content[i][0]
                         else:
@@ -375,7 +507,7 @@ def get_transitions(scenes):
                         if requiered is None:
                             requiered = content[i][0]
                         elif next_scene is None:
-                            if find_scene_by_name(scenes, content[i][0]) is None:
+                            if find_scene_by_name(scenes_by_name, content[i][0]) is None:
                                 raise Exception(f'Сцена {content[i][0]} не найдена. Строка {content[i][1]}.')
                             next_scene = content[i][0]
                         else:
@@ -393,25 +525,42 @@ def get_transitions(scenes):
                     raise Exception(f'Пустой переход. Строка {scene.trash[0][1]}.')
                 if scene.trash[1][2] != CodeAnalyzer.STRING:
                     raise Exception(f'Ожидалось название сцены для перехода. Строка {scene.trash[0][1]}.')
-                if find_scene_by_name(scenes, scene.trash[1][0]) is None:
+                if find_scene_by_name(scenes_by_name, scene.trash[1][0]) is None:
                     raise Exception(f'Сцена {scene.trash[1][0]} не найдена. Строка {scene.trash[1][1]}.')
                 transitions.append((scene.name, Transition.SEND_IMMEDIATELY, scene.trash[1][0], scene.trash[1][0]))
     return transitions
 
 
-def set_transitions(scenes, transitions):
+def set_transitions(scenes, transitions, scenes_by_name, precompute=True, cache=None, profile=None):
     # устанавливаем безусловные переходы внутри сцены
     for scene in scenes:
         posts = scene.getSceneMessages()
+        for i, post in enumerate(posts):
+            post.scene = scene.name
+            post.index = i
+            if isinstance(post, ButtonsPost):
+                for position, button in enumerate(post.content):
+                    button.set_id(scene.name, i, position)
         stop = len(posts)-1
         for i in range(stop):
             posts[i].add_next(posts[i+1])
     # устанавливаем условные переходы между сценами
     for from_scene_name, requiered, next_scene_name, is_keyword in transitions:
-        from_post = find_scene_by_name(scenes, from_scene_name).getSceneMessages()[-1]
-        next_post = find_scene_by_name(scenes, next_scene_name).getSceneMessages()[0]
+        from_post = find_scene_by_name(scenes_by_name, from_scene_name).getSceneMessages()[-1]
+        next_post = find_scene_by_name(scenes_by_name, next_scene_name).getSceneMessages()[0]
         if is_keyword != CodeAnalyzer.BUTTONS:
-            from_post.add_next(next_post, requiered, is_keyword)
+            transition = from_post.add_next(next_post, requiered, is_keyword)
+            if precompute:
+                if profile is not None:
+                    start = time.perf_counter()
+                # формы ключевого слова известны при сборке - склоняем их один раз
+                if cache is not None:
+                    cache.precompute_forms(transition)
+                else:
+                    transition.precompute_forms()
+                if profile is not None:
+                    scene = find_scene_by_name(scenes_by_name, from_scene_name)
+                    profile.add_scene_time(scene.name, scene.line, time.perf_counter() - start)
         else:
             for button in from_post.content:
                 if button.text == requiered:
@@ -1,10 +1,13 @@
 import os
 import shutil
-import pickle
 from code_analyzer import CodeAnalyzer
 import parser
 import subprocess
 from bot import Bot
+import scenario_format
+import metrics
+from build_cache import BuildCache
+from supervisor import Supervisor
 import sys
 import config as cfg
 
@@ -16,6 +19,10 @@ class Project:
     BIN_NAME = 'bin'  # название папки со скомпилированным проектом
     SCN_FILENAME = 'code.scn'  # название файла с кодом
     OBJ_FILENAME = 'obj.bin'  # название файла со скомпилированными объектами
+    MEDIA_CACHE_FILENAME = 'media.json'  # название файла с кэшем file_id загруженных файлов
+    BUILD_CACHE_FILENAME = 'build.cache'  # название файла с кэшем сборки
+    SESSIONS_FILENAME = 'sessions.db'  # название файла с сессиями игроков
+    PROFILE_FILENAME = 'profile.json'  # название файла с профилем последней сборки
 
     def __init__(self, path):
         """Создаёт новый проект по указанному пути."""
@@ -24,6 +31,10 @@ class Project:
         self.scn = path + os.sep + self.SCN_FILENAME  # путь до файла с кодом
         self.bin = path + os.sep + self.BIN_NAME  # путь до папки со скомпилированным проектом
         self.obj = self.bin + os.sep + self.OBJ_FILENAME  # путь до файла со скомпилированными объектами
+        self.media_cache = self.bin + os.sep + self.MEDIA_CACHE_FILENAME  # путь до кэша file_id
+        self.build_cache = self.bin + os.sep + self.BUILD_CACHE_FILENAME  # путь до кэша сборки
+        self.sessions = self.bin + os.sep + self.SESSIONS_FILENAME  # путь до базы сессий игроков
+        self.profile = self.bin + os.sep + self.PROFILE_FILENAME  # путь до профиля сборки
         self.name = os.path.basename(self.path)  # название проекта
         self.code_analyzer = CodeAnalyzer()
         self.process = None
@@ -115,29 +126,103 @@ class Project:
         os.remove(self.res + os.sep + name)
 
 
-    def run(self, recompile, new_console=True):
-        """Собирает .exe-файл с ботом"""
+    def run(self, recompile, new_console=True, workers=None):
+        """Собирает .exe-файл с ботом
+
+        Параметры:
+        workers - количество процессов бота (если не указано, берётся из настроек)
+        """
         if new_console:
             args = [cfg.COMPILER_PATH, self.path]
             if recompile:
                 args.insert(1, '-c')
+            if workers is not None:
+                args[-1:-1] = ['--workers', str(workers)]
             if not cfg.IS_EXE:
                 args.insert(0, 'python')
             self.process = subprocess.Popen(args, creationflags=subprocess.CREATE_NEW_CONSOLE)
         else:
             if recompile:
-                code = self.get_code()
-                analyzed, _ = self.code_analyzer.get_words(code)
-                words_for_parsing = self.code_analyzer.get_words_for_parsing(analyzed)
-                scenery = parser.getScenery(words_for_parsing, self.res + os.sep)
-                serialized = pickle.dumps(scenery)
-                with open(self.obj, 'wb') as f:
-                    f.write(serialized)
+                self.compile()
             print('=== ЗАПУСКАЕМ БОТА... ===')
-            with open(self.obj, 'rb') as f:
-                token, first_message = pickle.load(f)
+            if workers is None:
+                workers = cfg.WORKERS
+            if workers > 1:
+                # сценарий загружают рабочие процессы, супервизору нужен только токен
+                token = scenario_format.load_token(self.obj)
+                supervisor = Supervisor(token, workers, self.obj, self.res, self.media_cache,
+                                        self.sessions, metrics_port=cfg.METRICS_PORT)
+                print(f'=== БОТ ЗАПУЩЕН В {workers} ПРОЦЕССАХ. МОЖНО ИГРАТЬ ===')
+                supervisor.run(webhook_port=cfg.WEBHOOK_PORT, webhook_url=cfg.WEBHOOK_URL,
+                               webhook_secret=cfg.WEBHOOK_SECRET)
+                return
+            token, first_message = scenario_format.load_file(self.obj, self.res)
             print('=== БОТ ЗАПУЩЕН. МОЖНО ИГРАТЬ ===')
-            bot = Bot(token, first_message)
+            if cfg.METRICS_PORT is not None:
+                metrics.start_server(cfg.METRICS_PORT)
+                print(f'Метрики доступны по адресу http://127.0.0.1:{cfg.METRICS_PORT}/metrics')
+            bot_class = Bot
+            if cfg.RUNTIME == 'asyncio':
+                # импортируется только здесь: asyncio-версии нужен aiohttp
+                from async_bot import AsyncBot
+                bot_class = AsyncBot
+            bot = bot_class(token, first_message, self.media_cache, webhook_port=cfg.WEBHOOK_PORT,
+                            webhook_url=cfg.WEBHOOK_URL, webhook_secret=cfg.WEBHOOK_SECRET,
+                            sessions_path=self.sessions, scenario_path=self.obj, res_path=self.res)
+
+
+    def build(self):
+        """Пересобирает проект в отдельной консоли, не останавливая бота: запущенный бот
+        сам переключится на новый сценарий (см. scenario_watcher.ScenarioWatcher)."""
+        args = [cfg.COMPILER_PATH, '-b', self.path]
+        if not cfg.IS_EXE:
+            args.insert(0, 'python')
+        subprocess.Popen(args, creationflags=subprocess.CREATE_NEW_CONSOLE)
+
+
+    def compile(self, profile=None):
+        """Собирает сценарий в файл со скомпилированными объектами.
+
+        Пересобираются только изменившиеся с прошлой сборки части (см. BuildCache); если не
+        изменились ни код, ни ресурсы, сборка пропускается.
+
+        Параметры:
+        profile - профиль сборки (build_profile.BuildProfile): если передан, проект собирается
+                  даже без изменений и без кэша сборки (чтобы каждый этап выполнял всю свою
+                  работу), а в профиль записывается время и память этапов сборки
+        """
+        code = self.get_code()
+        build_cache = BuildCache(self.build_cache, self.path)
+        if profile is None and build_cache.is_up_to_date(code) and\
+           scenario_format.is_current_file(self.obj):
+            print('=== ПРОЕКТ НЕ ИЗМЕНИЛСЯ С ПРОШЛОЙ СБОРКИ ===')
+            return
+        if profile is not None:
+            profile.start()
+        analyzed, _ = self.code_analyzer.get_words(code)
+        if profile is not None:
+            profile.lap('get_words')
+        words_for_parsing = self.code_analyzer.get_words_for_parsing(analyzed)
+        if profile is not None:
+            profile.lap('get_words_for_parsing')
+        scenery = parser.getScenery(words_for_parsing, self.res + os.sep,
+                                    cache=build_cache if profile is None else None, profile=profile)
+        serialized = scenario_format.dump(*scenery, self.res)
+        if profile is not None:
+            profile.lap('dump')
+        # файл заменяется целиком, чтобы запущенный бот не прочитал его наполовину записанным
+        tmp_path = self.obj + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(serialized)
+        os.replace(tmp_path, self.obj)
+        if profile is not None:
+            profile.lap('write')
+            profile.stop()
+            # кэш не обновляется: эта сборка его не использовала, а прежний кэш по-прежнему
+            # описывает проект (если obj.bin получился другим, следующая сборка это заметит)
+            return
+        build_cache.add_file(self.obj)
+        build_cache.commit(code)
 
 
     def stop(self):
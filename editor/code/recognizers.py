@@ -0,0 +1,131 @@
+import json
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import speech_recognition as sr  # pip install SpeechRecognition
+import config as cfg
+
+
+class Recognizer(ABC):
+    """Распознаватель речи голосовых сообщений."""
+    @abstractmethod
+    def recognize(self, audio):
+        """Распознаёт речь и возвращает текст или None, если речь не разобрана.
+
+        Параметры:
+        audio - звук (тип speech_recognition.AudioData)
+
+        При ошибке распознавателя (например, нет сети) выбрасывается исключение.
+        """
+
+    def get_cache_key(self):
+        """Возвращает ключ распознавателя в кэше результатов (RecognitionCache): распознаватели
+        с одинаковым ключом распознают одинаково. По умолчанию результаты каждого
+        распознавателя хранятся отдельно."""
+        return self
+
+
+class GoogleRecognizer(Recognizer):
+    """Распознавание через бесплатный Google Web Speech API (нужен доступ в интернет)."""
+    def __init__(self, language='ru-RU'):
+        self.language = language
+
+    def get_cache_key(self):
+        return ('google', self.language)
+
+    def recognize(self, audio):
+        try:
+            return sr.Recognizer().recognize_google(audio, language=self.language)
+        except sr.UnknownValueError:
+            return None
+
+
+class VoskRecognizer(Recognizer):
+    """Офлайн-распознавание через Vosk (pip install vosk).
+
+    Модель для русского языка (например, vosk-model-small-ru) нужно скачать с
+    https://alphacephei.com/vosk/models и распаковать в папку model_path.
+    """
+    def __init__(self, model_path):
+        try:
+            import vosk
+        except ImportError:
+            raise Exception('Для офлайн-распознавания речи нужен пакет vosk (pip install vosk).')
+        self.vosk = vosk
+        self.model_path = model_path
+        self.model = vosk.Model(model_path)  # модель загружается один раз (это долго)
+
+    def get_cache_key(self):
+        return ('vosk', self.model_path)
+
+    def recognize(self, audio):
+        recognizer = self.vosk.KaldiRecognizer(self.model, audio.sample_rate)
+        recognizer.AcceptWaveform(audio.get_raw_data(convert_width=2))
+        return json.loads(recognizer.FinalResult()).get('text') or None
+
+
+class StubRecognizer(Recognizer):
+    """Распознаватель для проверок без сети: возвращает заранее заданный текст."""
+    def __init__(self, text=None, answers=None):
+        """Параметры:
+        text - текст, который возвращается для любого сообщения
+        answers - словарь вида {байты_звука: текст} для отдельных сообщений
+        """
+        self.text = text
+        self.answers = answers or {}
+
+    def recognize(self, audio):
+        return self.answers.get(audio.frame_data, self.text)
+
+
+class RecognitionCache:
+    """Ограниченный кэш результатов распознавания (вытесняются давно не использованные).
+
+    Ключ - ключ распознавателя (Recognizer.get_cache_key) и хэш голосового сообщения, поэтому
+    одинаковые сообщения (например, пересланные) распознаются одним распознавателем один раз.
+    """
+    SIZE = 1024  # максимальное количество записей
+
+    def __init__(self, size=SIZE):
+        self.size = size
+        self.results = OrderedDict()  # словарь вида {(ключ_распознавателя, хэш_сообщения): текст или None}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Возвращает кортеж (найдено, текст)."""
+        with self.lock:
+            if key not in self.results:
+                return False, None
+            self.results.move_to_end(key)
+            return True, self.results[key]
+
+    def put(self, key, text):
+        with self.lock:
+            self.results[key] = text
+            self.results.move_to_end(key)
+            if len(self.results) > self.size:
+                self.results.popitem(last=False)
+
+
+def create(name):
+    """Создаёт распознаватель по названию: 'google', 'vosk' или 'stub'."""
+    if name == 'google':
+        return GoogleRecognizer()
+    if name == 'vosk':
+        return VoskRecognizer(cfg.VOSK_MODEL_PATH)
+    if name == 'stub':
+        return StubRecognizer(cfg.STUB_RECOGNIZER_TEXT)
+    raise Exception(f'Неизвестный распознаватель речи: {name}.')
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_default():
+    """Возвращает распознаватель, указанный в настройках (создаётся при первом вызове)."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = create(cfg.RECOGNIZER)
+        return _default
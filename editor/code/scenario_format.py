@@ -0,0 +1,279 @@
+import io
+import os
+import pickle
+from collections import deque
+from bot_message import *
+
+# Формат скомпилированного сценария.
+#
+# Файл начинается с сигнатуры и версии формата, за ними записаны два объекта pickle:
+# токен бота (его можно прочитать, не загружая сценарий) и таблицы сценария. Таблицы
+# состоят только из списков, кортежей, чисел и строк, а посты ссылаются друг на друга
+# индексами, поэтому запись и чтение не зависят от глубины сценария:
+#   strings - таблица строк (каждая строка записывается один раз), остальные таблицы
+#             хранят вместо строк их индексы в этой таблице;
+#   paths - пути до файлов относительно папки ресурсов; absolute_paths - индексы путей,
+#           которые не удалось сделать относительными (файл на другом диске);
+#   buttons - таблица кнопок: (текст, идентификатор);
+#   posts - таблицы постов без переходов, по одной на класс, по столбцам:
+#           (класс, сцены, номера_в_сцене, содержимое, доп_поля); посты нумеруются подряд
+#           по всем таблицам, first - номер первого поста игры;
+#   transitions - таблица переходов: (пост, следующий_пост, требуемая_строка, is_keyword, формы);
+#   button_transitions - таблица переходов по кнопкам: (пост, следующий_пост, кнопка).
+# Загрузка - один вызов pickle.load и один проход по каждой таблице.
+
+MAGIC = b'TGSCN'  # сигнатура файла
+VERSION = 2  # версия формата
+
+# номер класса поста в таблице постов - индекс класса в этом кортеже
+POST_CLASSES = (TextPost, ImagePost, VideoPost, VoicePost, GifPost, RoundPost, DocPost,
+                AudioPost, StickerPost, ButtonsPost, GroupPost)
+FILE_POST_CLASSES = (ImagePost, VideoPost, VoicePost, GifPost, RoundPost, DocPost,
+                     AudioPost, StickerPost)
+EXTRA_FIELDS = {RoundPost: 'width', ButtonsPost: 'caption', GroupPost: 'caption'}  # доп. поле класса
+
+# как хранится содержимое поста каждого класса
+TEXT, FILE, BUTTONS, GROUP = range(4)
+CONTENT_KINDS = [FILE if cls in FILE_POST_CLASSES else BUTTONS if cls is ButtonsPost else
+                 GROUP if cls is GroupPost else TEXT for cls in POST_CLASSES]
+
+
+def is_compiled(data):
+    """Возвращает True, если данные записаны в этом формате (а не старым pickle)."""
+    return data.startswith(MAGIC)
+
+
+def is_current_file(path):
+    """Возвращает True, если файл записан в текущей версии формата (иначе проект нужно
+    пересобрать, даже если он не изменился)."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC) + 1) == MAGIC + bytes([VERSION])
+    except OSError:
+        return False
+
+
+def collect_posts(first_post):
+    """Возвращает список всех постов сценария (обход графа в ширину), first_post - первый."""
+    seen = {id(first_post)}
+    posts = [first_post]
+    queue = deque(posts)
+    while queue:
+        post = queue.popleft()
+        next_posts = [transition.next_post for transition in post.transitions]
+        if isinstance(post, GroupPost):
+            next_posts += post.content
+        for next_post in next_posts:
+            if id(next_post) not in seen:
+                seen.add(id(next_post))
+                posts.append(next_post)
+                queue.append(next_post)
+    return posts
+
+
+class Table(list):
+    """Таблица значений без повторов: add возвращает индекс значения в таблице."""
+    def __init__(self):
+        super().__init__()
+        self.indexes = {}  # словарь вида {значение: индекс}
+
+    def add(self, value):
+        index = self.indexes.get(value)
+        if index is None:
+            index = self.indexes[value] = len(self)
+            self.append(value)
+        return index
+
+
+def get_relative_path(path, res_path):
+    """Возвращает путь до файла относительно папки ресурсов или None, если файл на другом
+    диске (на Windows os.path.relpath не строит путь между дисками)."""
+    try:
+        return os.path.relpath(path, res_path)
+    except ValueError:
+        return None
+
+
+def dump(token, first_post, res_path):
+    """Сериализует сценарий, начинающийся с поста first_post, и возвращает байты.
+
+    Параметры:
+    token - токен бота
+    first_post - первый пост игры
+    res_path - путь до папки с ресурсами (пути до файлов сохраняются относительно неё)
+    """
+    posts = collect_posts(first_post)
+    # посты одного класса нумеруются подряд (см. таблицы постов)
+    classes = [POST_CLASSES.index(type(post)) for post in posts]
+    order = sorted(range(len(posts)), key=classes.__getitem__)
+    post_indexes = {id(posts[i]): number for number, i in enumerate(order)}
+    strings = Table()
+    paths = Table()
+    absolute_paths = []
+    buttons = []
+    button_indexes = {}  # словарь вида {id(кнопка): индекс}, кнопки сравниваются по объекту
+
+    def add_path(path):
+        relpath = get_relative_path(path, res_path)
+        if relpath is not None:
+            return paths.add(relpath)
+        index = paths.add(path)
+        if index not in absolute_paths:
+            absolute_paths.append(index)
+        return index
+
+    def add_button(button):
+        if id(button) not in button_indexes:
+            button_indexes[id(button)] = len(buttons)
+            buttons.append((strings.add(button.text), strings.add(button.callback_data)))
+        return button_indexes[id(button)]
+
+    post_tables = []
+    for i in order:
+        post = posts[i]
+        if not post_tables or post_tables[-1][0] != classes[i]:
+            field = EXTRA_FIELDS.get(type(post))
+            post_tables.append((classes[i], [], [], [], [] if field is not None else None))
+        _, scenes, indexes, contents, extras = post_tables[-1]
+        kind = CONTENT_KINDS[classes[i]]
+        if kind == FILE:
+            contents.append(add_path(post.content))
+        elif kind == BUTTONS:
+            contents.append([add_button(button) for button in post.content])
+        elif kind == GROUP:
+            contents.append([post_indexes[id(item)] for item in post.content])
+        else:
+            contents.append(strings.add(post.content))
+        scene, index = post.get_id()
+        scenes.append(strings.add(scene))
+        indexes.append(index)
+        if extras is not None:
+            extras.append(getattr(post, EXTRA_FIELDS[type(post)]))
+
+    # у поста с кнопками все переходы - по кнопкам, у остальных постов - ни одного, поэтому
+    # в двух таблицах порядок переходов каждого поста сохраняется
+    transitions = []
+    button_transitions = []
+    for post in posts:
+        for transition in post.transitions:
+            row = (post_indexes[id(post)], post_indexes[id(transition.next_post)])
+            if isinstance(transition, ButtonTransition):
+                button_transitions.append(row + (add_button(transition.requiered_button),))
+            else:
+                forms = transition.forms
+                if forms is not None:
+                    forms = [strings.add(form) for form in forms]
+                transitions.append(row + (strings.add(transition.requiered_callback),
+                                          transition.is_keyword, forms))
+
+    buffer = io.BytesIO()
+    buffer.write(MAGIC + bytes([VERSION]))
+    pickle.dump(token, buffer, protocol=pickle.HIGHEST_PROTOCOL)
+    tables = (list(strings), list(paths), absolute_paths, buttons, post_tables,
+              post_indexes[id(first_post)], transitions, button_transitions)
+    pickle.dump(tables, buffer, protocol=pickle.HIGHEST_PROTOCOL)
+    return buffer.getvalue()
+
+
+def check_header(data):
+    """Проверяет сигнатуру и версию формата в начале данных."""
+    if not is_compiled(data):
+        raise Exception('Файл не является скомпилированным сценарием.')
+    version = data[len(MAGIC)]
+    if version != VERSION:
+        raise Exception(f'Неподдерживаемая версия скомпилированного сценария: {version}. '
+                        'Пересоберите проект.')
+
+
+def open_data(data):
+    """Проверяет сигнатуру и версию и возвращает поток, указывающий на токен."""
+    check_header(data)
+    stream = io.BytesIO(data)
+    stream.seek(len(MAGIC) + 1)
+    return stream
+
+
+def load(data, res_path):
+    """Восстанавливает сценарий из байтов и возвращает список [token, first_post].
+
+    Параметры:
+    data - байты, полученные функцией dump
+    res_path - путь до папки с ресурсами проекта
+    """
+    stream = open_data(data)
+    token = pickle.load(stream)
+    (strings, relative_paths, absolute_paths, button_rows, post_tables, first,
+     transition_rows, button_transition_rows) = pickle.load(stream)
+    prefix = os.path.join(res_path, '')  # сложение строк быстрее os.path.join
+    paths = [prefix + path for path in relative_paths]
+    for i in absolute_paths:
+        paths[i] = relative_paths[i]
+
+    buttons = []
+    for text, callback_data in button_rows:
+        button = Button.__new__(Button)
+        button.__dict__ = {'text': strings[text], 'callback_data': strings[callback_data]}
+        buttons.append(button)
+
+    posts = []
+    groups = []
+    for class_index, scenes, indexes, contents, extras in post_tables:
+        cls = POST_CLASSES[class_index]
+        kind = CONTENT_KINDS[class_index]
+        if kind == TEXT:
+            contents = [strings[i] for i in contents]
+        elif kind == FILE:
+            contents = [paths[i] for i in contents]
+        elif kind == BUTTONS:
+            contents = [[buttons[i] for i in content] for content in contents]
+        start = len(posts)
+        for scene, index, content in zip(scenes, indexes, contents):
+            post = cls.__new__(cls)
+            post.__dict__ = {'content': content, 'transitions': [], 'keyword_matcher': None,
+                             'scene': strings[scene], 'index': index}
+            posts.append(post)
+        if kind == GROUP:
+            groups += posts[start:]  # посты группы могут быть ещё не созданы
+        if extras is not None:
+            field = EXTRA_FIELDS[cls]
+            for post, extra in zip(posts[start:], extras):
+                post.__dict__[field] = extra
+    for post in groups:
+        post.content = [posts[i] for i in post.content]
+
+    for calling_index, next_index, requiered, is_keyword, forms in transition_rows:
+        calling_post = posts[calling_index]
+        transition = Transition.__new__(Transition)
+        transition.__dict__ = {'calling_post': calling_post, 'next_post': posts[next_index],
+                               'requiered_callback': strings[requiered], 'is_keyword': is_keyword,
+                               'forms': None if forms is None else [strings[i] for i in forms]}
+        calling_post.transitions.append(transition)
+    for calling_index, next_index, button in button_transition_rows:
+        calling_post = posts[calling_index]
+        transition = ButtonTransition.__new__(ButtonTransition)
+        transition.__dict__ = {'calling_post': calling_post, 'next_post': posts[next_index],
+                               'requiered_button': buttons[button]}
+        calling_post.transitions.append(transition)
+    return [token, posts[first]]
+
+
+def load_file(path, res_path):
+    """Читает скомпилированный сценарий из файла и возвращает список [token, first_post]
+    (поддерживаются и проекты, собранные старой версией обычным pickle)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if is_compiled(data):
+        return load(data, res_path)
+    return pickle.loads(data)  # проект, собранный старой версией
+
+
+def load_token(path):
+    """Читает из файла скомпилированного сценария только токен бота (таблицы сценария
+    не загружаются)."""
+    with open(path, 'rb') as f:
+        header = f.read(len(MAGIC) + 1)
+        if is_compiled(header):
+            check_header(header)
+            return pickle.load(f)
+        f.seek(0)
+        return pickle.load(f)[0]  # проект, собранный старой версией
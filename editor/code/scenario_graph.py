@@ -0,0 +1,148 @@
+from collections import deque
+from code_analyzer import CodeAnalyzer
+from bot_message import Transition
+
+
+class ScenarioGraph:
+    """Граф сцен сценария: вершины - сцены, рёбра - переходы между ними.
+
+    Строится при сборке по переходам из parser.get_transitions, до конвертации медиафайлов,
+    поэтому недостижимые сцены можно не собирать вовсе.
+    """
+    # виды переходов
+    IMMEDIATE = 'immediate'  # сразу (ключевое слово перехода)
+    BUTTON = 'button'  # по кнопке
+    ELSE = 'else'  # при любом ответе (иначе или пустой ключ, которому подходит любой ответ)
+    ANSWER = 'answer'  # по ответу текстом или голосом (игрок должен угадать ответ)
+
+    def __init__(self, scenes, transitions):
+        """Параметры:
+        scenes - список сцен (тип parser.Scene), первая сцена - начало игры
+        transitions - список кортежей вида (сцена, условие, следующая_сцена, is_keyword)
+        """
+        self.scenes = {scene.name: scene for scene in scenes}
+        self.first = scenes[0].name
+        self.next_scenes = {scene.name: [] for scene in scenes}  # {сцена: [(следующая_сцена, вид)]}
+        self.previous_scenes = {scene.name: [] for scene in scenes}  # {сцена: [(предыдущая_сцена, вид)]}
+        for from_name, requiered, next_name, is_keyword in transitions:
+            kind = self.get_kind(requiered, is_keyword)
+            self.next_scenes[from_name].append((next_name, kind))
+            self.previous_scenes[next_name].append((from_name, kind))
+
+    @classmethod
+    def get_kind(cls, requiered, is_keyword):
+        """Возвращает вид перехода по условию и признаку is_keyword из parser.get_transitions."""
+        if is_keyword == CodeAnalyzer.BUTTONS:
+            return cls.BUTTON
+        if requiered == Transition.SEND_IMMEDIATELY:
+            return cls.IMMEDIATE
+        if requiered == Transition.SEND_ELSE or not requiered:
+            return cls.ELSE
+        return cls.ANSWER
+
+    def get_reachable(self, starts, edges):
+        """Возвращает множество сцен, достижимых из сцен starts по рёбрам edges
+        (self.next_scenes - вперёд по сценарию, self.previous_scenes - назад)."""
+        reachable = set(starts)
+        queue = deque(starts)
+        while queue:
+            name = queue.popleft()
+            for next_name, _ in edges[name]:
+                if next_name not in reachable:
+                    reachable.add(next_name)
+                    queue.append(next_name)
+        return reachable
+
+    def get_cycles(self, names):
+        """Возвращает список циклов среди сцен names: каждый цикл - список сцен компоненты
+        сильной связности (из любой её сцены можно вернуться в любую)."""
+        # алгоритм Тарьяна без рекурсии (в больших сценариях цепочки сцен длинные)
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        cycles = []
+        allowed = set(names)
+        for root in names:
+            if root in index:
+                continue
+            work = [(root, 0)]
+            while work:
+                name, position = work.pop()
+                if position == 0:
+                    index[name] = lowlink[name] = len(index)
+                    stack.append(name)
+                    on_stack.add(name)
+                edges = self.next_scenes[name]
+                for i in range(position, len(edges)):
+                    next_name = edges[i][0]
+                    if next_name not in allowed:
+                        continue
+                    if next_name not in index:
+                        work.append((name, i + 1))
+                        work.append((next_name, 0))
+                        break
+                    if next_name in on_stack:
+                        lowlink[name] = min(lowlink[name], index[next_name])
+                else:
+                    if lowlink[name] == index[name]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == name:
+                                break
+                        if len(component) > 1 or any(next_name == name for next_name, _ in edges):
+                            cycles.append(component[::-1])
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[name])
+        return cycles
+
+    def analyze(self):
+        """Анализирует граф и возвращает словарь с результатами:
+        reachable - сцены, достижимые из первой сцены
+        unreachable - недостижимые сцены (их не нужно собирать)
+        endpoints - достижимые сцены без переходов (концовки игры)
+        dead_ends - достижимые сцены, из которых нельзя дойти ни до одной концовки
+        cycles - циклы среди достижимых сцен
+        hidden - сцены, в которые можно попасть, только угадав ответ текстом или голосом
+        """
+        reachable = self.get_reachable([self.first], self.next_scenes)
+        endpoints = {name for name in reachable if not self.next_scenes[name]}
+        can_finish = self.get_reachable(list(endpoints), self.previous_scenes)
+        hidden = {name for name in reachable if name != self.first and
+                  all(kind == self.ANSWER for previous, kind in self.previous_scenes[name]
+                      if previous in reachable)}
+        ordered = lambda names: [name for name in self.scenes if name in names]  # в порядке объявления
+        return {
+            'reachable': ordered(reachable),
+            'unreachable': ordered(set(self.scenes) - reachable),
+            'endpoints': ordered(endpoints),
+            'dead_ends': ordered(reachable - can_finish),
+            'cycles': self.get_cycles(ordered(reachable)),
+            'hidden': ordered(hidden),
+        }
+
+    def format_report(self, report):
+        """Возвращает результаты анализа (см. analyze) в виде текста для вывода в консоль."""
+        describe = lambda names: ', '.join(f'{name} (строка {self.scenes[name].line})' for name in names)
+        lines = [f'=== АНАЛИЗ СЦЕНАРИЯ: СЦЕН {len(self.scenes)}, ДОСТИЖИМО {len(report["reachable"])}, '
+                 f'КОНЦОВОК {len(report["endpoints"])}, ЦИКЛОВ {len(report["cycles"])} ===']
+        if report['unreachable']:
+            lines.append(f'Недостижимые сцены (не собираются): {describe(report["unreachable"])}')
+        if not report['endpoints']:
+            lines.append('В сценарии нет концовок: игру нельзя пройти до конца.')
+        elif report['dead_ends']:
+            lines.append(f'Из этих сцен нельзя дойти до концовки: {describe(report["dead_ends"])}')
+        if report['hidden']:
+            lines.append(f'В эти сцены можно попасть, только угадав ответ: {describe(report["hidden"])}')
+        return '\n'.join(lines)
+
+
+def prune(scenes, transitions, reachable):
+    """Возвращает кортеж (сцены, переходы) только с достижимыми сценами reachable."""
+    reachable = set(reachable)
+    return ([scene for scene in scenes if scene.name in reachable],
+            [transition for transition in transitions if transition[0] in reachable])
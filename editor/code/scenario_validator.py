@@ -0,0 +1,61 @@
+import re
+import threading
+from code_analyzer import CodeAnalyzer
+import parser
+
+
+class ScenarioValidator:
+    """Фоновая проверка сценария на ошибки в отдельном потоке.
+
+    Проверяется только последняя переданная версия кода: если за время проверки пришли
+    новые версии, промежуточные пропускаются.
+    """
+    LINE_RE = re.compile(r'Строка (\d+)')  # номер строки в тексте ошибки парсера
+
+    def __init__(self, callback):
+        """Создаёт поток проверки.
+
+        Параметры:
+        callback - функция callback(revision, errors), вызывается в рабочем потоке после проверки;
+                   errors - список кортежей вида (номер_строки, текст_ошибки)
+        """
+        self.callback = callback
+        self.code_analyzer = CodeAnalyzer()
+        self.condition = threading.Condition()
+        self.pending = None  # кортеж вида (номер_версии, код, путь_до_ресурсов)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, revision, code, res_path):
+        """Ставит версию кода в очередь на проверку (заменяя ещё не проверенную)."""
+        with self.condition:
+            self.pending = (revision, code, res_path)
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                revision, code, res_path = self.pending
+                self.pending = None
+            self.callback(revision, self.validate(code, res_path))
+
+    def validate(self, code, res_path):
+        """Проверяет код без конвертации медиафайлов и возвращает список ошибок."""
+        errors = []
+        try:
+            analyzed, _ = self.code_analyzer.get_words(code)
+            words_for_parsing = self.code_analyzer.get_words_for_parsing(analyzed)
+            parser.getScenery(words_for_parsing, res_path, errors)
+        except Exception as e:
+            # ошибка в структуре сценария - дальнейший разбор невозможен
+            errors.append((self.get_line(str(e)), str(e)))
+        return errors
+
+    def get_line(self, message):
+        """Возвращает номер строки из текста ошибки или None, если он не указан."""
+        match = self.LINE_RE.search(message)
+        if match is None:
+            return None
+        return int(match.group(1))
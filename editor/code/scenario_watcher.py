@@ -0,0 +1,54 @@
+import os
+import threading
+import scenario_format
+
+
+class ScenarioWatcher:
+    """Следит за файлом скомпилированного сценария и загружает его заново после пересборки.
+
+    Новый сценарий загружается в фоновом потоке и передаётся в callback, поэтому бот
+    продолжает работать со старым сценарием, пока новый не будет полностью загружен.
+    """
+    INTERVAL = 1  # период проверки файла, с
+
+    def __init__(self, path, res_path, callback, interval=INTERVAL):
+        """Запускает фоновый поток проверки.
+
+        Параметры:
+        path - путь до файла со скомпилированным сценарием
+        res_path - путь до папки с ресурсами проекта
+        callback - функция callback(token, first_post), вызывается в фоновом потоке
+        interval - период проверки файла, с
+        """
+        self.path = path
+        self.res_path = res_path
+        self.callback = callback
+        self.interval = interval
+        self.version = self.get_version()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def get_version(self):
+        """Возвращает кортеж (время_изменения, размер) файла или None, если файла нет."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            version = self.get_version()
+            if version is None or version == self.version:
+                continue
+            self.version = version
+            try:
+                token, first_post = scenario_format.load_file(self.path, self.res_path)
+            except Exception as e:
+                print(f'Не удалось загрузить обновлённый сценарий, работает прежний: {e}')
+                continue
+            self.callback(token, first_post)
+
+    def stop(self):
+        self.stopped.set()
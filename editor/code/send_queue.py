@@ -0,0 +1,320 @@
+import asyncio
+import heapq
+import threading
+import time
+from collections import deque
+import metrics
+
+
+def get_retry_after(e):
+    """Возвращает время ожидания из ответа 429 Too Many Requests или None для других ошибок.
+
+    Подходит для исключений и telebot.apihelper, и telebot.asyncio_helper.
+    """
+    if getattr(e, 'error_code', None) != 429:
+        return None
+    parameters = (getattr(e, 'result_json', None) or {}).get('parameters') or {}
+    return parameters.get('retry_after', 1)
+
+
+def is_transient(e, errors=(OSError,)):
+    """Возвращает True, если ошибка отправки временная и сообщение стоит отправить ещё раз:
+    ответ Telegram с кодом 5xx, тайм-аут или обрыв соединения (исключение типа errors, в том
+    числе исключение, из-за которого возникло e).
+
+    Подходит для исключений и telebot.apihelper, и telebot.asyncio_helper.
+    """
+    error_code = getattr(e, 'error_code', None)
+    if error_code is None:
+        # ApiHTTPException: ответ не JSON, код - в ответе requests или aiohttp
+        result = getattr(e, 'result', None)
+        error_code = getattr(result, 'status_code', None) or getattr(result, 'status', None)
+    if isinstance(error_code, int):
+        return error_code >= 500
+    return isinstance(e, errors) or isinstance(e.__cause__, errors)
+
+
+class TokenBucket:
+    """Ограничитель частоты: не больше rate действий в секунду, короткими пачками до capacity."""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.time = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.time) * self.rate)
+        self.time = now
+
+    def delay(self, now, cost=1):
+        """Возвращает время в секундах, через которое можно выполнить действие стоимостью cost.
+
+        Действие дороже capacity выполняется, когда ведро полно: иначе его пришлось бы ждать
+        вечно (take уводит ведро в минус, и следующие действия ждут дольше).
+        """
+        self.refill(now)
+        return max(0, (min(cost, self.capacity) - self.tokens) / self.rate)
+
+    def take(self, now, cost=1):
+        """Забирает cost токенов; если их не хватает, уходит в минус (следующим придётся ждать)."""
+        self.refill(now)
+        self.tokens -= cost
+
+    def pause(self, now, seconds):
+        """Запрещает действия на seconds секунд (после паузы доступно одно действие)."""
+        self.refill(now)
+        self.tokens = min(self.tokens, 1) - seconds * self.rate
+
+    def is_full(self, now):
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+class RateLimits:
+    """Ограничения Telegram на частоту отправки: общее "ведро с токенами" на бота
+    (~30 сообщений в секунду) и отдельные вёдра для каждого чата (~1 сообщение в секунду)."""
+    GLOBAL_RATE = 30  # сообщений в секунду на бота
+    GLOBAL_BURST = 1  # сообщения отправляются равномерно, без пачек
+    CHAT_RATE = 1  # сообщений в секунду на чат
+    CHAT_BURST = 3  # сколько сообщений подряд можно отправить в чат без ожидания
+    PRUNE_INTERVAL = 60  # период удаления вёдер неактивных чатов, с
+    RETRIES = 3  # сколько раз повторяется отправка после временной ошибки
+    RETRY_DELAY = 1  # ожидание перед первым повтором, с (перед каждым следующим - вдвое дольше)
+    TRANSIENT_ERRORS = (OSError,)  # временные ошибки соединения (requests и socket)
+
+    def __init__(self, global_rate=None, global_burst=None, chat_rate=None, chat_burst=None):
+        """Параметры, которые не указаны, берутся из атрибутов класса GLOBAL_RATE и т.д."""
+        self.chat_rate = chat_rate or self.CHAT_RATE
+        self.chat_burst = chat_burst or self.CHAT_BURST
+        self.global_bucket = TokenBucket(global_rate or self.GLOBAL_RATE, global_burst or self.GLOBAL_BURST)
+        self.chat_buckets = {}  # словарь вида {chat_id: TokenBucket}
+        self.queues = {}  # словарь вида {chat_id: deque([(задача, callback, стоимость)])}
+        self.last_prune = time.monotonic()
+        self.transient_errors = self.TRANSIENT_ERRORS
+
+    def get_retry_delay(self, e, attempt):
+        """Возвращает, через сколько секунд повторить отправку, завершившуюся ошибкой e,
+        или None, если сообщение отправить не удалось.
+
+        Параметры:
+        e - исключение
+        attempt - сколько раз отправка этого сообщения уже повторялась
+
+        После ответа 429 сообщение повторяется всегда (столько, сколько просит Telegram),
+        после временной ошибки (см. is_transient) - не больше RETRIES раз. Повтор после
+        тайм-аута может отправить сообщение дважды, если первая попытка всё же дошла.
+        """
+        retry_after = get_retry_after(e)
+        if retry_after is not None:
+            return retry_after
+        if attempt < self.RETRIES and is_transient(e, self.transient_errors):
+            return self.RETRY_DELAY * 2 ** attempt
+        return None
+
+    def on_error(self, chat_id, e, attempt):
+        """Обрабатывает ошибку отправки сообщения в чат и возвращает время до повтора
+        или None, если сообщение отправить не удалось (см. get_retry_delay)."""
+        retry_after = self.get_retry_delay(e, attempt)
+        if retry_after is None:
+            print(f'Не удалось отправить сообщение в чат {chat_id}: {e}')
+            metrics.SEND_FAILURES.inc()
+        else:
+            metrics.SEND_RETRIES.inc()
+        return retry_after
+
+    def call_back(self, chat_id, callback, sent, error):
+        """Сообщает результат отправки функции callback (см. SendQueue.put)."""
+        if callback is None:
+            return
+        try:
+            callback(sent, error)
+        except Exception as e:
+            print(f'Ошибка при обработке отправленного в чат {chat_id} сообщения: {e}')
+
+    def get_chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def reserve(self, now, cost):
+        """Бронирует место в общем ведре и возвращает время, которое нужно подождать до отправки."""
+        delay = self.global_bucket.delay(now, cost)
+        self.global_bucket.take(now, cost)
+        return delay
+
+    def prune(self, now):
+        """Удаляет вёдра чатов, которым ничего не отправляется и которые успели наполниться."""
+        if now - self.last_prune < self.PRUNE_INTERVAL:
+            return
+        self.last_prune = now
+        for chat_id in [chat_id for chat_id, bucket in self.chat_buckets.items()
+                        if chat_id not in self.queues and bucket.is_full(now)]:
+            del self.chat_buckets[chat_id]
+
+
+class SendQueue(RateLimits):
+    """Очередь исходящих сообщений с учётом ограничений Telegram на частоту отправки.
+
+    Сообщения отправляются рабочими потоками, поэтому медленная загрузка файла не задерживает
+    обработчик обновлений. Сообщения одного чата отправляются строго по очереди (в каждом чате
+    отправляется не больше одного сообщения одновременно). При ответе 429 чат ждёт указанные
+    Telegram retry_after секунд, после чего сообщение отправляется повторно; после временной
+    ошибки сообщение тоже отправляется повторно (см. RateLimits.get_retry_delay).
+    """
+    WORKERS = 8  # количество рабочих потоков
+
+    def __init__(self, workers=WORKERS, **limits):
+        """Создаёт очередь и запускает workers рабочих потоков (limits - см. RateLimits)."""
+        super().__init__(**limits)
+        self.ready = deque()  # чаты, сообщения которых можно отправлять
+        self.delayed = []  # куча кортежей вида (время, chat_id) - чаты, ожидающие своего ведра
+        self.attempts = {}  # словарь вида {chat_id: количество повторов первого сообщения чата}
+        self.condition = threading.Condition()
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, chat_id, job, callback=None, cost=1):
+        """Ставит сообщение в очередь чата.
+
+        Параметры:
+        chat_id - идентификатор чата
+        job - функция без параметров, отправляющая сообщение и возвращающая отправленное сообщение
+        callback - функция callback(отправленное_сообщение, ошибка), вызывается после отправки
+                   (с ошибкой None) или после окончательной неудачи (с сообщением None
+                   и исключением, из-за которого сообщение не отправлено)
+        cost - количество сообщений, которые отправляет job (для группы файлов - размер группы)
+        """
+        with self.condition:
+            queue = self.queues.get(chat_id)
+            if queue is None:
+                # чат не отправляет и не ждёт отправки - его можно обслуживать
+                queue = self.queues[chat_id] = deque()
+                self.ready.append(chat_id)
+                self.condition.notify()
+            queue.append((job, callback, cost))
+
+    def join(self, timeout=None):
+        """Ждёт отправки всех сообщений. Возвращает False, если время ожидания истекло."""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.queues, timeout)
+
+    def take(self):
+        """Ждёт сообщение, которое можно отправить, и возвращает кортеж
+        (chat_id, задача, callback, ожидание_общего_ведра). Вызывается под блокировкой."""
+        while True:
+            now = time.monotonic()
+            while self.delayed and self.delayed[0][0] <= now:
+                self.ready.append(heapq.heappop(self.delayed)[1])
+            if self.ready:
+                chat_id = self.ready.popleft()
+                job, callback, cost = self.queues[chat_id][0]
+                bucket = self.get_chat_bucket(chat_id)
+                chat_delay = bucket.delay(now, cost)
+                if chat_delay > 0:
+                    heapq.heappush(self.delayed, (now + chat_delay, chat_id))
+                    continue
+                bucket.take(now, cost)
+                # место в общем ведре бронируется сразу, ждать его можно и без блокировки
+                return chat_id, job, callback, self.reserve(now, cost)
+            timeout = self.delayed[0][0] - now if self.delayed else None
+            self.condition.wait(timeout)
+
+    def done(self, chat_id, retry_after=None):
+        """Завершает отправку сообщения чата. Вызывается под блокировкой.
+
+        Параметры:
+        retry_after - если указано, сообщение не отправлено и будет повторено через retry_after секунд
+        """
+        now = time.monotonic()
+        queue = self.queues[chat_id]
+        if retry_after is not None:
+            self.chat_buckets[chat_id].pause(now, retry_after)
+            heapq.heappush(self.delayed, (now + retry_after, chat_id))
+            self.attempts[chat_id] = self.attempts.get(chat_id, 0) + 1
+        else:
+            self.attempts.pop(chat_id, None)
+            queue.popleft()
+            if queue:
+                self.ready.append(chat_id)
+            else:
+                del self.queues[chat_id]
+        self.prune(now)
+        self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                chat_id, job, callback, global_delay = self.take()
+            if global_delay > 0:
+                time.sleep(global_delay)
+            sent = error = retry_after = None
+            try:
+                sent = job()
+            except Exception as e:
+                # повторы считает только поток, отправляющий сообщение чата
+                retry_after = self.on_error(chat_id, e, self.attempts.get(chat_id, 0))
+                error = e
+            if retry_after is None:
+                self.call_back(chat_id, callback, sent, error)
+            with self.condition:
+                self.done(chat_id, retry_after)
+
+
+class AsyncSendQueue(RateLimits):
+    """Очередь исходящих сообщений для asyncio с теми же ограничениями, что и SendQueue.
+
+    Сообщения каждого чата отправляет отдельная задача, которая существует, пока в очереди
+    чата есть сообщения, поэтому ожидание одного чата не задерживает остальные.
+    """
+    def __init__(self, **limits):
+        super().__init__(**limits)
+        from aiohttp import ClientError  # очередь используется только asyncio-версией бота
+        self.transient_errors = (*self.TRANSIENT_ERRORS, asyncio.TimeoutError, ClientError)
+        self.tasks = set()  # задачи отправки (ссылки хранятся, чтобы задачи не удалил сборщик мусора)
+
+    def put(self, chat_id, job, callback=None, cost=1):
+        """Ставит сообщение в очередь чата (см. SendQueue.put); job возвращает корутину отправки."""
+        queue = self.queues.get(chat_id)
+        if queue is None:
+            queue = self.queues[chat_id] = deque()
+            task = asyncio.get_running_loop().create_task(self.run(chat_id, queue))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        queue.append((job, callback, cost))
+
+    async def join(self):
+        """Ждёт отправки всех сообщений."""
+        while self.tasks:
+            await asyncio.gather(*self.tasks)
+
+    async def run(self, chat_id, queue):
+        bucket = self.get_chat_bucket(chat_id)
+        attempt = 0  # сколько раз повторялась отправка первого сообщения очереди
+        while queue:
+            job, callback, cost = queue[0]
+            now = time.monotonic()
+            chat_delay = bucket.delay(now, cost)
+            if chat_delay > 0:
+                await asyncio.sleep(chat_delay)
+                continue
+            bucket.take(now, cost)
+            global_delay = self.reserve(now, cost)
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+            sent = error = retry_after = None
+            try:
+                sent = await job()
+            except Exception as e:
+                retry_after = self.on_error(chat_id, e, attempt)
+                error = e
+            if retry_after is not None:
+                bucket.pause(time.monotonic(), retry_after)
+                attempt += 1
+                continue
+            self.call_back(chat_id, callback, sent, error)
+            attempt = 0
+            queue.popleft()
+        del self.queues[chat_id]
+        self.prune(time.monotonic())
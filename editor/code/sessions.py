@@ -0,0 +1,280 @@
+import sqlite3
+import threading
+import time
+import scenario_format
+
+
+class SessionStore:
+    """Хранилище игровых сессий вида "user_id - post - last_message_id".
+
+    Поиск, обновление и удаление сессии выполняются за O(1), поскольку записи
+    хранятся в словаре с ключом user_id. Сессии живут только в памяти; хранилища,
+    сохраняющие их на диск, переопределяют методы lookup и save.
+
+    Методы можно вызывать из разных потоков: обработчики обновлений и потоки очереди
+    отправки (см. bot_base.BotBase.on_sent) меняют сессии одновременно.
+    """
+    def __init__(self, start_post=None):
+        """Параметры:
+        start_post - первый пост сценария (нужен для перехода на новую версию сценария,
+                     см. set_scenario)
+        """
+        self.sessions = {}  # словарь вида {user_id: (post, last_message_id)}
+        # get вызывает set, а remove - get, поэтому блокировка повторно входимая
+        self.lock = threading.RLock()
+        # кортеж вида (первый_пост, {идентификатор_поста: пост}, {название_сцены: первый_пост_сцены})
+        self.scenario = None
+        if start_post is not None:
+            self.set_scenario(start_post)
+
+    def set_scenario(self, start_post):
+        """Переключает сессии на новую версию сценария (например, после пересборки проекта).
+
+        Игрок остаётся на посте с тем же идентификатором (название сцены, номер в сцене).
+        Если такого поста больше нет, игрок переходит на первый пост своей сцены, а если
+        пропала и сцена - на первый пост игры. Сессии переключаются при обращении к ним,
+        поэтому обработчики, работающие со старым сценарием, не мешают переключению.
+        """
+        posts = {}
+        scene_starts = {}
+        for post in scenario_format.collect_posts(start_post):
+            scene, index = post.get_id()
+            if scene is None:
+                continue  # пост внутри группы или сценарий собран старой версией
+            posts[(scene, index)] = post
+            if index == 0:
+                scene_starts[scene] = post
+        self.scenario = (start_post, posts, scene_starts)  # заменяется одним присваиванием
+
+    def find_post(self, post_id):
+        """Возвращает пост текущего сценария по идентификатору (см. set_scenario)."""
+        start_post, posts, scene_starts = self.scenario
+        post = posts.get(post_id)
+        if post is None:
+            post = scene_starts.get(post_id[0], start_post)
+        return post
+
+    def current(self, post):
+        """Возвращает пост текущего сценария, соответствующий посту post."""
+        post_id = post.get_id()
+        if self.scenario is None or post_id[0] is None or self.scenario[1].get(post_id) is post:
+            return post  # пост текущего сценария или пост без идентификатора
+        return self.find_post(post_id)
+
+    def lookup(self, user_id):
+        """Возвращает сессию игрока, которой нет в памяти, или None (вызывается при промахе)."""
+        return None
+
+    def save(self, user_id, session):
+        """Вызывается после изменения сессии игрока (session равно None, если сессия удалена)."""
+
+    def close(self):
+        """Сохраняет несохранённые изменения и закрывает хранилище."""
+
+    def get(self, user_id):
+        """Возвращает кортеж (post, last_message_id) игрока или None, если игрок не начал игру."""
+        with self.lock:
+            session = self.sessions.get(user_id)
+            if session is None:
+                session = self.lookup(user_id)
+                if session is not None:
+                    self.sessions[user_id] = session
+            if session is not None:
+                post, last_message_id = session
+                current = self.current(post)
+                if current is not post:
+                    # сценарий обновлён - переводим игрока на новый пост; если пост другой,
+                    # кнопки последнего сообщения больше не действуют
+                    if current.get_id() != post.get_id():
+                        last_message_id = None
+                    self.set(user_id, current, last_message_id)
+                    session = (current, last_message_id)
+            return session
+
+    def get_post(self, user_id, message_id=None):
+        """Возвращает последний отправленный игроку пост.
+
+        Параметры:
+        user_id - идентификатор игрока
+        message_id - если указан, пост возвращается только тогда, когда он совпадает
+                     с идентификатором последнего отправленного игроку сообщения
+                     (защита от нажатий на старые кнопки)
+        """
+        session = self.get(user_id)
+        if session is None:
+            return None
+        post, last_message_id = session
+        if message_id is not None and message_id != last_message_id:
+            return None
+        return post
+
+    def set(self, user_id, post, last_message_id):
+        """Создаёт или обновляет сессию игрока."""
+        with self.lock:
+            self.sessions[user_id] = (post, last_message_id)
+            self.save(user_id, self.sessions[user_id])
+
+    def update(self, user_id, post, last_message_id):
+        """Обновляет сессию игрока, если он уже начал игру."""
+        with self.lock:
+            if user_id in self:
+                self.set(user_id, post, last_message_id)
+
+    def set_message_id(self, user_id, post, last_message_id):
+        """Запоминает идентификатор последнего отправленного игроку сообщения, если игрок
+        всё ещё находится на посте post (сообщения отправляются асинхронно, и за время
+        отправки игрок мог пройти дальше или закончить игру)."""
+        with self.lock:
+            session = self.sessions.get(user_id)
+            current = self.current(post)
+            if session is None or current.get_id() != post.get_id():
+                return  # игрок закончил игру или поста больше нет в обновлённом сценарии
+            if self.current(session[0]) is current:
+                self.set(user_id, current, last_message_id)
+
+    def remove_at(self, user_id, post):
+        """Удаляет сессию игрока, если он всё ещё находится на посте post (см. set_message_id).
+        Возвращает True, если сессия удалена."""
+        with self.lock:
+            session = self.get(user_id)
+            current = self.current(post)
+            if session is None or current.get_id() != post.get_id() or session[0] is not current:
+                return False  # игрок закончил игру, ушёл дальше или поста больше нет в сценарии
+            return self.remove(user_id)
+
+    def remove(self, user_id):
+        """Удаляет сессию игрока (например, после прохождения игры)."""
+        with self.lock:
+            if self.get(user_id) is None:
+                return False
+            del self.sessions[user_id]
+            self.save(user_id, None)
+            return True
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+class SqliteSessionStore(SessionStore):
+    """Хранилище сессий, сохраняющее их в базу SQLite, чтобы перезапуск бота не сбрасывал игру.
+
+    В базе хранятся строки (user_id, сцена, номер_поста, last_message_id): пост задаётся
+    идентификатором Post.get_id(), который не меняется между сборками. Изменения пишутся
+    в базу отложенно: фоновый поток раз в FLUSH_INTERVAL секунд (или при накоплении
+    BATCH_SIZE изменений) записывает их одной транзакцией, поэтому обработка обновления
+    не ждёт диска. Если записать изменения не удалось (например, диск переполнен), они
+    записываются при следующей попытке. Сессии загружаются из базы при первом обращении
+    игрока после запуска. При аварийном завершении теряются изменения за последние
+    FLUSH_INTERVAL секунд.
+    """
+    FLUSH_INTERVAL = 1  # период записи изменений в базу, с
+    BATCH_SIZE = 1000  # количество изменений, при котором они записываются, не дожидаясь периода
+
+    def __init__(self, path, start_post):
+        """Открывает (или создаёт) базу сессий.
+
+        Параметры:
+        path - путь до файла базы
+        start_post - первый пост сценария (по нему посты находятся по идентификаторам)
+        """
+        super().__init__(start_post)
+        self.pending = {}  # несохранённые изменения вида {user_id: (сцена, номер, last_message_id) или None}
+        self.condition = threading.Condition()
+        self.closed = False
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db_lock = threading.Lock()  # соединение используется и обработчиками, и потоком записи
+        with self.db_lock, self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS sessions (user_id INTEGER PRIMARY KEY, '
+                            'scene TEXT NOT NULL, post_index INTEGER NOT NULL, last_message_id INTEGER)')
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def lookup(self, user_id):
+        with self.condition:
+            if user_id in self.pending:
+                # изменение сессии (удаление) ещё не записано в базу
+                return self.to_session(self.pending[user_id])
+        with self.db_lock:
+            row = self.db.execute('SELECT scene, post_index, last_message_id FROM sessions '
+                                  'WHERE user_id = ?', (user_id,)).fetchone()
+        return self.to_session(row)
+
+    def to_session(self, row):
+        """Превращает строку базы в сессию."""
+        if row is None:
+            return None
+        scene, index, last_message_id = row
+        post = self.find_post((scene, index))
+        if post.get_id() != (scene, index):
+            last_message_id = None  # поста больше нет в сценарии - игрок переходит на другой
+        return (post, last_message_id)
+
+    def save(self, user_id, session):
+        row = None
+        if session is not None:
+            post, last_message_id = session
+            scene, index = post.get_id()
+            if scene is None:
+                return  # пост без идентификатора (сценарий собран старой версией) не сохраняется
+            row = (scene, index, last_message_id)
+        with self.condition:
+            self.pending[user_id] = row
+            if len(self.pending) >= self.BATCH_SIZE:
+                self.condition.notify()
+
+    def flush(self):
+        """Записывает накопленные изменения в базу одной транзакцией."""
+        # блокировка базы берётся до того, как изменения забираются из pending, иначе lookup
+        # мог бы прочитать из базы ещё не перезаписанную сессию
+        with self.db_lock:
+            with self.condition:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return
+            removed = [(user_id,) for user_id, row in pending.items() if row is None]
+            changed = [(user_id, *row) for user_id, row in pending.items() if row is not None]
+            try:
+                with self.db:
+                    self.db.executemany('DELETE FROM sessions WHERE user_id = ?', removed)
+                    self.db.executemany('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)', changed)
+            except Exception:
+                # транзакция откачена - возвращаем изменения в pending, не затирая более новые
+                with self.condition:
+                    for user_id, row in pending.items():
+                        self.pending.setdefault(user_id, row)
+                raise
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.closed or len(self.pending) >= self.BATCH_SIZE,
+                                        self.FLUSH_INTERVAL)
+                closed = self.closed
+            try:
+                self.flush()
+            except Exception as e:
+                print(f'Не удалось сохранить сессии игроков: {e}')
+                if not closed:
+                    # не повторяем запись сразу, даже если изменений накопилось много
+                    time.sleep(self.FLUSH_INTERVAL)
+            if closed:
+                return
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.db.close()
+
+
+def open_store(path, start_post):
+    """Возвращает хранилище сессий: в базе SQLite по пути path или в памяти, если path равен None."""
+    if path is None:
+        return SessionStore(start_post)
+    return SqliteSessionStore(path, start_post)
@@ -0,0 +1,128 @@
+import multiprocessing
+import secrets
+import threading
+import time
+import zlib
+import telebot
+import metrics
+from webhook import WebhookServer
+import scenario_format
+
+
+def get_player_id(update):
+    """Возвращает идентификатор игрока, от которого пришло обновление (или None)."""
+    for event in (update.message, update.callback_query):
+        if event is not None and event.from_user is not None:
+            return event.from_user.id
+    return None
+
+
+def run_worker(update_queue, shards, obj_path, res_path, media_cache_path, sessions_path,
+               metrics_port=None):
+    """Рабочий процесс: загружает сценарий и обрабатывает обновления из очереди update_queue.
+
+    Если задан metrics_port, процесс отдаёт свои метрики на этом порту (см. metrics.start_server).
+    """
+    from bot import Bot  # импортируется в рабочем процессе, чтобы не загружать бота в супервизоре
+    if metrics_port is not None:
+        metrics.start_server(metrics_port)
+    token, first_post = scenario_format.load_file(obj_path, res_path)
+    Bot(token, first_post, media_cache_path, sessions_path=sessions_path,
+        update_queue=update_queue, shards=shards, scenario_path=obj_path, res_path=res_path)
+
+
+class Supervisor:
+    """Запускает бота в нескольких процессах.
+
+    Супервизор получает обновления (через long polling или webhook) и распределяет их по
+    рабочим процессам по хэшу идентификатора игрока, поэтому все обновления одного игрока
+    обрабатываются одним процессом по порядку, а разные игроки - на разных ядрах. Каждый
+    процесс загружает сценарий сам и сам переключается на пересобранный. Сессии хранятся
+    в общей базе SQLite (сессию игрока пишет только его процесс, поэтому процессы не
+    перезаписывают сессии друг друга). Упавший рабочий процесс перезапускается.
+    """
+    POLLING_TIMEOUT = 20  # время ожидания обновлений при long polling, с
+    CHECK_INTERVAL = 1  # период проверки рабочих процессов, с
+
+    def __init__(self, token, workers, obj_path, res_path, media_cache_path=None, sessions_path=None,
+                 metrics_port=None):
+        """Создаёт супервизор.
+
+        Параметры:
+        token - токен бота
+        workers - количество рабочих процессов
+        obj_path - путь до файла со скомпилированным сценарием
+        res_path - путь до папки с ресурсами проекта
+        media_cache_path - путь до файла с кэшем file_id загруженных в Telegram файлов
+        sessions_path - путь до базы сессий игроков
+        metrics_port - первый порт метрик: рабочий процесс с номером i отдаёт метрики
+                       на порту metrics_port + i (если не задан, метрики не собираются)
+        """
+        self.tgbot = telebot.TeleBot(token)
+        self.worker_args = (workers, obj_path, res_path, media_cache_path, sessions_path)
+        self.queues = [multiprocessing.Queue() for _ in range(workers)]
+        self.processes = [None] * workers
+        self.metrics_port = metrics_port
+
+    def start_worker(self, index):
+        metrics_port = None if self.metrics_port is None else self.metrics_port + index
+        process = multiprocessing.Process(target=run_worker,
+                                          args=(self.queues[index], *self.worker_args, metrics_port),
+                                          daemon=True)
+        process.start()
+        self.processes[index] = process
+
+    def process_new_updates(self, updates):
+        """Передаёт обновления рабочим процессам (такой же метод, как у telebot.TeleBot,
+        поэтому супервизор можно передать в webhook.WebhookServer вместо бота)."""
+        for update in updates:
+            player_id = get_player_id(update)
+            if player_id is None:
+                continue  # обновления без игрока сценарий не обрабатывает
+            # zlib.crc32, а не hash: распределение не должно зависеть от запуска
+            index = zlib.crc32(str(player_id).encode('ascii')) % len(self.queues)
+            self.queues[index].put(update)
+
+    def poll(self):
+        """Получает обновления через long polling."""
+        self.tgbot.remove_webhook()
+        offset = None
+        while True:
+            try:
+                updates = self.tgbot.get_updates(offset, timeout=self.POLLING_TIMEOUT,
+                                                 long_polling_timeout=self.POLLING_TIMEOUT)
+            except Exception as e:
+                print(f'Не удалось получить обновления: {e}')
+                time.sleep(self.CHECK_INTERVAL)
+                continue
+            if updates:
+                offset = updates[-1].update_id + 1
+                self.process_new_updates(updates)
+
+    def run(self, webhook_port=None, webhook_url=None, webhook_secret=None):
+        """Запускает рабочие процессы и распределяет между ними обновления (параметры webhook -
+        как у bot.Bot). Возвращает управление только при прерывании."""
+        for index in range(len(self.processes)):
+            self.start_worker(index)
+        if webhook_port is None:
+            threading.Thread(target=self.poll, daemon=True).start()
+        else:
+            if webhook_url is not None:
+                if webhook_secret is None:
+                    webhook_secret = secrets.token_urlsafe(32)
+                self.tgbot.set_webhook(url=webhook_url, secret_token=webhook_secret)
+            WebhookServer(self, webhook_secret, port=webhook_port).start()
+            print(f'Бот принимает обновления через webhook на порту {webhook_port}.')
+        try:
+            while True:
+                time.sleep(self.CHECK_INTERVAL)
+                for index, process in enumerate(self.processes):
+                    if not process.is_alive():
+                        print(f'Рабочий процесс {index} завершился (код {process.exitcode}), '
+                              'перезапускаем.')
+                        self.start_worker(index)
+        finally:
+            for queue in self.queues:
+                queue.put(None)  # рабочие процессы завершаются, обработав полученные обновления
+            for process in self.processes:
+                process.join(self.CHECK_INTERVAL * 5)
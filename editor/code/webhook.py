@@ -0,0 +1,142 @@
+import hmac
+import json
+import queue
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telebot import types
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'  # заголовок с секретным токеном webhook
+
+
+def parse_update(headers, body, secret):
+    """Проверяет секретный токен запроса и разбирает обновление.
+
+    Возвращает кортеж (HTTP-код, обновление); обновление равно None, если код не 200.
+
+    Параметры:
+    headers - заголовки запроса
+    body - тело запроса (bytes)
+    secret - секретный токен webhook (bytes)
+    """
+    if not hmac.compare_digest(headers.get(SECRET_HEADER, '').encode('utf-8'), secret):
+        return 403, None
+    try:
+        update = types.Update.de_json(body.decode('utf-8'))
+    except (ValueError, KeyError, TypeError):
+        return 400, None
+    if update is None:
+        return 400, None
+    return 200, update
+
+
+class WebhookServer:
+    """HTTP-сервер, принимающий обновления от Telegram (режим webhook вместо long polling).
+
+    Каждый POST-запрос на путь path должен содержать JSON одного обновления и заголовок
+    X-Telegram-Bot-Api-Secret-Token с секретным токеном, указанным при установке webhook.
+    Обновления передаются в обработчики telebot.TeleBot так же, как при long polling.
+
+    Запросы обрабатываются параллельно в потоках сервера, а обновления передаются боту
+    одним потоком-диспетчером через очередь в порядке получения: иначе потоки сервера
+    могли бы передать обновления одного игрока в бот не в том порядке, в котором они пришли.
+    """
+    def __init__(self, tgbot, secret, host='0.0.0.0', port=8443, path='/'):
+        """Создаёт сервер.
+
+        Параметры:
+        tgbot - бот (telebot.TeleBot), обработчикам которого передаются обновления
+        secret - секретный токен webhook
+        host, port - адрес, на котором сервер принимает запросы
+        path - путь, на который Telegram отправляет обновления
+        """
+        if not secret:
+            raise Exception('Для режима webhook нужен секретный токен.')
+        self.tgbot = tgbot
+        self.secret = secret.encode('utf-8')
+        self.path = path
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.updates = queue.Queue()  # полученные обновления, ещё не переданные боту
+        self.dispatcher = None
+        self.thread = None
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.send_response(server.handle(self.path, self.headers, self.rfile))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass  # не выводим в консоль каждый запрос
+
+        return Handler
+
+    def handle(self, path, headers, body):
+        """Обрабатывает запрос и возвращает HTTP-код ответа."""
+        if path != self.path:
+            return 404
+        try:
+            length = int(headers.get('Content-Length', 0))
+        except ValueError:
+            return 400
+        status, update = parse_update(headers, body.read(length), self.secret)
+        if update is None:
+            return status
+        # обновление обрабатывается диспетчером, поэтому Telegram получает ответ сразу
+        self.updates.put(update)
+        return 200
+
+    def dispatch(self):
+        """Передаёт обновления из очереди боту по одному, пока не будет получен None."""
+        while True:
+            update = self.updates.get()
+            if update is None:
+                break
+            try:
+                self.tgbot.process_new_updates([update])
+            except Exception as e:
+                print(f'Ошибка при обработке обновления {update.update_id}: {e}')
+
+    def get_address(self):
+        """Возвращает кортеж (хост, порт), на котором сервер принимает запросы."""
+        return self.httpd.server_address[:2]
+
+    def serve_forever(self):
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.updates.put(None)
+
+    def start(self):
+        """Запускает сервер в фоновом потоке."""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def send_update(url, update, secret, timeout=10):
+    """Отправляет обновление на webhook так же, как это делает Telegram (для локальной проверки
+    и нагрузочного тестирования). Возвращает HTTP-код ответа.
+
+    Параметры:
+    url - адрес webhook
+    update - обновление в виде словаря (формат Telegram Bot API)
+    secret - секретный токен webhook
+    """
+    request = urllib.request.Request(url, data=json.dumps(update).encode('utf-8'), method='POST',
+                                     headers={'Content-Type': 'application/json', SECRET_HEADER: secret})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
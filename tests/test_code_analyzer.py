@@ -0,0 +1,131 @@
+import os
+import random
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'editor', 'code'))
+
+from code_analyzer import CodeAnalyzer
+
+GAME_CODE = os.path.join(ROOT, 'game', 'Торговые ряды', 'code.scn')
+
+
+def old_get_words(self, code):
+    """Прежняя реализация CodeAnalyzer.get_words (посимвольный проход) - образец для сравнения."""
+    analyzed = []  # список кортежей вида (слово, номер_строки, позиция_последнего_символа_в_тексте, тип)
+    line_number = 1  # номер текущей строки
+    current_word = ''  # текущее исследуемое слово
+    current_type = self.UNKNOWN  # тип текущего исследуемого слова
+
+    symbol = ''
+    for i, symbol in enumerate(code):
+        pos = i+1
+        if symbol == '\r':
+            symbol = self.NEWLINE
+            pos += 1
+        elif symbol == '\n':
+            symbol = self.NEWLINE
+            continue
+        if symbol == self.QUOTE:
+            if current_type == self.STRING:
+                # заканчиваем считывание строки в кавычках
+                analyzed.append((current_word+symbol,
+                               line_number-current_word.count(self.NEWLINE),
+                               pos, current_type))
+                current_word = ''
+                current_type = self.UNKNOWN
+                continue
+            elif current_type != self.COMMENT:
+                # начинаем считывание строки в кавычках
+                current_word = ''
+                current_type = self.STRING
+        elif symbol == self.NEWLINE:
+            line_number += 1
+            if current_type == self.COMMENT:
+                # комментарий прерывается при переходе на следующую строку
+                analyzed.append((current_word+symbol, line_number, pos, current_type))
+                current_word = ''
+                current_type = self.UNKNOWN
+                continue
+        elif symbol == self.EXCLAM:
+            if current_type != self.STRING and current_type != self.COMMENT:
+                # начинается комментарий
+                current_word = ''
+                current_type = self.COMMENT
+        if current_type == self.KEYWORD and symbol != self.NEWLINE and\
+           symbol != self.SPACE and symbol != self.COLON:
+            # если после ввода ключевого слова пользователь ввёл что-то, кроме
+            # пробела или перевода строки, ключевое слово теряется
+            current_word, _, _, _ = analyzed[-1]
+            del analyzed[-1]
+        if current_type == self.KEYWORD:
+            current_type = self.UNKNOWN
+        if current_type == self.UNKNOWN and (symbol == self.NEWLINE or symbol == self.SPACE):
+            current_word = ''
+        else:
+            current_word += symbol
+        if current_word in self.KWORDS:
+            current_type = self.KEYWORD
+            analyzed.append((current_word, line_number, pos, current_type))
+            current_word = ''
+    if current_type == self.STRING or current_type == self.COMMENT:
+        analyzed.append((current_word, line_number-current_word.count(self.NEWLINE), pos, current_type))
+
+    completion = ''
+    return analyzed, completion
+
+
+class GetWordsTest(unittest.TestCase):
+    """CodeAnalyzer.get_words на регулярном выражении должен разбирать код так же,
+    как прежний посимвольный проход."""
+
+    def setUp(self):
+        self.analyzer = CodeAnalyzer()
+
+    def assertSameWords(self, code):
+        self.assertEqual(self.analyzer.get_words(code), old_get_words(self.analyzer, code), repr(code))
+
+    def test_game_code(self):
+        with open(GAME_CODE, encoding='utf-8', newline='') as f:
+            code = f.read()
+        lf_code = code.replace('\r\n', '\n')
+        self.assertSameWords(code)
+        self.assertSameWords(lf_code)
+        self.assertSameWords(lf_code.replace('\n', '\r\n'))
+
+    def test_edge_cases(self):
+        cases = [
+            '',
+            '"незакрытая строка',
+            'сцена "незакрытая\r\n строка',
+            '"а" -- "б"',
+            '"а"--"б"',
+            '--',
+            '-- --',
+            '! комментарий',
+            '! комментарий\r\nтекст "а"',
+            'текст "строка ! не комментарий"',
+            '! комментарий "с кавычками"\r\n"строка"',
+            'текст! комментарий сразу после ключевого слова',
+            'бот "1:a":\r\n    сцена "а":\r\n    конецСцены\r\nконецБота',
+            'бот "1:a":\n    сцена "а":\n    конецСцены\nконецБота',
+            'сценаx "а":',
+            'кнопки "выбор":\r\n    "да" -- "а"\r\nхватитКнопок',
+            'текст\r',
+            '\r\r\n\n\r',
+            'ждатьТекст:\r\n    *"да" -- "а"\r\n    иначе -- "б"\r\nхватитЖдать',
+        ]
+        for code in cases:
+            self.assertSameWords(code)
+
+    def test_random_code(self):
+        parts = list(CodeAnalyzer.KWORDS) + ['"', '!', '--', ':', ' ', '\r\n', '\n', '\r', 'а', 'б', 'x', '*']
+        generator = random.Random(7)
+        for _ in range(3000):
+            code = ''.join(generator.choice(parts) for _ in range(generator.randint(1, 30)))
+            self.assertSameWords(code)
+
+
+if __name__ == '__main__':
+    unittest.main()
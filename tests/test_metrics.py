@@ -0,0 +1,46 @@
+import os
+import re
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'editor', 'code'))
+
+import metrics
+
+SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})? \S+$')
+# окончания значений, которые относятся к метрике типа (см. текстовый формат Prometheus)
+SUFFIXES = {'counter': [''], 'gauge': [''], 'histogram': ['_bucket', '_sum', '_count']}
+
+
+class MetricsTest(unittest.TestCase):
+    def test_exposition(self):
+        # каждое значение относится к метрике, объявленной строками HELP и TYPE перед ним
+        metrics.GAMES.inc('started')
+        metrics.SEND_SECONDS.observe(0.2, 'TextPost')
+        name = metric_type = None
+        for line in metrics.render().splitlines():
+            if line.startswith('# HELP '):
+                name = line.split()[2]
+            elif line.startswith('# TYPE '):
+                _, _, type_name, metric_type = line.split()
+                self.assertEqual(type_name, name)
+                if metric_type == 'counter':
+                    self.assertTrue(name.endswith('_total'), name)
+            else:
+                match = SAMPLE_RE.match(line)
+                self.assertIsNotNone(match, line)
+                self.assertIn(match.group(1), [name + suffix for suffix in SUFFIXES[metric_type]])
+
+    def test_counter(self):
+        counter = metrics.Counter('test_events_total', 'События.', 'event')
+        metrics.REGISTRY.remove(counter)
+        counter.inc('a')
+        counter.inc('a', 2)
+        self.assertEqual(counter.render(), ['# HELP test_events_total События.',
+                                            '# TYPE test_events_total counter',
+                                            'test_events_total{event="a"} 3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
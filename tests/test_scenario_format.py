@@ -0,0 +1,157 @@
+import os
+import pickle
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'editor', 'code'))
+
+import scenario_format
+from bot_message import *
+
+
+def describe(first_post):
+    """Возвращает описание сценария, не зависящее от объектов: посты с содержимым и переходы
+    с номерами постов."""
+    posts = scenario_format.collect_posts(first_post)
+    numbers = {id(post): i for i, post in enumerate(posts)}
+    result = []
+    for post in posts:
+        content = post.content
+        if isinstance(post, ButtonsPost):
+            content = [(button.text, button.callback_data) for button in content]
+        elif isinstance(post, GroupPost):
+            content = [numbers[id(item)] for item in content]
+        transitions = []
+        for transition in post.transitions:
+            if isinstance(transition, ButtonTransition):
+                transitions.append((numbers[id(transition.next_post)],
+                                    post.content.index(transition.requiered_button)))
+            else:
+                transitions.append((numbers[id(transition.next_post)], transition.requiered_callback,
+                                    transition.is_keyword, transition.forms))
+        result.append((type(post).__name__, post.get_id(), content, getattr(post, 'caption', None),
+                       getattr(post, 'width', None), transitions))
+    return result
+
+
+class ScenarioFormatTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.res = os.path.join(self.tmp.name, 'res')
+        os.mkdir(self.res)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_file(self, name):
+        path = os.path.join(self.res, name)
+        with open(path, 'wb') as f:
+            f.write(b'0')
+        return path
+
+    def make_scenario(self):
+        """Сценарий со всеми видами постов и переходов."""
+        start = TextPost('Начало')
+        image = ImagePost(self.make_file('a.jpg'))
+        same_image = ImagePost(image.content)
+        voice = VoicePost(self.make_file('b.ogg'))
+        round_post = RoundPost(self.make_file('c.mp4'), width=240, convert=False)
+        group = GroupPost([TextPost('Подпись'), ImagePost(image.content), VideoPost(round_post.content)])
+        buttons = ButtonsPost('Выберите', [Button('Да'), Button('Нет')])
+        end = TextPost('Конец')
+        posts = [start, image, same_image, voice, round_post, group, buttons, end]
+        for i, post in enumerate(posts):
+            post.scene, post.index = 'сцена', i
+        start.add_next(image)
+        image.add_next(same_image, 'кот', True).forms = ['кот', 'кота']
+        image.add_next(voice, Transition.SEND_ELSE, False)
+        same_image.add_next(round_post, 'да', False)
+        voice.add_next(group)
+        round_post.add_next(buttons)
+        group.add_next(buttons)
+        for i, button in enumerate(buttons.content):
+            button.set_id('сцена', 6, i)
+        buttons.add_next(end, buttons.content[0])
+        buttons.add_next(start, buttons.content[1])
+        return start
+
+    def test_round_trip(self):
+        start = self.make_scenario()
+        data = scenario_format.dump('token', start, self.res)
+        token, loaded = scenario_format.load(data, self.res)
+        self.assertEqual(token, 'token')
+        self.assertEqual(describe(loaded), describe(start))
+        # файлы загружаются по полным путям, одинаковые пути - одним объектом
+        images = [post for post in scenario_format.collect_posts(loaded) if isinstance(post, ImagePost)]
+        self.assertEqual(images[0].content, os.path.join(self.res, 'a.jpg'))
+        self.assertIs(images[0].content, images[1].content)
+        # кнопки после загрузки совпадают с кнопками переходов
+        buttons = [post for post in scenario_format.collect_posts(loaded) if isinstance(post, ButtonsPost)][0]
+        self.assertIs(buttons.get_next(buttons.content[1].callback_data), loaded)
+        self.assertEqual(scenario_format.dump(token, loaded, self.res), data)
+
+    def test_smaller_than_pickle(self):
+        start = self.make_scenario()
+        self.assertLess(len(scenario_format.dump('token', start, self.res)),
+                        len(pickle.dumps(['token', start])))
+
+    def test_load_token(self):
+        path = os.path.join(self.tmp.name, 'obj.bin')
+        with open(path, 'wb') as f:
+            f.write(scenario_format.dump('token', self.make_scenario(), self.res))
+        self.assertEqual(scenario_format.load_token(path), 'token')
+        with open(path, 'wb') as f:
+            pickle.dump(['old token', TextPost('Начало')], f)
+        self.assertEqual(scenario_format.load_token(path), 'old token')
+
+    def test_deep_scenario(self):
+        # рекурсивный pickle такого сценария упирается в ограничение глубины рекурсии
+        start = post = TextPost('0')
+        for i in range(1, 20000):
+            post = post.add_next(TextPost(str(i)), 'дальше', True).next_post
+        token, loaded = scenario_format.load(scenario_format.dump('token', start, self.res), self.res)
+        for i in range(20000):
+            self.assertEqual(loaded.content, str(i))
+            loaded = loaded.transitions[0].next_post if loaded.transitions else None
+        self.assertIsNone(loaded)
+
+    def test_other_drive(self):
+        # путь, который нельзя сделать относительным, сохраняется полностью
+        start = self.make_scenario()
+        relpath = os.path.relpath
+
+        def failing_relpath(path, start=os.curdir):
+            if path.endswith('b.ogg'):
+                raise ValueError('path is on mount \'D:\', start on mount \'C:\'')
+            return relpath(path, start)
+
+        os.path.relpath = failing_relpath
+        try:
+            data = scenario_format.dump('token', start, self.res)
+        finally:
+            os.path.relpath = relpath
+        other_res = os.path.join(self.tmp.name, 'other')
+        _, loaded = scenario_format.load(data, other_res)
+        paths = {post.content for post in scenario_format.collect_posts(loaded)
+                 if isinstance(post, (ImagePost, VoicePost))}
+        self.assertEqual(paths, {os.path.join(other_res, 'a.jpg'), os.path.join(self.res, 'b.ogg')})
+
+    def test_version(self):
+        data = bytearray(scenario_format.dump('token', self.make_scenario(), self.res))
+        data[len(scenario_format.MAGIC)] = scenario_format.VERSION + 1
+        with self.assertRaises(Exception):
+            scenario_format.load(bytes(data), self.res)
+
+    def test_old_pickle(self):
+        # проекты, собранные старой версией, читаются как обычный pickle
+        path = os.path.join(self.tmp.name, 'obj.bin')
+        with open(path, 'wb') as f:
+            pickle.dump(['token', TextPost('Начало')], f)
+        token, start = scenario_format.load_file(path, self.res)
+        self.assertEqual((token, start.content), ('token', 'Начало'))
+
+
+if __name__ == '__main__':
+    unittest.main()
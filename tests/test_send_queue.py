@@ -0,0 +1,63 @@
+import asyncio
+import os
+import sys
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'editor', 'code'))
+
+from send_queue import TokenBucket, SendQueue, AsyncSendQueue
+
+# частые отправки, чтобы тесты шли быстро; пачка в чат - как у Telegram
+LIMITS = {'global_rate': 1000, 'chat_rate': 50, 'chat_burst': 3}
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_cost_above_capacity(self):
+        # действие дороже ёмкости ведра выполняется, когда ведро полно, и уводит его в минус
+        bucket = TokenBucket(rate=1, capacity=3)
+        now = bucket.time
+        self.assertEqual(bucket.delay(now, 10), 0)
+        bucket.take(now, 10)
+        self.assertEqual(bucket.delay(now, 1), 8)
+        self.assertEqual(bucket.delay(now + 10, 10), 0)
+
+    def test_cost_within_capacity(self):
+        bucket = TokenBucket(rate=2, capacity=3)
+        now = bucket.time
+        bucket.take(now, 3)
+        self.assertEqual(bucket.delay(now, 2), 1)
+
+
+class SendQueueTest(unittest.TestCase):
+    def test_group_above_burst(self):
+        # группа из 10 файлов (стоимость больше CHAT_BURST) не блокирует чат навсегда
+        queue = SendQueue(workers=2, **LIMITS)
+        sent = []
+        done = threading.Event()
+        queue.put(1, lambda: 'group', callback=lambda message, error: sent.append(message), cost=10)
+        queue.put(1, lambda: 'text', callback=lambda message, error: (sent.append(message), done.set()))
+        self.assertTrue(done.wait(5))
+        self.assertTrue(queue.join(5))
+        self.assertEqual(sent, ['group', 'text'])
+
+    def test_async_group_above_burst(self):
+        sent = []
+
+        async def send(message):
+            return message
+
+        async def main():
+            queue = AsyncSendQueue(**LIMITS)
+            queue.put(1, lambda: send('group'), callback=lambda message, error: sent.append(message),
+                      cost=10)
+            queue.put(1, lambda: send('text'), callback=lambda message, error: sent.append(message))
+            await asyncio.wait_for(queue.join(), 5)
+
+        asyncio.run(main())
+        self.assertEqual(sent, ['group', 'text'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'editor', 'code'))
+
+import sessions
+from bot_message import *
+
+
+class FailingConnection:
+    """Соединение с базой, в котором любая запись завершается ошибкой."""
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.db.__exit__(*exc_info)
+
+    def executemany(self, sql, rows):
+        raise sqlite3.OperationalError('disk I/O error')
+
+
+class ManualStore(sessions.SqliteSessionStore):
+    FLUSH_INTERVAL = 1000  # изменения записываются только вызовом flush и при закрытии
+
+
+class FastStore(sessions.SqliteSessionStore):
+    FLUSH_INTERVAL = 0.05
+
+
+class SqliteSessionStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'sessions.db')
+        self.start = TextPost('Начало')
+        self.next = self.start.add_next(TextPost('Дальше')).next_post
+        for i, post in enumerate([self.start, self.next]):
+            post.scene, post.index = 'сцена', i
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assertSaved(self, user_id, session):
+        store = ManualStore(self.path, self.start)
+        try:
+            self.assertEqual(store.get(user_id), session)
+        finally:
+            store.close()
+
+    def test_flush_failure_keeps_changes(self):
+        store = ManualStore(self.path, self.start)
+        db = store.db
+        store.db = FailingConnection(db)
+        store.set(1, self.start, 10)
+        store.set(2, self.start, 20)
+        with self.assertRaises(sqlite3.OperationalError):
+            store.flush()
+        # после неудачной записи изменения накапливаются дальше, новые - поверх возвращённых
+        store.set(2, self.next, 21)
+        store.db = db
+        store.close()
+        self.assertSaved(1, (self.start, 10))
+        self.assertSaved(2, (self.next, 21))
+
+    def test_writer_survives_failure(self):
+        store = FastStore(self.path, self.start)
+        db = store.db
+        store.db = FailingConnection(db)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            store.set(1, self.next, 10)
+            time.sleep(0.3)
+        self.assertTrue(store.thread.is_alive())
+        self.assertIn('disk I/O error', output.getvalue())
+        store.db = db
+        time.sleep(0.3)
+        self.assertEqual(store.pending, {})
+        store.close()
+        self.assertSaved(1, (self.next, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()